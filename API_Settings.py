@@ -6,14 +6,19 @@
 
 import os
 import logging
+from types import MappingProxyType
 from dotenv import load_dotenv
 
+from caching import VersionedCache
+
 load_dotenv()
 # =============================================================================
 # PRIMARY API KEYS (Main Configuration)
 # =============================================================================
 # Add your API keys here - these are the primary keys used by the system
-
+# (environment variables take precedence)
+GOOGLE_API_KEY = ""
+OPENAI_API_KEY = ""
 
 # =============================================================================
 # AI SERVICE CONFIGURATION
@@ -27,6 +32,8 @@ DEFAULT_GOOGLE_MODEL = "gemini-1.5-flash"
 DEFAULT_OPENAI_MODEL = "gpt-4.1-nano"
 
 # Available models for each service
+#   max_tokens     - longest completion the model can produce
+#   context_tokens - context window (prompt + completion)
 AI_MODELS = {
     'google': {
         'default': 'gemini-1.5-flash',
@@ -34,17 +41,20 @@ AI_MODELS = {
             'gemini-1.5-flash': {
                 'name': 'Gemini 1.5 Flash (Fast)',
                 'description': 'Quick responses with good quality',
-                'max_tokens': 8192
+                'max_tokens': 8192,
+                'context_tokens': 1048576
             },
             'gemini-1.5-pro': {
                 'name': 'Gemini 1.5 Pro (Advanced)', 
                 'description': 'Most capable Gemini model for complex tasks',
-                'max_tokens': 32768
+                'max_tokens': 32768,
+                'context_tokens': 2097152
             },
             'gemini-pro': {
                 'name': 'Gemini Pro (Standard)',
                 'description': 'Reliable performance for most tasks',
-                'max_tokens': 4096
+                'max_tokens': 4096,
+                'context_tokens': 32760
             }
         }
     },
@@ -54,27 +64,113 @@ AI_MODELS = {
             'gpt-4.1-nano': {
                 'name': 'GPT-4.1 Nano (Fast & Efficient)',
                 'description': 'Best for quick analysis and cost-effective processing',
-                'max_tokens': 16384
+                'max_tokens': 16384,
+                'context_tokens': 1047576
             },
             'gpt-4o': {
                 'name': 'GPT-4o (Advanced)',
                 'description': 'Most capable model for complex analysis', 
-                'max_tokens': 4096
+                'max_tokens': 4096,
+                'context_tokens': 128000
             },
             'gpt-4-turbo': {
                 'name': 'GPT-4 Turbo (Balanced)',
                 'description': 'Good balance of capability and speed',
-                'max_tokens': 4096
+                'max_tokens': 4096,
+                'context_tokens': 128000
             },
             'gpt-3.5-turbo': {
                 'name': 'GPT-3.5 Turbo (Basic)',
                 'description': 'Basic analysis capabilities, fastest response',
-                'max_tokens': 4096
+                'max_tokens': 4096,
+                'context_tokens': 16385
             }
         }
     }
 }
 
+# =============================================================================
+# TOKEN BUDGETS
+# =============================================================================
+# Completion tokens requested per call (capped by the model's max_tokens)
+AI_COMPLETION_TOKENS = 2000
+
+# Largest prompt sent to any model, however big its context window -
+# long prompts are slow, and very large inputs go through map-reduce instead
+AI_PROMPT_TOKEN_LIMIT = int(os.getenv('AI_PROMPT_TOKEN_LIMIT', 100000))
+
+# Context window assumed for models not listed in AI_MODELS
+DEFAULT_CONTEXT_TOKENS = 32768
+
+# Chat history sent with each chat turn, newest turns first
+AI_HISTORY_TOKEN_BUDGET = int(os.getenv('AI_HISTORY_TOKEN_BUDGET', 3000))
+
+# =============================================================================
+# PROVIDER RATE LIMITS
+# =============================================================================
+# Applied per (service, model, api key) by ai_resilience before each call.
+# Set these to your account's quota so bursts queue instead of failing with 429s.
+
+PROVIDER_LIMITS = {
+    'google': {
+        'max_concurrent': int(os.getenv('GOOGLE_MAX_CONCURRENT', 8)),
+        'requests_per_minute': int(os.getenv('GOOGLE_RPM', 60)),
+        'tokens_per_minute': int(os.getenv('GOOGLE_TPM', 1000000))
+    },
+    'openai': {
+        'max_concurrent': int(os.getenv('OPENAI_MAX_CONCURRENT', 16)),
+        'requests_per_minute': int(os.getenv('OPENAI_RPM', 500)),
+        'tokens_per_minute': int(os.getenv('OPENAI_TPM', 200000))
+    }
+}
+
+# Callers beyond this many waiting per provider are turned away immediately
+ADMISSION_MAX_QUEUE = int(os.getenv('AI_ADMISSION_MAX_QUEUE', 100))
+# Longest a request waits for a provider slot before giving up (seconds)
+ADMISSION_TIMEOUT = float(os.getenv('AI_ADMISSION_TIMEOUT', 30))
+
+# Circuit breaker per provider: once a provider is failing or too slow, traffic
+# goes straight to the fallback service until a probe request succeeds again
+CIRCUIT_BREAKER_SETTINGS = {
+    'window_seconds': 60,              # outcomes older than this are forgotten
+    'min_requests': 5,                 # don't judge a provider on fewer calls than this
+    'error_rate_threshold': 0.5,       # open when this share of calls fail...
+    'slow_call_seconds': float(os.getenv('AI_SLOW_CALL_SECONDS', 30)),
+    'slow_rate_threshold': 0.5,        # ...or this share are slower than slow_call_seconds
+    'open_seconds': 30                 # wait this long before sending a half-open probe
+}
+
+# =============================================================================
+# TIMEOUTS, RETRIES AND HEDGING
+# =============================================================================
+# Per-endpoint call policy for make_ai_call. Endpoints not listed use 'default'.
+#   connect_timeout / read_timeout - seconds (Gemini only supports one overall deadline,
+#                                    so read_timeout is used for it)
+#   max_retries   - extra attempts for timeouts, 429s and 5xx, with jittered backoff
+#   hedge         - if the provider is slower than its recent p95, also ask the
+#                   fallback provider and use whichever answers first
+
+AI_CALL_POLICIES = {
+    'default': {
+        'connect_timeout': float(os.getenv('AI_CONNECT_TIMEOUT', 10)),
+        'read_timeout': float(os.getenv('AI_READ_TIMEOUT', 60)),
+        'max_retries': int(os.getenv('AI_MAX_RETRIES', 2)),
+        'hedge': os.getenv('AI_HEDGING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    },
+    # Interactive chat: fail fast, users are waiting on the page
+    'chat': {'connect_timeout': 5, 'read_timeout': 45, 'max_retries': 1},
+    # Long dataset prompts legitimately take a while
+    'interpret_data': {'read_timeout': 120, 'max_retries': 1}
+}
+
+# Backoff between retries: random in [0, min(max, base * 2**attempt)] seconds
+AI_RETRY_BASE_DELAY = 0.5
+AI_RETRY_MAX_DELAY = 8.0
+
+# Hedge delay before enough latency samples exist, and its floor afterwards (seconds)
+AI_HEDGE_DEFAULT_DELAY = 15.0
+AI_HEDGE_MIN_DELAY = 2.0
+
 # =============================================================================
 # API CONFIGURATION FUNCTIONS
 # =============================================================================
@@ -114,6 +210,17 @@ def get_model_info(service, model_id):
         return AI_MODELS[service]['models'][model_id]
     return None
 
+def get_completion_budget(service, model_id):
+    """Completion tokens to request from a model"""
+    info = get_model_info(service, model_id) or {}
+    return min(AI_COMPLETION_TOKENS, info.get('max_tokens', AI_COMPLETION_TOKENS))
+
+def get_prompt_budget(service, model_id):
+    """Most tokens a prompt (system prompt included) may take for a model"""
+    info = get_model_info(service, model_id) or {}
+    context_tokens = info.get('context_tokens', DEFAULT_CONTEXT_TOKENS)
+    return min(AI_PROMPT_TOKEN_LIMIT, context_tokens - get_completion_budget(service, model_id))
+
 def get_available_models(service):
     """Get list of available models for a service"""
     if service in AI_MODELS:
@@ -125,11 +232,23 @@ def is_service_available(service):
     api_key = get_api_key(service)
     return api_key is not None and len(api_key.strip()) > 10
 
-def get_ai_config():
-    """Get complete AI configuration with Google priority fallback system"""
-    google_available = is_service_available('google')
-    openai_available = is_service_available('openai')
-    
+# get_ai_config() snapshots, built once per API-key environment. Saving
+# /api/system-settings bumps the version so every worker rebuilds.
+ai_config_cache = VersionedCache('ai_config')
+
+def _freeze(value):
+    """Read-only copy of nested dicts/lists so cached snapshots can be shared safely"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def _env_fingerprint():
+    return (os.getenv('GOOGLE_API_KEY'), os.getenv('OPENAI_API_KEY'))
+
+def _build_ai_config(google_available, openai_available, google_healthy, openai_healthy):
+    """Build the AI configuration for one combination of key availability and provider health"""
     # Priority logic: Google first, OpenAI as fallback
     if google_available:
         primary_service = 'google'
@@ -140,24 +259,65 @@ def get_ai_config():
     else:
         primary_service = 'google'  # Default, will use test mode
         fallback_service = None
+    default_service = primary_service
+    
+    # Health-aware routing: while the primary's circuit is open, send traffic
+    # to the fallback first instead of waiting for the primary to fail again
+    healthy = {'google': google_healthy, 'openai': openai_healthy}
+    if fallback_service and not healthy[primary_service] and healthy[fallback_service]:
+        primary_service, fallback_service = fallback_service, primary_service
     
-    return {
-        'default_service': primary_service,
+    return _freeze({
+        'default_service': default_service,
         'primary_service': primary_service,
         'fallback_service': fallback_service,
         'available_services': [primary_service] + ([fallback_service] if fallback_service else []),
         'google': {
             'available': google_available,
+            'healthy': google_healthy,
             'default_model': get_default_model('google'),
             'models': get_available_models('google')
         },
         'openai': {
             'available': openai_available,
+            'healthy': openai_healthy,
             'default_model': get_default_model('openai'),
             'models': get_available_models('openai')
         }
-    }
-    return issues
+    })
+
+def get_ai_config():
+    """Get complete AI configuration with Google priority fallback system
+
+    Returns a shared read-only snapshot. Key availability is resolved once per
+    API-key environment; only provider health is checked on each call.
+    """
+    fingerprint = _env_fingerprint()
+    snapshots = ai_config_cache.get(fingerprint)
+    if snapshots is None:
+        generation = ai_config_cache.generation()
+        snapshots = {
+            'available': (is_service_available('google'), is_service_available('openai')),
+            'variants': {}
+        }
+        ai_config_cache.set(fingerprint, snapshots, generation)
+    
+    from ai_resilience import circuit_breakers
+    health = (circuit_breakers.is_available('google'), circuit_breakers.is_available('openai'))
+    config = snapshots['variants'].get(health)
+    if config is None:
+        config = snapshots['variants'][health] = _build_ai_config(*snapshots['available'], *health)
+    return config
+
+def reload_ai_config():
+    """Drop cached AI configuration in every worker (call after changing settings or keys)"""
+    ai_config_cache.bump()
+
+def get_ai_call_policy(endpoint=None):
+    """Timeout/retry/hedge policy for an endpoint, merged over the default"""
+    policy = dict(AI_CALL_POLICIES['default'])
+    policy.update(AI_CALL_POLICIES.get(endpoint, {}))
+    return policy
 
 def get_fallback_service():
     """Get a fallback service if the default one is not available"""
@@ -0,0 +1,275 @@
+# =============================================================================
+# AI RESPONSE CACHE - LAILA Platform
+# =============================================================================
+# Exact-match cache for AI responses. A whole class often sends the same
+# vignette or dataset, so identical (service, model, system prompt, prompt,
+# temperature) requests are answered from memory or from a small SQLite file
+# instead of calling the provider again.
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from caching import TTLCache
+from model.database import get_connection
+
+# =============================================================================
+# CACHE SETTINGS
+# =============================================================================
+
+AI_CACHE_DB_PATH = os.getenv('AI_CACHE_DB_PATH', 'db/ai_response_cache.db')
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', 7 * 24 * 3600))  # seconds
+AI_CACHE_MAX_MEMORY_ENTRIES = 512
+AI_CACHE_MAX_DISK_ENTRIES = 20000
+
+# Disk pruning runs at most once per this many stores
+PRUNE_EVERY = 200
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + SQLite) cache of AI responses with TTL expiry"""
+
+    def __init__(self, db_path=AI_CACHE_DB_PATH, ttl=AI_CACHE_TTL,
+                 max_memory_entries=AI_CACHE_MAX_MEMORY_ENTRIES,
+                 max_disk_entries=AI_CACHE_MAX_DISK_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self._memory = TTLCache(ttl=ttl, max_size=max_memory_entries)
+        self._schema_ready = False
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.errors = 0
+
+    @staticmethod
+    def make_key(service, model, system_prompt, prompt, temperature=None):
+        """Stable hash of everything that determines the provider's answer"""
+        payload = json.dumps(
+            [service, model, system_prompt or '', prompt, temperature],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _connect(self):
+        conn = get_connection(self.db_path)
+        if not self._schema_ready:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS ai_response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    service TEXT,
+                    model TEXT,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    hit_count INTEGER DEFAULT 0
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_ai_response_cache_expires ON ai_response_cache(expires_at)')
+            conn.commit()
+            self._schema_ready = True
+        return conn
+
+    def get(self, key):
+        """Return (response, model) for a key, or None on a miss"""
+        cached = self._memory.get(key)
+        if cached is not None:
+            with self._lock:
+                self.memory_hits += 1
+            return cached
+
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    'SELECT response, model, expires_at FROM ai_response_cache WHERE cache_key = ?',
+                    (key,)
+                ).fetchone()
+                if row and row[2] > time.time():
+                    conn.execute('UPDATE ai_response_cache SET hit_count = hit_count + 1 WHERE cache_key = ?', (key,))
+                    conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"⚠️ AI cache read failed: {e}")
+            row = None
+
+        if row and row[2] > time.time():
+            value = (row[0], row[1])
+            # Promote to memory for the rest of its lifetime
+            self._memory.set(key, value, ttl=row[2] - time.time())
+            with self._lock:
+                self.disk_hits += 1
+            return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, response, model, service=None):
+        """Store a provider response in both tiers"""
+        if not response:
+            return
+        self._memory.set(key, (response, model))
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute('''
+                    INSERT OR REPLACE INTO ai_response_cache
+                    (cache_key, service, model, response, created_at, expires_at, hit_count)
+                    VALUES (?, ?, ?, ?, ?, ?, 0)
+                ''', (key, service, model, response, now, now + self.ttl))
+                conn.commit()
+                with self._lock:
+                    self.stores += 1
+                    prune = self.stores % PRUNE_EVERY == 0
+                if prune:
+                    self._prune(conn, now)
+            finally:
+                conn.close()
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"⚠️ AI cache write failed: {e}")
+
+    def _prune(self, conn, now):
+        """Drop expired rows, then the oldest rows beyond max_disk_entries"""
+        conn.execute('DELETE FROM ai_response_cache WHERE expires_at <= ?', (now,))
+        conn.execute('''
+            DELETE FROM ai_response_cache WHERE cache_key IN (
+                SELECT cache_key FROM ai_response_cache
+                ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_disk_entries,))
+        conn.commit()
+
+    def clear(self):
+        """Empty both tiers"""
+        self._memory.clear()
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM ai_response_cache')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Hit/miss counters for each tier"""
+        disk_entries = None
+        try:
+            conn = self._connect()
+            try:
+                disk_entries = conn.execute('SELECT COUNT(*) FROM ai_response_cache').fetchone()[0]
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"⚠️ AI cache stats failed: {e}")
+
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory': self._memory.stats(),
+                'disk_entries': disk_entries,
+                'max_disk_entries': self.max_disk_entries,
+                'ttl': self.ttl,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                'stores': self.stores,
+                'errors': self.errors
+            }
+
+
+# Shared cache used by make_ai_call and the analysis endpoints
+ai_response_cache = ResponseCache()
+
+
+# =============================================================================
+# REQUEST COALESCING
+# =============================================================================
+
+# Longest a caller waits on someone else's in-flight request before giving up
+AI_INFLIGHT_TIMEOUT = 120  # seconds
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one in-flight call
+
+    The first caller (the leader) runs the function; callers arriving while it
+    runs wait for its result instead of starting their own. A waiter that
+    times out gives up on its own without affecting the leader or the other
+    waiters.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, timeout=AI_INFLIGHT_TIMEOUT):
+        """Run fn() once per key at a time and return its result to every caller"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _InFlightCall()
+                self.leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+        else:
+            self._wait(call, timeout)
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _wait(self, call, timeout):
+        if not call.done.wait(timeout):
+            with self._lock:
+                call.waiters -= 1
+                self.timeouts += 1
+            raise TimeoutError(f"In-flight AI request did not finish within {timeout}s")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'waiting': sum(call.waiters for call in self._calls.values()),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts
+            }
+
+
+# Shared coalescer for cacheable AI calls
+ai_inflight = SingleFlight()
@@ -0,0 +1,207 @@
+# =============================================================================
+# AI PROVIDER CLIENT REGISTRY - LAILA Platform
+# =============================================================================
+# Keeps provider clients (and their HTTP connection pools) alive between
+# requests instead of rebuilding them on every chat turn.
+
+import asyncio
+import threading
+from collections import OrderedDict
+
+import httpx
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from openai import OpenAI, AsyncOpenAI
+
+from API_Settings import AI_CALL_POLICIES
+
+# =============================================================================
+# REGISTRY SETTINGS
+# =============================================================================
+
+# Maximum number of cached clients before the least recently used is evicted
+MAX_PROVIDER_CLIENTS = 64
+
+# Keep-alive pool for each OpenAI client
+OPENAI_MAX_CONNECTIONS = 100
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 20
+OPENAI_KEEPALIVE_EXPIRY = 60  # seconds
+
+# Client-wide deadline; individual calls pass their endpoint's timeout.
+# The SDK's own retries are off because ai_resilience retries with jitter.
+OPENAI_DEFAULT_TIMEOUT = httpx.Timeout(
+    AI_CALL_POLICIES['default']['read_timeout'],
+    connect=AI_CALL_POLICIES['default']['connect_timeout']
+)
+
+
+class ProviderClientRegistry:
+    """Thread-safe LRU registry of provider clients keyed by (service, api_key, model, event loop)"""
+
+    def __init__(self, max_clients=MAX_PROVIDER_CLIENTS):
+        self.max_clients = max_clients
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        # genai.configure() mutates module-level state, so building Gemini
+        # clients is serialized separately from registry lookups
+        self._google_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, service, api_key, model):
+        # OpenAI clients are model-agnostic, so one pool serves every model
+        if service in ('openai', 'openai_async'):
+            model = None
+        # Async clients hold connections bound to the event loop that created them
+        loop = None
+        if service in ('openai_async', 'google_async'):
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+        return (service, api_key, model, loop)
+
+    def get(self, service, api_key, model=None):
+        """Return a cached client for the given service, creating it if needed"""
+        key = self._key(service, api_key, model)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return client
+            self.misses += 1
+
+        client = self._build(service, api_key, model)
+
+        evicted = []
+        with self._lock:
+            existing = self._clients.get(key)
+            if existing is not None:
+                # Another thread built the same client first; keep theirs
+                self._clients.move_to_end(key)
+                evicted.append((key, client))
+                client = existing
+            else:
+                self._clients[key] = client
+                while len(self._clients) > self.max_clients:
+                    evicted.append(self._clients.popitem(last=False))
+                    self.evictions += 1
+        for evicted_key, evicted_client in evicted:
+            self._close(evicted_client, evicted_key[3])
+        return client
+
+    def _build(self, service, api_key, model):
+        if service == 'openai':
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+                ),
+                timeout=OPENAI_DEFAULT_TIMEOUT
+            )
+            return OpenAI(api_key=api_key, http_client=http_client,
+                          timeout=OPENAI_DEFAULT_TIMEOUT, max_retries=0)
+
+        if service == 'openai_async':
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+                ),
+                timeout=OPENAI_DEFAULT_TIMEOUT
+            )
+            return AsyncOpenAI(api_key=api_key, http_client=http_client,
+                               timeout=OPENAI_DEFAULT_TIMEOUT, max_retries=0)
+
+        if service in ('google', 'google_async'):
+            with self._google_lock:
+                genai.configure(api_key=api_key)
+                model_instance = genai.GenerativeModel(model)
+                # Bind the transport now so later genai.configure() calls for
+                # other keys cannot swap it out from under this model
+                if service == 'google_async':
+                    # gRPC aio channels belong to the event loop that creates them
+                    model_instance._async_client = genai_client.get_default_generative_async_client()
+                else:
+                    model_instance._client = genai_client.get_default_generative_client()
+            return model_instance
+
+        raise Exception(f"Unsupported AI service: {service}")
+
+    def _close(self, client, loop=None):
+        """Close a client; an async client's close() is awaited on loop, the one that owns it"""
+        close = getattr(client, 'close', None)
+        if callable(close):
+            try:
+                result = close()
+                if asyncio.iscoroutine(result):
+                    self._await_close(result, loop)
+            except Exception as e:
+                print(f"⚠️ Error closing provider client: {e}")
+
+    def _await_close(self, closing, loop):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is None:
+            loop = running
+        if loop is not None and loop is running:
+            loop.create_task(closing)
+        elif loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(closing, loop)
+        elif running is None:
+            # The owning loop has stopped: release the connections on a loop of our own
+            asyncio.run(closing)
+        else:
+            running.create_task(closing)
+
+    def clear(self):
+        """Close and drop every cached client"""
+        with self._lock:
+            clients = list(self._clients.items())
+            self._clients.clear()
+        for key, client in clients:
+            self._close(client, key[3])
+
+    def stats(self):
+        """Registry size and hit/miss counters"""
+        with self._lock:
+            return {
+                'size': len(self._clients),
+                'max_size': self.max_clients,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+# Shared registry used by every AI call in the app
+client_registry = ProviderClientRegistry()
+
+
+def get_openai_client(api_key):
+    """Get a pooled OpenAI client for an API key"""
+    return client_registry.get('openai', api_key)
+
+
+def get_google_model(api_key, model):
+    """Get a pooled Gemini model bound to an API key"""
+    return client_registry.get('google', api_key, model)
+
+
+def get_async_openai_client(api_key):
+    """Get a pooled AsyncOpenAI client for an API key"""
+    return client_registry.get('openai_async', api_key)
+
+
+def get_async_google_model(api_key, model):
+    """Get a pooled Gemini model whose async transport is bound to an API key
+
+    Must be called from the event loop that will use it.
+    """
+    return client_registry.get('google_async', api_key, model)
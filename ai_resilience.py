@@ -0,0 +1,601 @@
+# =============================================================================
+# AI PROVIDER RESILIENCE - LAILA Platform
+# =============================================================================
+# Admission control in front of the AI providers. Each (service, model,
+# api_key) gets a concurrency cap plus requests- and tokens-per-minute
+# buckets; callers over the limit wait in a bounded queue until a slot frees
+# up or their deadline passes, instead of hitting the provider and getting 429s.
+# Per-provider circuit breakers let traffic skip a provider that is failing,
+# and transient errors are retried with jittered backoff or hedged.
+
+import asyncio
+import hashlib
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+
+from API_Settings import PROVIDER_LIMITS, ADMISSION_MAX_QUEUE, ADMISSION_TIMEOUT, CIRCUIT_BREAKER_SETTINGS
+
+# Completion tokens assumed for a request when charging the tokens-per-minute bucket
+EXPECTED_COMPLETION_TOKENS = 1000
+
+# How often an async caller re-checks for a free concurrency slot (seconds)
+ASYNC_ADMISSION_POLL = 0.05
+
+
+class AdmissionError(Exception):
+    """Raised when a provider call cannot be admitted (queue full or deadline passed)"""
+
+
+def estimate_tokens(*texts):
+    """Rough token count for rate limiting (~4 characters per token)"""
+    return sum(len(text) for text in texts if text) // 4 + 1
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount tokens are available (0 if available now)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class ProviderLimiter:
+    """Concurrency cap + RPM/TPM buckets + bounded wait queue for one provider key"""
+
+    def __init__(self, max_concurrent, requests_per_minute, tokens_per_minute,
+                 max_queue=ADMISSION_MAX_QUEUE):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, tokens=1, timeout=ADMISSION_TIMEOUT):
+        """Block until the call may proceed; raises AdmissionError otherwise"""
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionError(f"Too many requests waiting for this provider ({self.waiting})")
+
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._try_admit(tokens, now)
+                    if wait == 0:
+                        self._record_wait(now - started)
+                        return
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise AdmissionError(f"No provider capacity within {timeout}s")
+                    # Woken early by release() when a concurrency slot frees up
+                    self._cond.wait(remaining if wait is None else min(remaining, wait))
+            finally:
+                self.waiting -= 1
+
+    async def acquire_async(self, tokens=1, timeout=ADMISSION_TIMEOUT):
+        """Coroutine version of acquire() that polls instead of blocking the event loop"""
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionError(f"Too many requests waiting for this provider ({self.waiting})")
+            self.waiting += 1
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    wait = self._try_admit(tokens, now)
+                    if wait == 0:
+                        self._record_wait(now - started)
+                        return
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise AdmissionError(f"No provider capacity within {timeout}s")
+                await asyncio.sleep(min(remaining, ASYNC_ADMISSION_POLL if wait is None else wait))
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+    def _try_admit(self, tokens, now):
+        """Take a slot if one is free (lock held); returns 0 when admitted, else seconds to wait or None"""
+        if self.in_flight >= self.max_concurrent:
+            return None
+        wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+        if wait == 0:
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.in_flight += 1
+        return wait
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            # Wake everyone: the first waiter may still be held back by a bucket
+            self._cond.notify_all()
+
+    def _record_wait(self, waited):
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_wait_sec': round(self.total_wait / self.admitted, 3) if self.admitted else 0.0,
+                'max_wait_sec': round(self.max_wait, 3)
+            }
+
+
+class AdmissionController:
+    """Registry of ProviderLimiters keyed by (service, model, api key hash)"""
+
+    def __init__(self, limits=PROVIDER_LIMITS):
+        self.limits = limits
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(service, model, api_key):
+        # Never keep raw API keys around just for bookkeeping
+        key_hash = hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:12]
+        return (service, model, key_hash)
+
+    def limiter(self, service, model, api_key):
+        key = self._key(service, model, api_key)
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                settings = self.limits.get(service, {})
+                limiter = self._limiters[key] = ProviderLimiter(
+                    max_concurrent=settings.get('max_concurrent', 8),
+                    requests_per_minute=settings.get('requests_per_minute', 60),
+                    tokens_per_minute=settings.get('tokens_per_minute', 100000)
+                )
+            return limiter
+
+    @contextmanager
+    def slot(self, service, model, api_key, tokens=1, timeout=ADMISSION_TIMEOUT):
+        """Hold one provider slot for the duration of the with-block"""
+        limiter = self.limiter(service, model, api_key)
+        limiter.acquire(tokens, timeout)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    @asynccontextmanager
+    async def async_slot(self, service, model, api_key, tokens=1, timeout=ADMISSION_TIMEOUT):
+        """Async with-block counterpart of slot() for the asyncio provider path"""
+        limiter = self.limiter(service, model, api_key)
+        await limiter.acquire_async(tokens, timeout)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def stats(self):
+        with self._lock:
+            limiters = list(self._limiters.items())
+        return [
+            {'service': service, 'model': model, 'key': key_hash, **limiter.stats()}
+            for (service, model, key_hash), limiter in limiters
+        ]
+
+
+# Shared admission controller for every provider call
+admission_controller = AdmissionController()
+
+
+# =============================================================================
+# CIRCUIT BREAKERS
+# =============================================================================
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit is open"""
+
+
+class CircuitBreaker:
+    """Error-rate and latency circuit breaker for one provider
+
+    closed    - calls flow; outcomes within the window are tracked
+    open      - calls are refused until open_seconds have passed
+    half_open - a single probe call is let through; success closes the
+                circuit, failure opens it again
+    """
+
+    def __init__(self, service, window_seconds=60, min_requests=5, error_rate_threshold=0.5,
+                 slow_call_seconds=30, slow_rate_threshold=0.5, open_seconds=30):
+        self.service = service
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate_threshold = slow_rate_threshold
+        self.open_seconds = open_seconds
+
+        self._lock = threading.Lock()
+        self._outcomes = deque()  # (timestamp, succeeded, latency)
+        self.state = CLOSED
+        self.opened_at = None
+        self._probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _trim(self, now):
+        cutoff = now - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._outcomes.popleft()
+
+    def allow_request(self):
+        """True if a call may go to this provider now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def is_available(self):
+        """Non-mutating check used for routing decisions"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.open_seconds
+            return not self._probe_in_flight
+
+    def record_success(self, latency):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                print(f"✅ Circuit for {self.service} closed after successful probe")
+                self._reset()
+                return
+            self._record(True, latency)
+
+    def record_failure(self, latency=None):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._open("probe failed")
+                return
+            self._record(False, latency)
+
+    def record_cancelled(self):
+        """The admitted call ended without an outcome (e.g. client went away); free the probe"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record_error(self, error, latency=None):
+        """Count an error against the provider only if it is transient (timeout, 429, 5xx)
+
+        Other errors (a bad request, an invalid key) say nothing about the
+        provider's health, so they only free the probe.
+        """
+        if is_retryable(error):
+            self.record_failure(latency)
+        else:
+            self.record_cancelled()
+
+    def _record(self, succeeded, latency):
+        now = time.monotonic()
+        self._outcomes.append((now, succeeded, latency))
+        self._trim(now)
+        if self.state != CLOSED or len(self._outcomes) < self.min_requests:
+            return
+        total = len(self._outcomes)
+        errors = sum(1 for _, ok, _ in self._outcomes if not ok)
+        slow = sum(1 for _, _, lat in self._outcomes if lat is not None and lat >= self.slow_call_seconds)
+        if errors / total >= self.error_rate_threshold:
+            self._open(f"{errors}/{total} calls failed")
+        elif slow / total >= self.slow_rate_threshold:
+            self._open(f"{slow}/{total} calls slower than {self.slow_call_seconds}s")
+
+    def _open(self, reason):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self.times_opened += 1
+        print(f"⚠️ Circuit for {self.service} opened: {reason}")
+
+    def _reset(self):
+        self.state = CLOSED
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._outcomes.clear()
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            total = len(self._outcomes)
+            errors = sum(1 for _, ok, _ in self._outcomes if not ok)
+            latencies = [lat for _, ok, lat in self._outcomes if ok and lat is not None]
+            return {
+                'state': self.state,
+                'recent_calls': total,
+                'error_rate': round(errors / total, 3) if total else 0.0,
+                'avg_latency_sec': round(sum(latencies) / len(latencies), 3) if latencies else None,
+                'retry_in_sec': round(max(0.0, self.open_seconds - (now - self.opened_at)), 1) if self.state == OPEN else None,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected
+            }
+
+
+class UntrackedCircuitBreaker:
+    """Stand-in breaker for calls made with a user's own API key
+
+    Those calls must neither be refused because the shared key's provider
+    is failing nor count towards opening the circuit for everyone else.
+    """
+
+    def allow_request(self):
+        return True
+
+    def is_available(self):
+        return True
+
+    def record_success(self, latency):
+        pass
+
+    def record_failure(self, latency=None):
+        pass
+
+    def record_cancelled(self):
+        pass
+
+    def record_error(self, error, latency=None):
+        pass
+
+
+UNTRACKED_BREAKER = UntrackedCircuitBreaker()
+
+
+class CircuitBreakerRegistry:
+    """One CircuitBreaker per provider service"""
+
+    def __init__(self, settings=CIRCUIT_BREAKER_SETTINGS):
+        self.settings = settings
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, service):
+        with self._lock:
+            breaker = self._breakers.get(service)
+            if breaker is None:
+                breaker = self._breakers[service] = CircuitBreaker(service, **self.settings)
+            return breaker
+
+    def for_call(self, service, user_key=False):
+        """The breaker a call should go through: the shared one, or none for a user's own key"""
+        return UNTRACKED_BREAKER if user_key else self.get(service)
+
+    def is_available(self, service):
+        return self.get(service).is_available()
+
+    def snapshot(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {service: breaker.snapshot() for service, breaker in breakers.items()}
+
+
+# Shared breakers consulted by make_ai_call and get_ai_config
+circuit_breakers = CircuitBreakerRegistry()
+
+
+# =============================================================================
+# RETRIES AND HEDGING
+# =============================================================================
+
+# HTTP statuses worth retrying: timeouts, rate limits and transient server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Provider SDK / transport exceptions worth retrying, matched by class name so
+# this module does not need to import every SDK
+RETRYABLE_ERROR_NAMES = {
+    'APITimeoutError', 'APIConnectionError', 'RateLimitError', 'InternalServerError',  # openai
+    'DeadlineExceeded', 'ServiceUnavailable', 'ResourceExhausted', 'TooManyRequests',  # google.api_core
+    'TimeoutException', 'NetworkError',  # httpx
+}
+
+# Recent successful latencies kept per provider for p95-based hedging
+LATENCY_SAMPLES = 200
+MIN_LATENCY_SAMPLES = 20
+
+
+def is_retryable(error):
+    """True for transient provider errors; never for our own admission/circuit refusals"""
+    if isinstance(error, (AdmissionError, CircuitOpenError)):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    if isinstance(status, int) and status in RETRYABLE_STATUS_CODES:
+        return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def call_with_retries(fn, max_retries, base_delay=0.5, max_delay=8.0):
+    """Call fn(), retrying retryable errors up to max_retries times"""
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            attempt += 1
+            print(f"🔁 Retry {attempt}/{max_retries} in {delay:.2f}s after: {e}")
+            time.sleep(delay)
+
+
+async def call_with_retries_async(fn, max_retries, base_delay=0.5, max_delay=8.0):
+    """Await fn(), retrying retryable errors up to max_retries times"""
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            attempt += 1
+            print(f"🔁 Retry {attempt}/{max_retries} in {delay:.2f}s after: {e}")
+            await asyncio.sleep(delay)
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per provider"""
+
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.samples = samples
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, service, latency):
+        with self._lock:
+            window = self._latencies.get(service)
+            if window is None:
+                window = self._latencies[service] = deque(maxlen=self.samples)
+            window.append(latency)
+
+    def percentile(self, service, pct, min_samples=MIN_LATENCY_SAMPLES):
+        """The pct-th percentile latency, or None until min_samples calls were seen"""
+        with self._lock:
+            window = sorted(self._latencies.get(service, ()))
+        if len(window) < min_samples:
+            return None
+        index = min(len(window) - 1, int(round(pct / 100.0 * (len(window) - 1))))
+        return window[index]
+
+    def snapshot(self):
+        with self._lock:
+            services = list(self._latencies)
+        return {
+            service: {
+                'p50_sec': self.percentile(service, 50, min_samples=1),
+                'p95_sec': self.percentile(service, 95, min_samples=1)
+            }
+            for service in services
+        }
+
+
+class Hedger:
+    """Runs a backup request when the first one is slower than expected
+
+    The primary request runs on the calling thread; only backups use the
+    pool, so its size does not cap how many hedged calls are in flight, and
+    the hedge timer starts when the primary really starts. Python threads
+    cannot be cancelled, so whichever request is not used runs to completion
+    and its result is discarded.
+    """
+
+    def __init__(self, max_workers=32):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='laila-hedge')
+        self._lock = threading.Lock()
+        self.fired = 0
+        self.won = 0
+
+    def call(self, primary, backup, hedge_after):
+        """Return primary(), or backup()'s result if primary fails after backup was started at hedge_after seconds"""
+        state = {'finished': False, 'backup': None}
+        state_lock = threading.Lock()
+
+        def start_backup():
+            with state_lock:
+                if state['finished']:
+                    return
+                state['backup'] = self._pool.submit(backup)
+            with self._lock:
+                self.fired += 1
+
+        timer = threading.Timer(hedge_after, start_backup)
+        timer.daemon = True
+        timer.start()
+        try:
+            return primary()
+        except Exception as primary_error:
+            with state_lock:
+                state['finished'] = True
+                second = state['backup']
+            # A fast failure is raised straight away so the caller's own fallback handles it
+            if second is None:
+                raise
+            try:
+                result = second.result()
+            except Exception:
+                raise primary_error
+            with self._lock:
+                self.won += 1
+            return result
+        finally:
+            with state_lock:
+                state['finished'] = True
+            timer.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {'fired': self.fired, 'won': self.won}
+
+
+# Shared latency history and hedger used by make_ai_call
+provider_latency = LatencyTracker()
+hedger = Hedger()
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session, flash, send_from_directory, send_file, render_template_string, abort
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, flash, send_from_directory, send_file, render_template_string, abort, Response, stream_with_context, copy_current_request_context
 from flask_cors import CORS
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -7,32 +7,44 @@ import os
 import sqlite3
 import openai
 import google.generativeai as genai
-from config import get_ai_config, LOGIN_TEMPLATE, ADMIN_ACCESS_DENIED_TEMPLATE, CHAT_SYSTEM_PROMPT, load_system_prompt, list_available_prompts, save_system_prompt
-from API_Settings import  DEFAULT_AI_SERVICE, DEFAULT_GOOGLE_MODEL, DEFAULT_OPENAI_MODEL, is_service_available, get_api_key, get_default_model
+from config import get_ai_config, LOGIN_TEMPLATE, ADMIN_ACCESS_DENIED_TEMPLATE, CHAT_SYSTEM_PROMPT, load_system_prompt, list_available_prompts, save_system_prompt, warm_prompt_cache, is_response_cache_enabled
+from API_Settings import  DEFAULT_AI_SERVICE, DEFAULT_GOOGLE_MODEL, DEFAULT_OPENAI_MODEL, is_service_available, get_api_key, get_default_model, get_ai_call_policy, reload_ai_config, get_prompt_budget, get_completion_budget, AI_HISTORY_TOKEN_BUDGET, AI_RETRY_BASE_DELAY, AI_RETRY_MAX_DELAY, AI_HEDGE_DEFAULT_DELAY, AI_HEDGE_MIN_DELAY
 import bcrypt
 import uuid
 import logging
 from logging.handlers import RotatingFileHandler
 import json
+import base64
 from datetime import datetime, timedelta
 import random
 import time
 import traceback
+import asyncio
 import sys
 import csv
 import pandas as pd
 from dotenv import load_dotenv
+from model.log_writer import log_writer
+from model.schema_migrations import ensure_database_migrated
+from model.database import get_connection
+from model.message_search import message_search_ready, search_messages, SEARCH_PAGE_SIZE
+from model.log_statistics import get_log_statistics
+from model.daily_rollups import daily_rollups
+from caching import VersionedCache
+from token_budget import count_tokens, fit_prompt, trim_history, start_usage, record_usage, take_usage
 
 load_dotenv()
 
 
 # Enhanced logging functions
 
-def log_chat_interaction(user_id, chat_type, message_type, content, context_data=None, ai_model=None, ai_response=None, processing_time=None):
-    """Log chat interactions to central SQLite database - persistent and reliable"""
+def log_chat_interaction(user_id, chat_type, message_type, content, context_data=None, ai_model=None, ai_response=None, processing_time=None, prompt_tokens=None, completion_tokens=None):
+    """Log chat interactions to central SQLite database - persistent and reliable
+    
+    AI response rows record the tokens spent by this request's provider calls
+    unless prompt_tokens/completion_tokens are given.
+    """
     try:
-        import sqlite3
-        
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         chat_id = session.get('chat_id', str(uuid.uuid4()))
         
@@ -59,7 +71,7 @@ def log_chat_interaction(user_id, chat_type, message_type, content, context_data
         essential_context = ""
         if context_data and isinstance(context_data, dict):
             # Keep only research-relevant context
-            research_keys = ['analysis_type', 'research_context', 'target_insights', 'audience_level']
+            research_keys = ['analysis_type', 'research_context', 'target_insights', 'audience_level', 'truncated']
             context_items = []
             for key in research_keys:
                 if key in context_data and context_data[key]:
@@ -77,27 +89,24 @@ def log_chat_interaction(user_id, chat_type, message_type, content, context_data
         ai_model_used = ai_model if message_type == 'ai_response' else ''
         response_time = round(processing_time / 1000, 2) if processing_time and message_type == 'ai_response' else None
         context = essential_context
-
-        # Save to Central SQLite database
-        db_path = 'db/laila_central.db'
-        
-        # Ensure database exists
-        if not os.path.exists(db_path):
-            from model.central_database_setup import create_central_database
-            create_central_database()
-        
-        # Insert into central database
-        conn = sqlite3.connect(db_path)
-        conn.execute('''
-            INSERT INTO chat_logs 
-            (user_id, session_id, timestamp, module, sender, turn, message, ai_model, response_time_sec, context)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, chat_id, timestamp, module, sender, turn, message, ai_model_used, response_time, context))
-        
-        conn.commit()
-        conn.close()
-        
-
+        if message_type == 'ai_response' and prompt_tokens is None and completion_tokens is None:
+            prompt_tokens, completion_tokens = take_usage()
+
+        # Queue for the background writer - the request never waits on SQLite
+        log_writer.submit('chat_logs', {
+            'user_id': user_id,
+            'session_id': chat_id,
+            'timestamp': timestamp,
+            'module': module,
+            'sender': sender,
+            'turn': turn,
+            'message': message,
+            'ai_model': ai_model_used,
+            'response_time_sec': response_time,
+            'context': context,
+            'prompt_tokens': prompt_tokens if message_type == 'ai_response' else None,
+            'completion_tokens': completion_tokens if message_type == 'ai_response' else None
+        })
         
     except Exception as e:
         print(f"Error logging chat interaction to central database: {str(e)}")
@@ -125,6 +134,26 @@ app.config['REMEMBER_COOKIE_SECURE'] = False  # Set to True in production with H
 app.config['REMEMBER_COOKIE_HTTPONLY'] = True
 CORS(app)  # Enable CORS for all routes
 
+# Set once a request has warmed the in-memory caches
+caches_warmed = False
+
+@app.before_request
+def prepare_database():
+    """On the first request, never at import: bring an older database up to date and warm the caches"""
+    global caches_warmed
+    try:
+        if ensure_database_migrated() and not caches_warmed:
+            caches_warmed = True
+            # Serve system prompts from memory from here on
+            warm_prompt_cache()
+    except Exception as e:
+        print(f"⚠️ Database migration failed, retrying on the next request: {e}")
+
+@app.before_request
+def start_token_usage():
+    """Each request meters the tokens its AI calls spend, for chat_logs"""
+    start_usage()
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -140,28 +169,52 @@ class User(UserMixin):
     def get_id(self):
         return str(self.id)
 
+# Users loaded by Flask-Login, keyed by id. Code that changes a user row calls
+# invalidate_user(), which drops the cached users in every worker process.
+user_cache = VersionedCache('users')
+
+def invalidate_user():
+    """Drop cached users here and in every other worker process after a user row changes"""
+    try:
+        user_cache.bump()
+    except Exception as e:
+        print(f"⚠️ Could not invalidate cached users: {e}")
+
+def get_current_user_id():
+    """Database id of the logged-in user, taken from the request's current_user"""
+    return current_user.id if current_user.is_authenticated else None
+
 @login_manager.user_loader
 def load_user(id):
+    cached = user_cache.get(str(id))
+    if cached is not None:
+        return cached
+    generation = user_cache.generation()
     try:
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute('SELECT id, fullname, email, is_admin, is_confirmed FROM users WHERE id = ?', (id,))
         user_data = cursor.fetchone()
         conn.close()
         if user_data:
             id, fullname, email, is_admin, is_confirmed = user_data
-            return User(id, fullname, email, bool(is_admin), bool(is_confirmed))
+            user = User(id, fullname, email, bool(is_admin), bool(is_confirmed))
+            user_cache.set(str(id), user, generation)
+            return user
     except Exception as e:
         print(f"Error loading user: {e}")
     return None
 
 # Import unified API settings with priority fallback
 
-import google.generativeai as genai
-from openai import OpenAI
-
-# Configure Google AI with API key
-genai.configure(api_key=get_api_key('google'))
+from ai_clients import get_openai_client, get_google_model, get_async_openai_client, get_async_google_model
+from ai_cache import ai_response_cache, ai_inflight
+from data_summary import prepare_data_for_prompt
+from jobs import ai_jobs, report_progress as report_job_progress, mark_result_degraded, DONE as JOB_DONE, FAILED as JOB_FAILED
+from chunking import needs_chunking, split_into_chunks, map_reduce
+from conversation_memory import ConversationMemory
+from ai_resilience import admission_controller, circuit_breakers, CircuitOpenError, estimate_tokens, EXPECTED_COMPLETION_TOKENS, call_with_retries, call_with_retries_async, provider_latency, hedger
+import httpx
 
 # --- User Authentication ---
 
@@ -199,7 +252,7 @@ def login():
         
         # Check if user exists in database
         try:
-            conn = sqlite3.connect('db/laila_central.db')
+            conn = get_connection()
             cursor = conn.cursor()
             cursor.execute('SELECT id, fullname, email, password_hash, is_confirmed FROM users WHERE email = ?', (email,))
             user = cursor.fetchone()
@@ -227,6 +280,7 @@ def login():
                 ''', (fullname, email, hashed_password, False, timestamp, False, True))
                 conn.commit()
                 conn.close()
+                invalidate_user()
                 return render_template_string(LOGIN_TEMPLATE, 
                                                 info="Thank you for registering. An administrator will revise your account and grant you access.",
                                                 email=email)
@@ -274,6 +328,8 @@ def login():
                         print(f"⚠️  Warning: Could not update last_login: {e}")
                         # Continue with login even if last_login update fails
                     print(email)
+                    # Start the session from the current database row, not a cached copy
+                    user_cache.invalidate(str(id))
                     user_obj = load_user(id)
                     login_user(user_obj, remember=remember_me)
                     session.permanent = True
@@ -311,35 +367,37 @@ def register():
 @app.route('/logout')
 @login_required
 def logout():
+    if current_user.is_authenticated:
+        user_cache.invalidate(str(current_user.id))
     logout_user()
     session.clear()
     return redirect(url_for('login'))
 
 # --- Missing Logging Functions ---
-def log_user_interaction(user_id, interaction_type=None, page=None, action=None, element_id=None, element_type=None, element_value=None, additional_data=None):
-    """Log user interactions to database"""
+def log_user_interaction(user_id, interaction_type=None, page=None, action=None, element_id=None, element_type=None, element_value=None, additional_data=None, timestamp=None):
+    """Log user interactions to database (timestamp defaults to now)"""
 
     try:
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S') # datetime.now().isoformat()
+        timestamp = timestamp or datetime.now().strftime('%Y-%m-%d %H:%M:%S') # datetime.now().isoformat()
         
         # Use action as interaction_type if provided (for backwards compatibility)
         actual_interaction_type = action if action else interaction_type
         
-        # Save to database
-        conn = sqlite3.connect('db/laila_central.db')
-        cursor = conn.cursor()
-        
-        # Convert additional_data to string if it's a dict
-        additional_data_str = str(additional_data) if additional_data else None
-        
-        cursor.execute('''
-            INSERT INTO user_interactions 
-            (user_id, interaction_type, page, action, element_id, element_type, element_value, timestamp, additional_data)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, actual_interaction_type, page, action, element_id, element_type, element_value, timestamp, additional_data_str))
-        
-        conn.commit()
-        conn.close()
+        # Stored as JSON so it can be returned as-is and queried with SQLite's JSON functions
+        additional_data_str = json.dumps(additional_data, ensure_ascii=False, default=str) if additional_data else None
+        
+        # Queue for the background writer
+        log_writer.submit('user_interactions', {
+            'user_id': user_id,
+            'interaction_type': actual_interaction_type,
+            'page': page,
+            'action': action,
+            'element_id': element_id,
+            'element_type': element_type,
+            'element_value': element_value,
+            'timestamp': timestamp,
+            'additional_data': additional_data_str
+        })
         
         # Also log to console for debugging
         print(f"✅ USER INTERACTION: {timestamp} | {user_id} | {actual_interaction_type} | {page}")
@@ -363,10 +421,122 @@ def log_data_analysis(user_id, analysis_type, input_data, generated_data, ai_mod
         print(f"Error logging data analysis: {e}")
 
 # Unified AI function using API_Settings
-def make_ai_call(prompt, system_prompt=None, service=None, model=None, user_api_key=None):
+def request_ai_provider(service, model, api_key, prompt, system_prompt=None, temperature=None, policy=None):
+    """Send one prompt to a provider and return the response text"""
+    policy = policy or get_ai_call_policy()
+    if service == 'google':
+        # Reuse the pooled Gemini model for this key
+        model_instance = get_google_model(api_key, model)
+        if system_prompt:
+            full_prompt = f"{system_prompt}\n\n{prompt}"
+        else:
+            full_prompt = prompt
+    
+        # Gemini takes a single overall deadline rather than connect/read timeouts
+        request_options = {'timeout': policy['read_timeout']}
+        generation_config = {'max_output_tokens': get_completion_budget(service, model)}
+        if temperature is not None:
+            generation_config['temperature'] = temperature
+        response = model_instance.generate_content(full_prompt, generation_config=generation_config, request_options=request_options)
+        return response.text
+    
+    elif service == 'openai':
+        # Reuse the pooled OpenAI client for this key
+        client = get_openai_client(api_key)
+    
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+    
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=get_completion_budget(service, model),
+            temperature=0.7 if temperature is None else temperature,
+            timeout=httpx.Timeout(policy['read_timeout'], connect=policy['connect_timeout'])
+        )
+        return response.choices[0].message.content
+    else:
+        raise Exception(f"Unsupported AI service: {service}")
+
+def call_ai_provider(service, model, api_key, prompt, system_prompt=None, temperature=None, policy=None, user_key=False):
+    """Send one prompt to a provider, retrying transient errors with jittered backoff (no fallback)
+
+    user_key marks api_key as the user's own, which bypasses the shared circuit breaker.
+    """
+    policy = policy or get_ai_call_policy()
+    return call_with_retries(
+        lambda: attempt_ai_provider(service, model, api_key, prompt, system_prompt, temperature, policy, user_key),
+        policy['max_retries'], AI_RETRY_BASE_DELAY, AI_RETRY_MAX_DELAY
+    )
+
+def attempt_ai_provider(service, model, api_key, prompt, system_prompt=None, temperature=None, policy=None, user_key=False):
+    """Make one attempt through admission control and the provider's circuit breaker"""
+    breaker = circuit_breakers.for_call(service, user_key)
+    if not breaker.is_available():
+        raise CircuitOpenError(f"Circuit for {service} is open")
+    
+    # Wait for a provider slot (concurrency + RPM/TPM) instead of bursting into 429s
+    tokens = estimate_tokens(system_prompt, prompt) + EXPECTED_COMPLETION_TOKENS
+    with admission_controller.slot(service, model, api_key, tokens):
+        if not breaker.allow_request():
+            raise CircuitOpenError(f"Circuit for {service} is open")
+        request_started = time.time()
+        try:
+            result = request_ai_provider(service, model, api_key, prompt, system_prompt, temperature, policy)
+        except Exception as e:
+            breaker.record_error(e, time.time() - request_started)
+            raise
+        latency = time.time() - request_started
+        breaker.record_success(latency)
+        provider_latency.record(service, latency)
+        return result
+
+def healthy_alternative(service):
+    """Another configured provider whose circuit is not open, if there is one"""
+    for candidate in get_ai_config()['available_services']:
+        if candidate != service and circuit_breakers.is_available(candidate):
+            return candidate
+    return None
+
+def hedge_delay(service):
+    """Seconds to wait on a provider before hedging: its recent p95 latency"""
+    p95 = provider_latency.percentile(service, 95)
+    if p95 is None:
+        return AI_HEDGE_DEFAULT_DELAY
+    return max(AI_HEDGE_MIN_DELAY, p95)
+
+def hedged_provider_call(service, model, api_key, prompt, system_prompt=None, temperature=None, policy=None):
+    """Call a provider, asking a healthy alternative too if it is slower than usual
+
+    Returns (response_text, model_used).
+    """
+    def primary():
+        return call_ai_provider(service, model, api_key, prompt, system_prompt, temperature, policy), model
+    
+    alternative = healthy_alternative(service)
+    alternative_key = get_api_key(alternative) if alternative else None
+    if not alternative_key:
+        return primary()
+    alternative_model = get_default_model(alternative)
+    
+    def backup():
+        print(f"🏁 {service} slower than {hedge_delay(service):.1f}s, hedging with {alternative}")
+        return call_ai_provider(alternative, alternative_model, alternative_key, prompt, system_prompt, temperature, policy), alternative_model
+    
+    return hedger.call(primary, backup, hedge_delay(service))
+
+def make_ai_call(prompt, system_prompt=None, service=None, model=None, user_api_key=None, cache=False, temperature=None, endpoint=None):
     """
     Make AI call using unified API system - Clean, Simple, Robust
+    
+    With cache=True, an identical earlier request (same service, model,
+    system prompt, prompt and temperature) is answered from ai_response_cache,
+    and identical requests already in flight share one provider call.
+    endpoint selects the timeout/retry/hedge policy from AI_CALL_POLICIES.
     """
+    policy = get_ai_call_policy(endpoint)
     try:
         # Use priority service if not specified (Google first, OpenAI fallback)
         if not service:
@@ -382,50 +552,62 @@ def make_ai_call(prompt, system_prompt=None, service=None, model=None, user_api_
             else:
                 model = get_default_model(service)
         
+        # Keep the request inside the model's prompt budget
+        prompt = fit_prompt(prompt, system_prompt, get_prompt_budget(service, model), service, model)
+        
+        # Don't wait for a provider known to be failing - go straight to a healthy one
+        if not user_api_key and not circuit_breakers.is_available(service):
+            alternative = healthy_alternative(service)
+            if alternative:
+                print(f"⚡ Circuit for {service} is open, routing to {alternative}")
+                return make_ai_call(prompt, system_prompt, alternative, None, None, cache=cache, temperature=temperature, endpoint=endpoint)
+        
+        cache_key = None
+        if cache:
+            cache_key = ai_response_cache.make_key(service, model, system_prompt, prompt, temperature)
+            cached = ai_response_cache.get(cache_key)
+            if cached is not None:
+                print(f"💾 Serving cached AI response: {service}, model: {model}")
+                return cached
+        
         # Get API key with proper fallback
         api_key = get_api_key(service, user_api_key)
         if not api_key or api_key in ["your-google-api-key-here", "your-openai-api-key-here"]:
             config = get_ai_config()
             # Try fallback service if primary not available
-            if config.get('fallback_service') and service != config['fallback_service']:
+            if config.get('fallback_service') and service != config['fallback_service'] \
+                    and circuit_breakers.is_available(config['fallback_service']):
                 print(f"🔄 Primary service {service} not available, switching to {config['fallback_service']}")
-                return make_ai_call(prompt, system_prompt, config['fallback_service'], model, user_api_key)
+                return make_ai_call(prompt, system_prompt, config['fallback_service'], model, user_api_key, cache=cache, temperature=temperature, endpoint=endpoint)
             else:
                 raise Exception(f"No valid API key available for {service}. Using test mode.")
         
         print(f"🎯 Using primary AI service: {service}, model: {model}")
         
-        if service == 'google':
-            # Configure Google AI with fresh key
-            genai.configure(api_key=api_key)
-            
-            model_instance = genai.GenerativeModel(model)
-            if system_prompt:
-                full_prompt = f"{system_prompt}\n\n{prompt}"
+        def call():
+            # Hedging sends a second request to another provider, so never with a user's own key
+            if policy['hedge'] and not user_api_key:
+                result, model_used = hedged_provider_call(service, model, api_key, prompt, system_prompt, temperature, policy)
             else:
-                full_prompt = prompt
+                result, model_used = call_ai_provider(service, model, api_key, prompt, system_prompt, temperature, policy, bool(user_api_key)), model
+            record_usage(count_tokens(system_prompt, service, model) + count_tokens(prompt, service, model),
+                         count_tokens(result, service, model))
+            return result, model_used
+        
+        if cache_key:
+            def call_and_store():
+                # A request that finished just before this one may have filled the cache
+                cached = ai_response_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+                result, model_used = call()
+                # Only real provider answers are cached, never fallback or test-mode text
+                ai_response_cache.set(cache_key, result, model_used, service)
+                return result, model_used
             
-            response = model_instance.generate_content(full_prompt)
-            return response.text, model
-            
-        elif service == 'openai':
-            # Create OpenAI client
-            client = OpenAI(api_key=api_key)
-            
-            messages = []
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            messages.append({"role": "user", "content": prompt})
-            
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=2000,
-                temperature=0.7
-            )
-            return response.choices[0].message.content, model
-        else:
-            raise Exception(f"Unsupported AI service: {service}")
+            # Concurrent identical requests share one provider call
+            return ai_inflight.do(cache_key, call_and_store)
+        return call()
             
     except Exception as e:
         error_msg = f"AI Call Error ({service}/{model}): {str(e)}"
@@ -434,10 +616,11 @@ def make_ai_call(prompt, system_prompt=None, service=None, model=None, user_api_
         # Try fallback service if primary fails and no user key specified
         if not user_api_key:
             config = get_ai_config()
-            if config.get('fallback_service') and service != config['fallback_service']:
+            if config.get('fallback_service') and service != config['fallback_service'] \
+                    and circuit_breakers.is_available(config['fallback_service']):
                 print(f"🔄 Trying fallback to {config['fallback_service']}...")
                 try:
-                    return make_ai_call(prompt, system_prompt, config['fallback_service'], None, None)
+                    return make_ai_call(prompt, system_prompt, config['fallback_service'], None, None, cache=cache, temperature=temperature, endpoint=endpoint)
                 except Exception as fallback_error:
                     print(f"Fallback also failed: {str(fallback_error)}")
         
@@ -445,6 +628,462 @@ def make_ai_call(prompt, system_prompt=None, service=None, model=None, user_api_
         print("⚠️ All AI services failed, using test mode")
         return get_test_response(prompt, system_prompt), "test-mode"
 
+def stream_ai_provider(service, model, api_key, prompt, system_prompt=None, policy=None):
+    """Stream one prompt from a provider, yielding text chunks"""
+    policy = policy or get_ai_call_policy('chat')
+    if service == 'google':
+        model_instance = get_google_model(api_key, model)
+        if system_prompt:
+            full_prompt = f"{system_prompt}\n\n{prompt}"
+        else:
+            full_prompt = prompt
+    
+        generation_config = {'max_output_tokens': get_completion_budget(service, model)}
+        for chunk in model_instance.generate_content(full_prompt, stream=True, generation_config=generation_config, request_options={'timeout': policy['read_timeout']}):
+            if chunk.text:
+                yield chunk.text
+    
+    elif service == 'openai':
+        client = get_openai_client(api_key)
+    
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+    
+        stream = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=get_completion_budget(service, model),
+            temperature=0.7,
+            stream=True,
+            timeout=httpx.Timeout(policy['read_timeout'], connect=policy['connect_timeout'])
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    else:
+        raise Exception(f"Unsupported AI service: {service}")
+
+class StreamInterrupted(Exception):
+    """The provider failed after part of a streamed reply was already sent"""
+
+# Sent with a reply the provider stopped producing part way through
+STREAM_TRUNCATED_ERROR = 'The AI service stopped before finishing this reply'
+
+def stream_ai_call(prompt, system_prompt=None, service=None, model=None, user_api_key=None):
+    """
+    Streaming counterpart of make_ai_call - yields (text_chunk, model) tuples
+    as the provider produces them. Falls back to the other service or test
+    mode only if the failure happens before the first chunk was sent; after
+    that it raises StreamInterrupted.
+    """
+    started = False
+    try:
+        # Use priority service if not specified (Google first, OpenAI fallback)
+        if not service:
+            config = get_ai_config()
+            service = config['primary_service']
+        
+        # Get default model for service if not specified
+        if not model:
+            if service == 'google':
+                model = DEFAULT_GOOGLE_MODEL
+            elif service == 'openai':
+                model = DEFAULT_OPENAI_MODEL
+            else:
+                model = get_default_model(service)
+        
+        # Keep the request inside the model's prompt budget
+        prompt = fit_prompt(prompt, system_prompt, get_prompt_budget(service, model), service, model)
+        
+        # Don't wait for a provider known to be failing - go straight to a healthy one
+        if not user_api_key and not circuit_breakers.is_available(service):
+            alternative = healthy_alternative(service)
+            if alternative:
+                print(f"⚡ Circuit for {service} is open, routing to {alternative}")
+                yield from stream_ai_call(prompt, system_prompt, alternative, None, None)
+                return
+        
+        # Get API key with proper fallback
+        api_key = get_api_key(service, user_api_key)
+        if not api_key or api_key in ["your-google-api-key-here", "your-openai-api-key-here"]:
+            config = get_ai_config()
+            if config.get('fallback_service') and service != config['fallback_service'] \
+                    and circuit_breakers.is_available(config['fallback_service']):
+                print(f"🔄 Primary service {service} not available, switching to {config['fallback_service']}")
+                yield from stream_ai_call(prompt, system_prompt, config['fallback_service'], None, user_api_key)
+                return
+            else:
+                raise Exception(f"No valid API key available for {service}. Using test mode.")
+        
+        print(f"🎯 Streaming from AI service: {service}, model: {model}")
+        
+        breaker = circuit_breakers.for_call(service, bool(user_api_key))
+        if not breaker.is_available():
+            raise CircuitOpenError(f"Circuit for {service} is open")
+        
+        # The slot is held until the stream finishes or the client disconnects
+        tokens = estimate_tokens(system_prompt, prompt) + EXPECTED_COMPLETION_TOKENS
+        with admission_controller.slot(service, model, api_key, tokens):
+            if not breaker.allow_request():
+                raise CircuitOpenError(f"Circuit for {service} is open")
+            request_started = time.time()
+            outcome_recorded = False
+            parts = []
+            try:
+                for text in stream_ai_provider(service, model, api_key, prompt, system_prompt):
+                    if not outcome_recorded:
+                        # Time to first token is what the breaker judges streams by
+                        breaker.record_success(time.time() - request_started)
+                        outcome_recorded = True
+                    started = True
+                    parts.append(text)
+                    yield text, model
+                if not outcome_recorded:
+                    breaker.record_success(time.time() - request_started)
+                    outcome_recorded = True
+                record_usage(count_tokens(system_prompt, service, model) + count_tokens(prompt, service, model),
+                             count_tokens(''.join(parts), service, model))
+            except Exception as e:
+                if not outcome_recorded:
+                    breaker.record_error(e, time.time() - request_started)
+                    outcome_recorded = True
+                raise
+            finally:
+                # Client disconnected before the first token: no verdict on the provider
+                if not outcome_recorded:
+                    breaker.record_cancelled()
+            
+    except StreamInterrupted:
+        # Raised by a fallback stream this one delegated to
+        raise
+    except Exception as e:
+        print(f"AI Stream Error ({service}/{model}): {str(e)}")
+        
+        # Part of the answer already reached the client; it cannot be swapped for another provider's
+        if started:
+            raise StreamInterrupted(str(e)) from e
+        
+        # Try fallback service if primary fails and no user key specified
+        if not user_api_key:
+            config = get_ai_config()
+            if config.get('fallback_service') and service != config['fallback_service'] \
+                    and circuit_breakers.is_available(config['fallback_service']):
+                print(f"🔄 Trying fallback to {config['fallback_service']}...")
+                yield from stream_ai_call(prompt, system_prompt, config['fallback_service'], None, None)
+                return
+        
+        # Final fallback to test mode
+        print("⚠️ All AI services failed, using test mode")
+        yield get_test_response(prompt, system_prompt), "test-mode"
+
+# --- Async provider path (served natively by asgi.py) ---
+
+def resolve_ai_model(service, model):
+    """Default service and model for a request that did not name them"""
+    if not service:
+        service = get_ai_config()['primary_service']
+    if not model:
+        if service == 'google':
+            model = DEFAULT_GOOGLE_MODEL
+        elif service == 'openai':
+            model = DEFAULT_OPENAI_MODEL
+        else:
+            model = get_default_model(service)
+    return service, model
+
+async def request_ai_provider_async(service, model, api_key, prompt, system_prompt=None, temperature=None, policy=None):
+    """Async counterpart of request_ai_provider"""
+    policy = policy or get_ai_call_policy()
+    if service == 'google':
+        model_instance = get_async_google_model(api_key, model)
+        full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+        generation_config = {'max_output_tokens': get_completion_budget(service, model)}
+        if temperature is not None:
+            generation_config['temperature'] = temperature
+        response = await model_instance.generate_content_async(
+            full_prompt,
+            generation_config=generation_config,
+            request_options={'timeout': policy['read_timeout']}
+        )
+        return response.text
+    
+    elif service == 'openai':
+        client = get_async_openai_client(api_key)
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        response = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=get_completion_budget(service, model),
+            temperature=0.7 if temperature is None else temperature,
+            timeout=httpx.Timeout(policy['read_timeout'], connect=policy['connect_timeout'])
+        )
+        return response.choices[0].message.content
+    else:
+        raise Exception(f"Unsupported AI service: {service}")
+
+async def call_ai_provider_async(service, model, api_key, prompt, system_prompt=None, temperature=None, policy=None, user_key=False):
+    """Async counterpart of call_ai_provider: admission, circuit breaker and retries without holding a thread"""
+    policy = policy or get_ai_call_policy()
+    breaker = circuit_breakers.for_call(service, user_key)
+    
+    async def attempt():
+        if not breaker.is_available():
+            raise CircuitOpenError(f"Circuit for {service} is open")
+        tokens = estimate_tokens(system_prompt, prompt) + EXPECTED_COMPLETION_TOKENS
+        async with admission_controller.async_slot(service, model, api_key, tokens):
+            if not breaker.allow_request():
+                raise CircuitOpenError(f"Circuit for {service} is open")
+            request_started = time.time()
+            try:
+                result = await request_ai_provider_async(service, model, api_key, prompt, system_prompt, temperature, policy)
+            except asyncio.CancelledError:
+                # Client went away: no verdict on the provider
+                breaker.record_cancelled()
+                raise
+            except Exception as e:
+                breaker.record_error(e, time.time() - request_started)
+                raise
+            latency = time.time() - request_started
+            breaker.record_success(latency)
+            provider_latency.record(service, latency)
+            return result
+    
+    return await call_with_retries_async(attempt, policy['max_retries'], AI_RETRY_BASE_DELAY, AI_RETRY_MAX_DELAY)
+
+async def make_ai_call_async(prompt, system_prompt=None, service=None, model=None, user_api_key=None, cache=False, temperature=None, endpoint=None):
+    """
+    Async counterpart of make_ai_call with the same routing, caching and
+    fallback rules. Identical concurrent requests are not coalesced and
+    hedging is not applied on this path.
+    """
+    policy = get_ai_call_policy(endpoint)
+    try:
+        service, model = resolve_ai_model(service, model)
+        prompt = fit_prompt(prompt, system_prompt, get_prompt_budget(service, model), service, model)
+        
+        # Don't wait for a provider known to be failing - go straight to a healthy one
+        if not user_api_key and not circuit_breakers.is_available(service):
+            alternative = healthy_alternative(service)
+            if alternative:
+                print(f"⚡ Circuit for {service} is open, routing to {alternative}")
+                return await make_ai_call_async(prompt, system_prompt, alternative, None, None, cache=cache, temperature=temperature, endpoint=endpoint)
+        
+        cache_key = None
+        if cache:
+            cache_key = ai_response_cache.make_key(service, model, system_prompt, prompt, temperature)
+            # A SQLite read, so it runs off the event loop like the write below
+            cached = await asyncio.to_thread(ai_response_cache.get, cache_key)
+            if cached is not None:
+                print(f"💾 Serving cached AI response: {service}, model: {model}")
+                return cached
+        
+        api_key = get_api_key(service, user_api_key)
+        if not api_key or api_key in ["your-google-api-key-here", "your-openai-api-key-here"]:
+            config = get_ai_config()
+            if config.get('fallback_service') and service != config['fallback_service'] \
+                    and circuit_breakers.is_available(config['fallback_service']):
+                print(f"🔄 Primary service {service} not available, switching to {config['fallback_service']}")
+                return await make_ai_call_async(prompt, system_prompt, config['fallback_service'], model, user_api_key, cache=cache, temperature=temperature, endpoint=endpoint)
+            else:
+                raise Exception(f"No valid API key available for {service}. Using test mode.")
+        
+        print(f"🎯 Using primary AI service (async): {service}, model: {model}")
+        result = await call_ai_provider_async(service, model, api_key, prompt, system_prompt, temperature, policy, bool(user_api_key))
+        record_usage(count_tokens(system_prompt, service, model) + count_tokens(prompt, service, model),
+                     count_tokens(result, service, model))
+        if cache_key:
+            # The SQLite write may wait on a lock, so keep it off the event loop
+            await asyncio.to_thread(ai_response_cache.set, cache_key, result, model, service)
+        return result, model
+    
+    except Exception as e:
+        print(f"AI Call Error ({service}/{model}): {str(e)}")
+        
+        if not user_api_key:
+            config = get_ai_config()
+            if config.get('fallback_service') and service != config['fallback_service'] \
+                    and circuit_breakers.is_available(config['fallback_service']):
+                print(f"🔄 Trying fallback to {config['fallback_service']}...")
+                try:
+                    return await make_ai_call_async(prompt, system_prompt, config['fallback_service'], None, None, cache=cache, temperature=temperature, endpoint=endpoint)
+                except Exception as fallback_error:
+                    print(f"Fallback also failed: {str(fallback_error)}")
+        
+        print("⚠️ All AI services failed, using test mode")
+        return get_test_response(prompt, system_prompt), "test-mode"
+
+async def stream_ai_provider_async(service, model, api_key, prompt, system_prompt=None, policy=None):
+    """Async counterpart of stream_ai_provider, yielding text chunks"""
+    policy = policy or get_ai_call_policy('chat')
+    if service == 'google':
+        model_instance = get_async_google_model(api_key, model)
+        full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+        response = await model_instance.generate_content_async(
+            full_prompt,
+            stream=True,
+            generation_config={'max_output_tokens': get_completion_budget(service, model)},
+            request_options={'timeout': policy['read_timeout']}
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+    
+    elif service == 'openai':
+        client = get_async_openai_client(api_key)
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=get_completion_budget(service, model),
+            temperature=0.7,
+            stream=True,
+            timeout=httpx.Timeout(policy['read_timeout'], connect=policy['connect_timeout'])
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    else:
+        raise Exception(f"Unsupported AI service: {service}")
+
+async def stream_ai_call_async(prompt, system_prompt=None, service=None, model=None, user_api_key=None):
+    """Async counterpart of stream_ai_call - yields (text_chunk, model) tuples, raising StreamInterrupted after a partial reply"""
+    started = False
+    try:
+        service, model = resolve_ai_model(service, model)
+        prompt = fit_prompt(prompt, system_prompt, get_prompt_budget(service, model), service, model)
+        
+        if not user_api_key and not circuit_breakers.is_available(service):
+            alternative = healthy_alternative(service)
+            if alternative:
+                print(f"⚡ Circuit for {service} is open, routing to {alternative}")
+                async for item in stream_ai_call_async(prompt, system_prompt, alternative, None, None):
+                    yield item
+                return
+        
+        api_key = get_api_key(service, user_api_key)
+        if not api_key or api_key in ["your-google-api-key-here", "your-openai-api-key-here"]:
+            config = get_ai_config()
+            if config.get('fallback_service') and service != config['fallback_service'] \
+                    and circuit_breakers.is_available(config['fallback_service']):
+                print(f"🔄 Primary service {service} not available, switching to {config['fallback_service']}")
+                async for item in stream_ai_call_async(prompt, system_prompt, config['fallback_service'], None, user_api_key):
+                    yield item
+                return
+            else:
+                raise Exception(f"No valid API key available for {service}. Using test mode.")
+        
+        print(f"🎯 Streaming from AI service (async): {service}, model: {model}")
+        
+        breaker = circuit_breakers.for_call(service, bool(user_api_key))
+        if not breaker.is_available():
+            raise CircuitOpenError(f"Circuit for {service} is open")
+        
+        tokens = estimate_tokens(system_prompt, prompt) + EXPECTED_COMPLETION_TOKENS
+        async with admission_controller.async_slot(service, model, api_key, tokens):
+            if not breaker.allow_request():
+                raise CircuitOpenError(f"Circuit for {service} is open")
+            request_started = time.time()
+            outcome_recorded = False
+            parts = []
+            try:
+                async for text in stream_ai_provider_async(service, model, api_key, prompt, system_prompt):
+                    if not outcome_recorded:
+                        breaker.record_success(time.time() - request_started)
+                        outcome_recorded = True
+                    started = True
+                    parts.append(text)
+                    yield text, model
+                if not outcome_recorded:
+                    breaker.record_success(time.time() - request_started)
+                    outcome_recorded = True
+                record_usage(count_tokens(system_prompt, service, model) + count_tokens(prompt, service, model),
+                             count_tokens(''.join(parts), service, model))
+            except Exception as e:
+                if not outcome_recorded:
+                    breaker.record_error(e, time.time() - request_started)
+                    outcome_recorded = True
+                raise
+            finally:
+                if not outcome_recorded:
+                    breaker.record_cancelled()
+    
+    except StreamInterrupted:
+        raise
+    except Exception as e:
+        print(f"AI Stream Error ({service}/{model}): {str(e)}")
+        if started:
+            raise StreamInterrupted(str(e)) from e
+        
+        if not user_api_key:
+            config = get_ai_config()
+            if config.get('fallback_service') and service != config['fallback_service'] \
+                    and circuit_breakers.is_available(config['fallback_service']):
+                print(f"🔄 Trying fallback to {config['fallback_service']}...")
+                async for item in stream_ai_call_async(prompt, system_prompt, config['fallback_service'], None, None):
+                    yield item
+                return
+        
+        print("⚠️ All AI services failed, using test mode")
+        yield get_test_response(prompt, system_prompt), "test-mode"
+
+def wants_stream(data):
+    """Check whether the client asked for a server-sent events response"""
+    if data and data.get('stream'):
+        return True
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+def sse_event(payload):
+    """Format a payload as a single server-sent event"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+def finish_stream_payload(response_data, truncated):
+    """Final SSE event for a streamed reply; a truncated one is flagged as incomplete"""
+    if truncated:
+        response_data.update({'status': 'incomplete', 'truncated': True, 'error': STREAM_TRUNCATED_ERROR})
+    response_data['type'] = 'done'
+    return sse_event(response_data)
+
+def stream_chat_response(chunks, on_complete):
+    """
+    Relay (text_chunk, model) tuples to the client as SSE 'token' events.
+    Once the stream ends, on_complete(full_text, model, truncated) persists
+    the message and returns the payload sent in the final 'done' event.
+    truncated is True when the provider failed part way through the reply.
+    """
+    def generate():
+        parts = []
+        model_used = None
+        truncated = False
+        try:
+            for chunk, model_used in chunks:
+                parts.append(chunk)
+                yield sse_event({'type': 'token', 'content': chunk})
+        except StreamInterrupted:
+            truncated = True
+        
+        full_text = ''.join(parts)
+        try:
+            response_data = on_complete(full_text, model_used, truncated)
+        except Exception as e:
+            print(f"Error finishing streamed response: {str(e)}")
+            traceback.print_exc()
+            response_data = {'response': full_text, 'status': 'success'}
+        yield finish_stream_payload(response_data, truncated)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 def get_test_response(prompt, system_prompt=None):
     """Generate test response when no AI service is available"""
     if system_prompt and "bias" in system_prompt.lower():
@@ -745,8 +1384,8 @@ def get_config_info():
     # Legacy format for backward compatibility
     legacy_config = {
         'service': config['default_service'],
-        'google_key_available': config['system_google_key_available'],
-        'openai_key_available': config['system_openai_key_available']
+        'google_key_available': config['google']['available'],
+        'openai_key_available': config['openai']['available']
     }
     return jsonify(legacy_config)
 
@@ -877,13 +1516,26 @@ def auto_fill_form():
     return jsonify(form_data)
 
 # --- Endpoint: Log User Interaction ---
-@app.route('/api/log-interaction', methods=['POST'])
-@login_required
-def log_interaction_endpoint():
-    """Log user interactions to CSV"""
-    data = request.json
-    user_id = current_user.id if current_user.is_authenticated else 'anonymous'
-    # Log detailed user interaction
+# Client timestamps older than this are clamped to it (events are buffered for seconds, not hours)
+MAX_INTERACTION_EVENT_AGE = timedelta(hours=1)
+
+def client_event_timestamp(value):
+    """Server-local timestamp for the time the browser recorded an event, clamped to [now - max age, now]
+
+    navigation.js sends UTC ISO strings; anything missing or unparseable falls back to now.
+    """
+    now = datetime.now()
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except (TypeError, ValueError):
+        return now.strftime('%Y-%m-%d %H:%M:%S')
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    moment = min(max(moment, now - MAX_INTERACTION_EVENT_AGE), now)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def log_interaction_event(user_id, data):
+    """Log one front-end interaction event posted by the browser, at the time the browser recorded it"""
     log_user_interaction(
         user_id=user_id,
         action=data.get('action', ''),
@@ -897,11 +1549,46 @@ def log_interaction_endpoint():
             'ai_model': data.get('ai_model', ''),
             'ai_response': data.get('ai_response', ''),
             'session_data': data.get('session_data', '')
-        }
+        },
+        timestamp=client_event_timestamp(data.get('timestamp'))
     )
+
+@app.route('/api/log-interaction', methods=['POST'])
+@login_required
+def log_interaction_endpoint():
+    """Log user interactions to CSV"""
+    data = request.json
+    user_id = current_user.id if current_user.is_authenticated else 'anonymous'
+    # Log detailed user interaction
+    log_interaction_event(user_id, data)
     
     return jsonify({'status': 'success', 'message': 'Interaction logged'})
 
+# --- Endpoint: Log Interaction Batch ---
+# Maximum number of events accepted in one batch request
+MAX_INTERACTION_BATCH_SIZE = 200
+
+@app.route('/api/log-interactions/batch', methods=['POST'])
+@login_required
+def log_interactions_batch_endpoint():
+    """Log a batch of buffered user interactions in one request"""
+    # navigator.sendBeacon posts as text/plain, so parse the body regardless of content type
+    data = request.get_json(force=True, silent=True)
+    events = data.get('events') if isinstance(data, dict) else data
+    if not isinstance(events, list):
+        return jsonify({'error': 'Expected a list of events'}), 400
+    if len(events) > MAX_INTERACTION_BATCH_SIZE:
+        return jsonify({'error': f'Too many events in one batch (max {MAX_INTERACTION_BATCH_SIZE})'}), 413
+
+    user_id = current_user.id if current_user.is_authenticated else 'anonymous'
+    logged = 0
+    for event in events:
+        if isinstance(event, dict):
+            log_interaction_event(user_id, event)
+            logged += 1
+
+    return jsonify({'status': 'success', 'message': 'Interactions logged', 'logged': logged})
+
 # --- Endpoint: Log Chat Interaction ---
 @app.route('/api/log-chat', methods=['POST'])
 @login_required
@@ -924,6 +1611,102 @@ def log_chat_endpoint():
     
     return jsonify({'status': 'success', 'message': 'Chat logged'})
 
+# --- Log browsing: keyset pagination shared by the log endpoints ---
+# Pages are ordered newest first by (timestamp, id); the cursor names the last
+# row of the previous page, so every page is an index range scan however old it is.
+# Common query parameters: limit, cursor, date_from, date_to (YYYY-MM-DD, inclusive).
+# e.g. /api/user-interactions?action=click&data.interaction_type=button_click
+
+LOG_PAGE_SIZE = 100
+LOG_PAGE_MAX = 500
+
+def encode_log_cursor(timestamp, row_id):
+    """Opaque cursor pointing just past the given row"""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, row_id]).encode('utf-8')).decode('ascii')
+
+def decode_log_cursor(cursor):
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(timestamp), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def parse_log_date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'{name} must be a date in YYYY-MM-DD format')
+
+def resolve_log_user(cursor, user):
+    """users.id for a user filter given as an id or an email; None if there is no such user"""
+    if user.isdigit():
+        return int(user)
+    row = cursor.execute('SELECT id FROM users WHERE email = ?', (user,)).fetchone()
+    return row[0] if row else None
+
+def fetch_log_page(cursor, select_sql, alias, filters, fixed_where=None, json_column=None):
+    """One page of log rows for the current request's filters
+
+    select_sql must select the timestamp first and the row id last. filters
+    maps query parameters to the columns they must equal. With json_column,
+    parameters named data.<key> (or data.<key>.<nested key>...) match that
+    key of the column's JSON object.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    Raises ValueError for malformed parameters.
+    """
+    args = request.args
+    try:
+        limit = min(max(int(args.get('limit', LOG_PAGE_SIZE)), 1), LOG_PAGE_MAX)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    
+    where = list(fixed_where or [])
+    params = []
+    for param, column in filters.items():
+        value = args.get(param)
+        if not value:
+            continue
+        if param == 'user':
+            value = resolve_log_user(cursor, value)
+            if value is None:
+                return [], None
+        where.append(f"{alias}.{column} = ?")
+        params.append(value)
+    
+    if json_column:
+        for param, value in args.items():
+            if not param.startswith('data.') or not value:
+                continue
+            # Dotted keys such as data.details.interaction_type reach into nested objects
+            segments = param[len('data.'):].split('.')
+            if not all(segment.replace('_', '').isalnum() for segment in segments):
+                raise ValueError(f'Invalid filter: {param}')
+            where.append(f"json_extract({alias}.{json_column}, '$.{'.'.join(segments)}') = ?")
+            params.append(value)
+    
+    if args.get('date_from'):
+        where.append(f"{alias}.timestamp >= ?")
+        params.append(parse_log_date(args['date_from'], 'date_from').strftime('%Y-%m-%d'))
+    if args.get('date_to'):
+        # Timestamps are 'YYYY-MM-DD HH:MM:SS', so the whole end day is below the next day
+        where.append(f"{alias}.timestamp < ?")
+        params.append((parse_log_date(args['date_to'], 'date_to') + timedelta(days=1)).strftime('%Y-%m-%d'))
+    if args.get('cursor'):
+        where.append(f"({alias}.timestamp, {alias}.id) < (?, ?)")
+        params.extend(decode_log_cursor(args['cursor']))
+    
+    sql = select_sql
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {alias}.timestamp DESC, {alias}.id DESC LIMIT ?"
+    
+    # One extra row tells whether another page follows
+    rows = cursor.execute(sql, (*params, limit + 1)).fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_log_cursor(rows[-1][0], rows[-1][-1])
+
 # --- Endpoint: Get User Interactions ---
 @app.route('/api/user-interactions', methods=['GET'])
 @login_required
@@ -932,10 +1715,10 @@ def get_user_interactions():
     """Get user interaction logs from database"""
     print(f"🔍 User interactions API called by user: {getattr(current_user, 'email', 'anonymous') if current_user.is_authenticated else 'not authenticated'}")
     try:
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("""
+        rows, next_cursor = fetch_log_page(cursor, """
             SELECT 
                 ui.timestamp,
                 u.email as user_email,
@@ -946,48 +1729,28 @@ def get_user_interactions():
                 ui.element_id,
                 ui.element_type,
                 ui.element_value,
-                ui.additional_data
+                ui.additional_data,
+                ui.id
             FROM user_interactions ui
             LEFT JOIN users u ON ui.user_id = u.id
-            ORDER BY ui.timestamp DESC
-            LIMIT 1000
-        """)
+        """, 'ui', {'user': 'user_id', 'page': 'page', 'action': 'action', 'interaction_type': 'interaction_type'},
+            json_column='additional_data')
         
-        columns = ['timestamp', 'user_email', 'user_name', 'interaction_type', 'page', 'action', 'element_id', 'element_type', 'element_value', 'additional_data']
+        columns = ['timestamp', 'user_email', 'user_name', 'interaction_type', 'page', 'action', 'element_id', 'element_type', 'element_value', 'additional_data', 'id']
         interactions = []
-        for row in cursor.fetchall():
-            interaction_dict = {}
-            for i, column in enumerate(columns):
-                value = row[i]
-                # Fix additional_data JSON formatting
-                if column == 'additional_data':
-                    if value:
-                        try:
-                            # Convert Python dict string to proper JSON
-                            import json
-                            if isinstance(value, str) and value.startswith('{'):
-                                # Replace single quotes with double quotes for JSON
-                                json_str = value.replace("'", '"')
-                                # Validate it's proper JSON
-                                parsed = json.loads(json_str)
-                                value = json_str
-                            else:
-                                value = json.dumps(str(value))
-                        except:
-                            # If parsing fails, set to null to avoid JSON issues
-                            value = None
-                    else:
-                        # Set empty values to null for JSON safety
-                        value = None
-                interaction_dict[column] = value
+        for row in rows:
+            # additional_data is already JSON text; the dashboard parses it
+            interaction_dict = dict(zip(columns, row))
             # Add aliases for compatibility
             interaction_dict['user_id'] = interaction_dict['user_email']
             interactions.append(interaction_dict)
         
         conn.close()
         print(f"✅ User interactions API returning {len(interactions)} records")
-        return jsonify({'success': True, 'interactions': interactions})
+        return jsonify({'success': True, 'interactions': interactions, 'next_cursor': next_cursor})
         
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         print(f"❌ Error loading user interactions: {str(e)}")
         import traceback
@@ -1002,10 +1765,10 @@ def get_chat_logs():
     """Get chat logs from database"""
     print(f"🔍 Chat logs API called by user: {getattr(current_user, 'email', 'anonymous') if current_user.is_authenticated else 'not authenticated'}")
     try:
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("""
+        rows, next_cursor = fetch_log_page(cursor, """
             SELECT 
                 cl.timestamp,
                 u.email as user_email,
@@ -1016,16 +1779,17 @@ def get_chat_logs():
                 cl.message,
                 cl.ai_model,
                 cl.response_time_sec,
-                cl.context
+                cl.context,
+                cl.prompt_tokens,
+                cl.completion_tokens,
+                cl.id
             FROM chat_logs cl
             LEFT JOIN users u ON cl.user_id = u.id
-            ORDER BY cl.timestamp DESC
-            LIMIT 1000
-        """)
+        """, 'cl', {'module': 'module', 'sender': 'sender', 'user': 'user_id', 'model': 'ai_model'})
         
-        columns = ['timestamp', 'user_email', 'user_name', 'module', 'sender', 'turn', 'message', 'ai_model', 'response_time_sec', 'context']
+        columns = ['timestamp', 'user_email', 'user_name', 'module', 'sender', 'turn', 'message', 'ai_model', 'response_time_sec', 'context', 'prompt_tokens', 'completion_tokens', 'id']
         chats = []
-        for row in cursor.fetchall():
+        for row in rows:
             chat_dict = {}
             for i, column in enumerate(columns):
                 chat_dict[column] = row[i]
@@ -1037,8 +1801,10 @@ def get_chat_logs():
         
         conn.close()
         print(f"✅ Chat logs API returning {len(chats)} records")
-        return jsonify({'success': True, 'chats': chats})
+        return jsonify({'success': True, 'chats': chats, 'next_cursor': next_cursor})
         
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         print(f"❌ Error loading chat logs: {str(e)}")
         import traceback
@@ -1053,10 +1819,10 @@ def get_data_analysis_logs():
     """Get data analysis logs from database"""
     try:
         # For now, return data analysis entries from chat logs where module is 'Data Interpreter'
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("""
+        rows, next_cursor = fetch_log_page(cursor, """
             SELECT 
                 cl.timestamp,
                 u.email as user_email,
@@ -1064,16 +1830,14 @@ def get_data_analysis_logs():
                 cl.message,
                 cl.ai_model,
                 cl.response_time_sec,
-                cl.context
+                cl.context,
+                cl.id
             FROM chat_logs cl
             LEFT JOIN users u ON cl.user_id = u.id
-            WHERE cl.module = 'Data Interpreter'
-            ORDER BY cl.timestamp DESC
-            LIMIT 500
-        """)
+        """, 'cl', {'user': 'user_id', 'model': 'ai_model', 'sender': 'sender'}, ["cl.module = 'Data Interpreter'"])
         
         analyses = []
-        for row in cursor.fetchall():
+        for row in rows:
             analyses.append({
                 'timestamp': row[0],
                 'user_id': row[1],
@@ -1087,8 +1851,10 @@ def get_data_analysis_logs():
             })
         
         conn.close()
-        return jsonify({'success': True, 'analyses': analyses})
+        return jsonify({'success': True, 'analyses': analyses, 'next_cursor': next_cursor})
         
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         print(f"Error loading data analysis logs: {str(e)}")
         return jsonify({'success': False, 'message': 'Error loading data analysis logs'}), 500
@@ -1098,51 +1864,63 @@ def get_data_analysis_logs():
 @login_required
 @require_true_admin
 def get_logs_statistics():
-    """Get statistics from database"""
+    """Get statistics from database (served from the running totals in model/log_statistics.py)"""
     try:
-        stats = {}
-        conn = sqlite3.connect('db/laila_central.db')
-        cursor = conn.cursor()
-        
-        # Total users
-        cursor.execute("SELECT COUNT(DISTINCT user_id) FROM chat_logs WHERE user_id IS NOT NULL")
-        stats['total_users'] = cursor.fetchone()[0] or 0
-        
-        # Total chat messages
-        cursor.execute("SELECT COUNT(*) FROM chat_logs")
-        stats['total_chats'] = cursor.fetchone()[0] or 0
-        
-        # Total interactions (same as total chats for now)
-        stats['total_interactions'] = stats['total_chats']
-        
-        # Data analysis count
-        cursor.execute("SELECT COUNT(*) FROM chat_logs WHERE module = 'Data Interpreter'")
-        stats['total_analyses'] = cursor.fetchone()[0] or 0
-        
-        # Average processing time (in milliseconds)
-        cursor.execute("SELECT AVG(response_time_sec) FROM chat_logs WHERE response_time_sec IS NOT NULL AND sender = 'AI'")
-        avg_time_sec = cursor.fetchone()[0]
-        stats['avg_processing_time'] = int(avg_time_sec * 1000) if avg_time_sec else 0
-        
-        # Most active user
-        cursor.execute("""
-            SELECT u.email, COUNT(*) as message_count 
-            FROM chat_logs cl 
-            LEFT JOIN users u ON cl.user_id = u.id 
-            WHERE u.email IS NOT NULL 
-            GROUP BY u.email 
-            ORDER BY message_count DESC 
-            LIMIT 1
-        """)
-        result = cursor.fetchone()
-        stats['most_active_user'] = result[0] if result else 'N/A'
-        
-        conn.close()
+        snapshot = get_log_statistics().get()
+        stats = {
+            'total_users': snapshot['chat_users'],
+            'total_chats': snapshot['total_messages'],
+            # Total interactions (same as total chats for now)
+            'total_interactions': snapshot['total_messages'],
+            'total_analyses': snapshot['by_module'].get('Data Interpreter', 0),
+            # Average processing time (in milliseconds)
+            'avg_processing_time': int(snapshot['avg_response_time'] * 1000),
+            'most_active_user': snapshot['most_active_user'],
+            'as_of': snapshot['as_of']
+        }
         return jsonify({'success': True, 'statistics': stats})
     except Exception as e:
         print(f"Error loading statistics: {str(e)}")
         return jsonify({'success': False, 'message': 'Error loading statistics'}), 500
 
+# --- Endpoint: Log Writer Statistics ---
+@app.route('/api/admin/log-writer-stats', methods=['GET'])
+@login_required
+@require_true_admin
+def get_log_writer_stats():
+    """Get queue depth and write/drop counters of the background log writer, and the refresh state of the statistics snapshot"""
+    return jsonify({'success': True, 'stats': log_writer.stats(), 'statistics_snapshot': get_log_statistics().stats()})
+
+@app.route('/api/admin/ai-cache', methods=['GET', 'DELETE'])
+@login_required
+@require_true_admin
+def ai_cache_admin():
+    """Get AI response cache hit/miss counters, or clear the cache with DELETE"""
+    try:
+        if request.method == 'DELETE':
+            ai_response_cache.clear()
+            return jsonify({'success': True, 'message': 'AI response cache cleared'})
+        return jsonify({'success': True, 'stats': ai_response_cache.stats(), 'in_flight': ai_inflight.stats()})
+    except Exception as e:
+        print(f"ERROR in ai_cache_admin: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/admin/ai-admission', methods=['GET'])
+@login_required
+@require_true_admin
+def get_ai_admission_stats():
+    """Get in-flight, queue and wait-time metrics for each provider limiter, plus circuit breaker, latency, hedging, background job, conversation summary and daily rollup state"""
+    return jsonify({
+        'success': True,
+        'limiters': admission_controller.stats(),
+        'circuits': circuit_breakers.snapshot(),
+        'latency': provider_latency.snapshot(),
+        'hedges': hedger.stats(),
+        'jobs': ai_jobs.stats(),
+        'conversation_memory': conversation_memory.stats(),
+        'daily_rollups': daily_rollups.stats()
+    })
+
 # --- Endpoint: Submit Form Data ---
 @app.route('/api/submit', methods=['POST'])
 @login_required
@@ -1188,7 +1966,124 @@ def export_csv():
         return jsonify({'error': 'No data available'}), 404
     return send_file(DATA_FILE, mimetype='text/csv', as_attachment=True, download_name='submissions.csv')
 
+# --- Background AI jobs (see jobs.py) ---
+
+# How often the job event stream re-reads the job's status
+JOB_EVENTS_POLL_SECONDS = 1
+
+def start_ai_job(kind, fn, payload):
+    """Run fn() as a background job for the current user, reusing an identical earlier job"""
+    payload = {k: v for k, v in payload.items() if k != 'background'}
+    
+    # The job still sees this request's session, so chat logging keeps its chat_id
+    @copy_current_request_context
+    def run_job():
+        start_usage()  # tokens are metered per job, not per worker thread
+        return fn()
+    
+    return ai_jobs.submit(
+        kind,
+        current_user.id,
+        run_job,
+        dedupe_key=ai_jobs.make_key(current_user.id, kind, payload)
+    )
+
+def ai_job_accepted(job):
+    """202 response pointing the client at the job's status URL"""
+    return jsonify({
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'status_url': url_for('get_ai_job', job_id=job['job_id']),
+        'result_reused': job['reused']
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_ai_job(job_id):
+    """Status of a background AI job; 'result' holds the endpoint's usual response once done"""
+    job = ai_jobs.get(job_id, user_id=current_user.id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, **job})
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+@login_required
+def stream_ai_job(job_id):
+    """Server-sent 'status' events for a background AI job (on status or progress changes) until it finishes"""
+    user_id = current_user.id
+    if ai_jobs.get(job_id, user_id=user_id) is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    def generate():
+        last_state = None
+        while True:
+            job = ai_jobs.get(job_id, user_id=user_id)
+            if job is None:
+                # Purged (past its TTL) or removed since the stream started
+                yield sse_event({'type': 'error', 'job_id': job_id, 'error': 'Job not found'})
+                return
+            state = (job['status'], job['progress'])
+            if state != last_state:
+                last_state = state
+                yield sse_event({'type': 'status', **job})
+            if job['status'] in (JOB_DONE, JOB_FAILED):
+                return
+            time.sleep(JOB_EVENTS_POLL_SECONDS)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # --- Endpoint: AI Chat about Vignette ---
+# The prompt/logging helpers are shared with the native async handler in asgi.py
+
+def vignette_chat_prompt(vignette, user_message):
+    """Build the provider prompt for a question about a vignette"""
+    return f"""Here is the vignette we're discussing:\n        \"{vignette}\"\n        \n        Student's question/comment: {user_message}\n        \n        Please provide a helpful, educational response following the guidelines above."""
+
+def log_vignette_chat_input(user_id, vignette, user_message):
+    """Log the student's message for vignette chat"""
+    log_chat_interaction(
+        user_id=user_id,
+        chat_type='vignette_chat',
+        message_type='user_input',
+        content=user_message,
+        context_data={
+            'vignette_length': len(vignette),
+            'vignette_sample': vignette[:200]
+        }
+    )
+
+def finish_vignette_chat(user_id, vignette, user_message, start_time, result, model, truncated=False):
+    """Log the AI reply for vignette chat and return the response payload"""
+    processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
+    
+    # Log AI response
+    log_chat_interaction(
+        user_id=user_id,
+        chat_type='vignette_chat',
+        message_type='ai_response',
+        content=result,
+        context_data={
+            'vignette_length': len(vignette),
+            'vignette_sample': vignette[:200],
+            'user_question': user_message,
+            'truncated': truncated
+        },
+        ai_model=model,
+        ai_response=result,
+        processing_time=processing_time
+    )
+    
+    return {'response': result, 'status': 'success'}
+
+def vignette_chat_fallback(user_message):
+    """Canned reply used when the chat request itself fails"""
+    fallback_response = f"""Thank you for your question about the vignette. I can see you're interested in discussing: \"{user_message}\"\n\nThis vignette presents an interesting academic scenario. Here are some points to consider:\n\n1. **Student Background**: The scenario involves a student with specific characteristics and circumstances.\n2. **Support Strategy**: Consider how the support approach might impact the student's success.\n3. **Outcomes**: Think about what factors might have contributed to the results.\n\nWhat specific aspect of this scenario would you like to explore further? For example:\n- The effectiveness of the support method used\n- How the student's background might influence their learning\n- Alternative approaches that could have been considered\n\nI'm here to help you think through these educational scenarios!"""
+    return {'response': fallback_response, 'status': 'success'}
+
 @app.route('/api/chat', methods=['POST'])
 @login_required
 def vignette_chat():
@@ -1201,49 +2096,26 @@ def vignette_chat():
     
     # Log user input for vignette chat
     start_time = time.time()
-    log_chat_interaction(
-        user_id=current_user.id,
-        chat_type='vignette_chat',
-        message_type='user_input',
-        content=user_message,
-        context_data={
-            'vignette_length': len(vignette),
-            'vignette_sample': vignette[:200]
-        }
-    )
+    log_vignette_chat_input(current_user.id, vignette, user_message)
     
     try:
         # Use configured AI service for the chat
-        prompt = f"""Here is the vignette we're discussing:\n        \"{vignette}\"\n        \n        Student's question/comment: {user_message}\n        \n        Please provide a helpful, educational response following the guidelines above."""
-        
-        result, model = make_ai_call(prompt, CHAT_SYSTEM_PROMPT)
+        prompt = vignette_chat_prompt(vignette, user_message)
+        user_id = current_user.id
         
-        processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
+        def finish(result, model, truncated=False):
+            return finish_vignette_chat(user_id, vignette, user_message, start_time, result, model, truncated)
         
-        # Log AI response
-        log_chat_interaction(
-            user_id=current_user.id,
-            chat_type='vignette_chat',
-            message_type='ai_response',
-            content=result,
-            context_data={
-                'vignette_length': len(vignette),
-                'vignette_sample': vignette[:200],
-                'user_question': user_message
-            },
-            ai_model=model,
-            ai_response=result,
-            processing_time=processing_time
-        )
+        if wants_stream(data):
+            return stream_chat_response(stream_ai_call(prompt, CHAT_SYSTEM_PROMPT), finish)
         
-        return jsonify({'response': result, 'status': 'success'})
+        result, model = make_ai_call(prompt, CHAT_SYSTEM_PROMPT, endpoint='chat')
+        return jsonify(finish(result, model))
         
     except Exception as e:
         print(f"Chat API Error: {str(e)}")  # Add logging
         # Return a fallback response instead of error
-        fallback_response = f"""Thank you for your question about the vignette. I can see you're interested in discussing: \"{user_message}\"\n\nThis vignette presents an interesting academic scenario. Here are some points to consider:\n\n1. **Student Background**: The scenario involves a student with specific characteristics and circumstances.\n2. **Support Strategy**: Consider how the support approach might impact the student's success.\n3. **Outcomes**: Think about what factors might have contributed to the results.\n\nWhat specific aspect of this scenario would you like to explore further? For example:\n- The effectiveness of the support method used\n- How the student's background might influence their learning\n- Alternative approaches that could have been considered\n\nI'm here to help you think through these educational scenarios!"""
-        
-        return jsonify({'response': fallback_response, 'status': 'success'})
+        return jsonify(vignette_chat_fallback(user_message))
 
 # --- Endpoint: Student Bias Analysis (after 10+ interactions) ---
 @app.route('/api/student-bias', methods=['POST'])  
@@ -1268,44 +2140,55 @@ def student_bias_analysis():
         }
     )
     
-    try:
-        # Load system prompt from text file
-        system_prompt = load_system_prompt('bias_analyst')
-        
-        # Use default AI service configuration
-        ai_service = 'google'
-        ai_model = 'gemini-1.5-pro'
-        
-        # Use bias analyst chatbot for analysis
-        prompt = f"""Vignette to analyze:\n{vignette}\n\nPlease provide your bias analysis following the guidelines above. This analysis is for educational purposes to help the student understand potential biases in academic scenarios."""
-        
-        result, model = make_ai_call(prompt, system_prompt, service=ai_service, model=ai_model)
-        
-        processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
-        
-        # Log AI response
-        log_chat_interaction(
-            user_id=current_user.id,
-            chat_type='student_bias_analysis',
-            message_type='ai_response',
-            content=result,
-            context_data={
-                'vignette_length': len(vignette),
-                'vignette_sample': vignette[:200],
-                'analysis_type': 'bias_analysis'
-            },
-            ai_model=model,
-            ai_response=result,
-            processing_time=processing_time
-        )
-        
-        return jsonify({'bias_analysis': result, 'status': 'success'})
-        
-    except Exception as e:
-        print(f"Student Bias Analysis Error: {str(e)}")
-        fallback_analysis = f"""I apologize, but I'm unable to perform the bias analysis at this time due to a technical issue. \n\nHowever, here are some general questions you can consider when analyzing your vignette for potential bias:\n\n1. **Gender Bias**: Does the scenario make assumptions based on gender or pronouns?\n2. **Cultural Bias**: Are there stereotypes related to nationality or cultural background?\n3. **Academic Field Bias**: Does the scenario reflect stereotypes about certain fields of study?\n4. **Performance Bias**: Are the expectations and outcomes influenced by demographic factors?\n5. **Support Bias**: Is the type of support offered influenced by student characteristics?\n\nConsider discussing these aspects with your instructor or peers for a more comprehensive analysis."""
-        
-        return jsonify({'bias_analysis': fallback_analysis, 'status': 'success'})
+    user_id = current_user.id
+    
+    def run():
+        try:
+            # Load system prompt from text file
+            system_prompt = load_system_prompt('bias_analyst')
+            
+            # Use default AI service configuration
+            ai_service = 'google'
+            ai_model = 'gemini-1.5-pro'
+            
+            # Use bias analyst chatbot for analysis
+            prompt = f"""Vignette to analyze:\n{vignette}\n\nPlease provide your bias analysis following the guidelines above. This analysis is for educational purposes to help the student understand potential biases in academic scenarios."""
+            
+            result, model = make_ai_call(prompt, system_prompt, service=ai_service, model=ai_model,
+                                         cache=is_response_cache_enabled('student_bias'))
+            if model == 'test-mode':
+                mark_result_degraded()
+            
+            processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
+            
+            # Log AI response
+            log_chat_interaction(
+                user_id=user_id,
+                chat_type='student_bias_analysis',
+                message_type='ai_response',
+                content=result,
+                context_data={
+                    'vignette_length': len(vignette),
+                    'vignette_sample': vignette[:200],
+                    'analysis_type': 'bias_analysis'
+                },
+                ai_model=model,
+                ai_response=result,
+                processing_time=processing_time
+            )
+            
+            return {'bias_analysis': result, 'status': 'success'}
+            
+        except Exception as e:
+            print(f"Student Bias Analysis Error: {str(e)}")
+            mark_result_degraded()
+            fallback_analysis = f"""I apologize, but I'm unable to perform the bias analysis at this time due to a technical issue. \n\nHowever, here are some general questions you can consider when analyzing your vignette for potential bias:\n\n1. **Gender Bias**: Does the scenario make assumptions based on gender or pronouns?\n2. **Cultural Bias**: Are there stereotypes related to nationality or cultural background?\n3. **Academic Field Bias**: Does the scenario reflect stereotypes about certain fields of study?\n4. **Performance Bias**: Are the expectations and outcomes influenced by demographic factors?\n5. **Support Bias**: Is the type of support offered influenced by student characteristics?\n\nConsider discussing these aspects with your instructor or peers for a more comprehensive analysis."""
+            
+            return {'bias_analysis': fallback_analysis, 'status': 'success'}
+    
+    if data.get('background'):
+        return ai_job_accepted(start_ai_job('student_bias', run, data))
+    return jsonify(run())
 
 # --- Endpoint: Prompt Engineering Assistant ---
 @app.route('/api/prompt-engineering', methods=['POST'])
@@ -1394,46 +2277,62 @@ def prompt_engineering():
         
         # Check if we should generate final prompt
         final_prompt = None
+        final_prompt_job = None
        
         if new_question_count >= 7 or "final prompt" in result.lower():
             # Let AI craft the final optimized prompt
             prompt_crafting_request = f"""Based on our conversation where all questions have been answered, please craft a professional, optimized AI prompt that incorporates all the information we've discussed. \n\nHere's what we've gathered:\n- Task: {updated_prompt_data.get('task', 'Not specified')}\n- Context: {updated_prompt_data.get('context', 'Not specified')}\n- Audience: {updated_prompt_data.get('audience', 'Not specified')}\n- Format: {updated_prompt_data.get('format', 'Not specified')}\n- Tone: {updated_prompt_data.get('tone', 'Not specified')}\n- Constraints: {updated_prompt_data.get('constraints', 'Not specified')}\n- Examples/Details: {updated_prompt_data.get('examples', 'Not specified')}\n\nPlease create a single, well-crafted prompt that someone can copy and paste into any AI system to get excellent results. The prompt should be:\n1. Clear and specific\n2. Include all necessary context\n3. Specify the desired output format\n4. Include any important constraints\n5. Be optimized for best AI performance\n\nReturn ONLY the final prompt, no additional text."""
             
-            try:
-                # prompt_response = model.generate_content(prompt_crafting_request)
-                result, model = make_ai_call(
-                    prompt_crafting_request,
-                    system_prompt,
-                    service,
-                    model= model_name 
+            user_id = current_user.id
+            
+            def craft_final_prompt():
+                crafted, crafted_model = result, model
+                try:
+                    # prompt_response = model.generate_content(prompt_crafting_request)
+                    crafted, crafted_model = make_ai_call(
+                        prompt_crafting_request,
+                        system_prompt,
+                        service,
+                        model= model_name 
+                    )
+                    final_prompt = crafted
+                    if crafted_model == 'test-mode':
+                        mark_result_degraded()
+                except Exception as e:
+                    # Fallback if AI crafting fails
+                    print(f"Final prompt crafting failed: {e}")
+                    mark_result_degraded()
+                    final_prompt = f"Create a comprehensive {updated_prompt_data.get('task', 'response')} that addresses all the requirements we discussed in our conversation."
+                # Log AI response
+                log_chat_interaction(
+                    user_id=user_id,
+                    chat_type='prompt_engineering',
+                    message_type='ai_response',
+                    content=final_prompt,
+                    context_data={
+                        'question_count': question_count,
+                        'prompt_data': str(prompt_data),
+                        'user_question': user_message,
+                        'system_prompt_length': len(system_prompt) 
+                    },
+                    ai_model=crafted_model,
+                    ai_response=crafted,
+                    processing_time=processing_time
                 )
-                final_prompt = result
-            except Exception as e:
-                # Fallback if AI crafting fails
-                print("here")
-                print(e)
-                final_prompt = f"Create a comprehensive {updated_prompt_data.get('task', 'response')} that addresses all the requirements we discussed in our conversation."
-            # Log AI response
-            log_chat_interaction(
-                user_id=current_user.id,
-                chat_type='prompt_engineering',
-                message_type='ai_response',
-                content=final_prompt,
-                context_data={
-                    'question_count': question_count,
-                    'prompt_data': str(prompt_data),
-                    'user_question': user_message,
-                    'system_prompt_length': len(system_prompt) 
-                },
-                ai_model=model,
-                ai_response=result,
-                processing_time=processing_time
-            )            
+                return {'response': crafted, 'final_prompt': final_prompt}
+            
+            # Background mode answers the question now and crafts the final prompt as a job
+            if data.get('background'):
+                final_prompt_job = start_ai_job('prompt_engineering_final', craft_final_prompt, updated_prompt_data)
+            else:
+                crafted = craft_final_prompt()
+                result, final_prompt = crafted['response'], crafted['final_prompt']
         return jsonify({
             'response': result,
             'question_count': new_question_count,
             'prompt_data': updated_prompt_data,
             'final_prompt': final_prompt,
+            'final_prompt_job_id': final_prompt_job['job_id'] if final_prompt_job else None,
             'status': 'success'
         })
         
@@ -1531,6 +2430,53 @@ def prompt_discussion():
         return jsonify({'response': fallback_response, 'status': 'success'})
 
 
+# --- Map-reduce interpretation for inputs too large for one request ---
+def interpret_data_in_chunks(data_text, system_prompt, request_details, tabular=False, cache=False):
+    """Interpret each chunk of data_text separately, then merge the notes; returns (result, model)"""
+    chunks = split_into_chunks(data_text, repeat_header=tabular)
+    models = []
+    print(f"🧩 Interpreting data in {len(chunks)} chunks")
+    
+    def interpret_chunk(chunk, index, total):
+        prompt = f"""PARTIAL INTERPRETATION REQUEST (part {index + 1} of {total}):\n\n{request_details}\n\nThis dataset is too large to read at once, so it has been split into {total} parts. Describe the key values, statistics, patterns and anomalies in this part only, concisely and factually, keeping exact figures. Your notes will be combined with the notes on the other parts.\n\nData (part {index + 1} of {total}):\n{chunk}"""
+        result, model = make_ai_call(prompt, system_prompt, cache=cache, endpoint='interpret_data')
+        models.append(model)
+        return result
+    
+    def merge(partials, final):
+        notes = "\n\n".join(f"--- Notes {i + 1} ---\n{partial}" for i, partial in enumerate(partials))
+        if final:
+            prompt = f"""INTERPRETATION REQUEST:\n\n{request_details}\n\nThe data was too large to read at once, so it was split into parts and each part was described separately. Notes on the parts, in order:\n\n{notes}\n\nCombine these notes into one comprehensive interpretation of the whole dataset following the framework outlined in the system prompt. Focus on the educational research perspective and tailor the complexity to the specified audience level."""
+        else:
+            prompt = f"""Merge these notes on consecutive parts of one dataset into a single set of concise notes. Keep every important figure, pattern and anomaly.\n\n{notes}"""
+        result, model = make_ai_call(prompt, system_prompt, cache=cache, endpoint='interpret_data')
+        models.append(model)
+        return result
+    
+    result = map_reduce(chunks, interpret_chunk, merge, progress=report_job_progress)
+    if 'test-mode' in models:
+        # Part of the answer is test-mode text (map calls run on pool threads, so flag it here)
+        mark_result_degraded()
+    return result, models[-1]
+
+
+def condense_analysis(analysis, user_message):
+    """Shorten an over-long analysis to what matters for the user's question, by map-reduce"""
+    chunks = split_into_chunks(analysis)
+    print(f"🧩 Condensing analysis of {len(analysis)} chars in {len(chunks)} chunks")
+    
+    def condense_chunk(chunk, index, total):
+        prompt = f"""Below is part {index + 1} of {total} of a long data analysis. Condense it, keeping every finding, figure and caveat that could matter for this question:\n\n{user_message}\n\nANALYSIS (part {index + 1} of {total}):\n{chunk}"""
+        return make_ai_call(prompt, endpoint='interpret_data')[0]
+    
+    def merge(partials, final):
+        notes = "\n\n".join(partials)
+        prompt = f"""Merge these condensed parts of one data analysis, in order, into a single coherent condensed analysis. Keep every figure and caveat.\n\n{notes}"""
+        return make_ai_call(prompt, endpoint='interpret_data')[0]
+    
+    return map_reduce(chunks, condense_chunk, merge)
+
+
 # --- Endpoint: Data Interpretation ---
 @app.route('/api/interpret-data', methods=['POST'])
 @login_required
@@ -1573,89 +2519,118 @@ def interpret_data():
         'target_insights': target_insights
     })
     
-    try:
-        # Load system prompt from text file
-        system_prompt = load_system_prompt('data_interpreter')
-        
-        # Create comprehensive interpretation prompt
-        interpretation_prompt = f"""INTERPRETATION REQUEST:\n\nResearch Context: {research_context if research_context else 'General educational research context'}\n\nAnalysis Type: {analysis_type if analysis_type else 'General statistical analysis'}\n\nTarget Insights: {target_insights if target_insights else 'General interpretation and educational implications'}\n\nAudience Level: {audience_level}\n\nData Type: {data_type}\n\nData to Interpret:\n{data_content}\n\nPlease provide a comprehensive interpretation following the framework outlined in the system prompt. Focus on the educational research perspective and tailor the complexity to the specified audience level."""
-        
-        # Use the specified AI service and model
-        result, model = make_ai_call(
-            interpretation_prompt, 
-            system_prompt#, 
-            # service=ai_service, 
-            # model=ai_model, 
-            # user_api_key=user_api_key
-        )
-        log_chat_interaction(
-            user_id=user_id,
-            chat_type='data_interpreter',
-            message_type='user_input',
-            content=interpretation_prompt,
-            context_data={
-                'data_type': data_type,
-                'analysis_type': analysis_type,
-                'audience_level': audience_level,
-                'research_context': research_context,
-                'target_insights': target_insights,
-                'input_data_sample': data_content[:500]
-            },
-            ai_model=model 
-        )
-        
-        processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
-        
-        # Log AI response
-        log_chat_interaction(
-            user_id=user_id,
-            chat_type='data_interpreter',
-            message_type='ai_response',
-            content=result,
-            context_data={
-                'data_type': data_type,
-                'analysis_type': analysis_type,
-                'audience_level': audience_level,
-                'research_context': research_context,
-                'target_insights': target_insights,
-                'input_data_sample': data_content[:500]
-            },
-            ai_model=model,
-            ai_response=result,
-            processing_time=processing_time
-        )
-        
-        # Log data analysis operation
-        log_data_analysis(
-            user_id=user_id,
-            analysis_type=f'data_interpretation_{data_type}',
-            input_data=data_content,
-            generated_data=result,
-            ai_model=model,
-            processing_time=processing_time,
-            additional_context={
-                'research_context': research_context,
-                'target_insights': target_insights,
-                'audience_level': audience_level
-            }
-        )
-        
-        return jsonify({'analysis': result, 'status': 'success'})
-        
-    except Exception as e:
-        print(f"Data Interpretation Error: {str(e)}")
-        
-        # Provide fallback interpretation based on analysis type
-        if analysis_type == 'statistical_test':
-            fallback_analysis = f"""I apologize, but I'm having trouble interpreting your statistical test results right now. Here's some general guidance for interpreting statistical tests in educational research:\n\n**Key Elements to Consider:**\n- **Statistical Significance**: Look at p-values (typically p < 0.05 indicates significance)\n- **Effect Size**: Consider practical significance, not just statistical significance\n- **Confidence Intervals**: These provide a range of plausible values\n- **Educational Implications**: What do these results mean for teaching and learning?\n\nFor a more detailed interpretation, please try again or consult with a statistician."""
-        
-        elif analysis_type == 'network_analysis':
-            fallback_analysis = f"""I apologize, but I'm having trouble interpreting your network analysis right now. Here's some general guidance for network analysis in educational research:\n\n**Key Network Metrics:**\n- **Centrality Measures**: Who are the key players in the network?\n- **Clustering**: Are there distinct groups or communities?\n- **Density**: How connected is the network overall?\n- **Educational Applications**: How do these patterns relate to learning, collaboration, or communication?\n\nFor a more detailed interpretation, please try again with a smaller dataset."""
-        
-        else:
-            fallback_analysis = f"""I apologize, but I'm having trouble interpreting your data right now. Here's some general guidance for data interpretation in educational research:\n\n**General Interpretation Framework:**\n- **Descriptive Summary**: What does the data show at face value?\n- **Patterns and Trends**: What patterns emerge from the analysis?\n- **Educational Significance**: How do these findings relate to learning and teaching?\n- **Practical Implications**: What actions might educators take based on these results?\n- **Limitations**: What are the constraints and caveats of this analysis?\n\nPlease try again with a smaller data sample or check the format."""
-        
-        return jsonify({'analysis': fallback_analysis, 'status': 'success'})
+    def run():
+        try:
+            # Load system prompt from text file
+            system_prompt = load_system_prompt('data_interpreter')
+            
+            # Large tables are summarized locally so the prompt grows with columns, not rows
+            data_for_prompt, data_info = prepare_data_for_prompt(data_content)
+            
+            request_details = f"""Research Context: {research_context if research_context else 'General educational research context'}\n\nAnalysis Type: {analysis_type if analysis_type else 'General statistical analysis'}\n\nTarget Insights: {target_insights if target_insights else 'General interpretation and educational implications'}\n\nAudience Level: {audience_level}\n\nData Type: {data_type}"""
+            
+            # Create comprehensive interpretation prompt
+            interpretation_prompt = f"""INTERPRETATION REQUEST:\n\n{request_details}\n\nData to Interpret:\n{data_for_prompt}\n\nPlease provide a comprehensive interpretation following the framework outlined in the system prompt. Focus on the educational research perspective and tailor the complexity to the specified audience level."""
+            
+            if needs_chunking(data_for_prompt):
+                # Too large for one request: interpret parts concurrently, then merge them
+                result, model = interpret_data_in_chunks(
+                    data_for_prompt,
+                    system_prompt,
+                    request_details,
+                    tabular='rows' in data_info and not data_info['summarized'],
+                    cache=is_response_cache_enabled('interpret_data')
+                )
+            else:
+                # Use the specified AI service and model
+                result, model = make_ai_call(
+                    interpretation_prompt, 
+                    system_prompt, 
+                    # service=ai_service, 
+                    # model=ai_model, 
+                    # user_api_key=user_api_key
+                    cache=is_response_cache_enabled('interpret_data'),
+                    endpoint='interpret_data'
+                )
+            if model == 'test-mode':
+                mark_result_degraded()
+            log_chat_interaction(
+                user_id=user_id,
+                chat_type='data_interpreter',
+                message_type='user_input',
+                content=interpretation_prompt,
+                context_data={
+                    'data_type': data_type,
+                    'analysis_type': analysis_type,
+                    'audience_level': audience_level,
+                    'research_context': research_context,
+                    'target_insights': target_insights,
+                    'input_data_sample': data_content[:500]
+                },
+                ai_model=model 
+            )
+            
+            processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
+            
+            # Log AI response
+            log_chat_interaction(
+                user_id=user_id,
+                chat_type='data_interpreter',
+                message_type='ai_response',
+                content=result,
+                context_data={
+                    'data_type': data_type,
+                    'analysis_type': analysis_type,
+                    'audience_level': audience_level,
+                    'research_context': research_context,
+                    'target_insights': target_insights,
+                    'input_data_sample': data_content[:500]
+                },
+                ai_model=model,
+                ai_response=result,
+                processing_time=processing_time
+            )
+            
+            # Log data analysis operation
+            log_data_analysis(
+                user_id=user_id,
+                analysis_type=f'data_interpretation_{data_type}',
+                input_data=data_content,
+                generated_data=result,
+                ai_model=model,
+                processing_time=processing_time,
+                additional_context={
+                    'research_context': research_context,
+                    'target_insights': target_insights,
+                    'audience_level': audience_level,
+                    'data_summarized': data_info['summarized'],
+                    'data_rows': data_info.get('rows'),
+                    'data_chunked': needs_chunking(data_for_prompt)
+                }
+            )
+            
+            return {'analysis': result, 'status': 'success'}
+            
+        except Exception as e:
+            print(f"Data Interpretation Error: {str(e)}")
+            mark_result_degraded()
+            
+            # Provide fallback interpretation based on analysis type
+            if analysis_type == 'statistical_test':
+                fallback_analysis = f"""I apologize, but I'm having trouble interpreting your statistical test results right now. Here's some general guidance for interpreting statistical tests in educational research:\n\n**Key Elements to Consider:**\n- **Statistical Significance**: Look at p-values (typically p < 0.05 indicates significance)\n- **Effect Size**: Consider practical significance, not just statistical significance\n- **Confidence Intervals**: These provide a range of plausible values\n- **Educational Implications**: What do these results mean for teaching and learning?\n\nFor a more detailed interpretation, please try again or consult with a statistician."""
+            
+            elif analysis_type == 'network_analysis':
+                fallback_analysis = f"""I apologize, but I'm having trouble interpreting your network analysis right now. Here's some general guidance for network analysis in educational research:\n\n**Key Network Metrics:**\n- **Centrality Measures**: Who are the key players in the network?\n- **Clustering**: Are there distinct groups or communities?\n- **Density**: How connected is the network overall?\n- **Educational Applications**: How do these patterns relate to learning, collaboration, or communication?\n\nFor a more detailed interpretation, please try again with a smaller dataset."""
+            
+            else:
+                fallback_analysis = f"""I apologize, but I'm having trouble interpreting your data right now. Here's some general guidance for data interpretation in educational research:\n\n**General Interpretation Framework:**\n- **Descriptive Summary**: What does the data show at face value?\n- **Patterns and Trends**: What patterns emerge from the analysis?\n- **Educational Significance**: How do these findings relate to learning and teaching?\n- **Practical Implications**: What actions might educators take based on these results?\n- **Limitations**: What are the constraints and caveats of this analysis?\n\nPlease try again with a smaller data sample or check the format."""
+            
+            return {'analysis': fallback_analysis, 'status': 'success'}
+    
+    # Large datasets can outlast proxy timeouts; background mode returns a job id to poll
+    if data.get('background'):
+        return ai_job_accepted(start_ai_job('interpret_data', run, data))
+    return jsonify(run())
 
 # --- Endpoint: Interactive Data Interpretation Chat ---
 @app.route('/api/interpret-chat', methods=['POST'])
@@ -1690,51 +2665,61 @@ def interpret_chat():
     )
     
     try:
+        if needs_chunking(current_analysis):
+            # An analysis longer than one request holds is condensed around the question first
+            current_analysis = condense_analysis(current_analysis, user_message)
+        
         # Create chat prompt for data interpretation discussion
         chat_prompt = f"""You are an expert data interpreter engaged in an interactive discussion about a statistical analysis. Your role is to help the user understand, refine, and explore their data interpretation through conversation.\n\nCURRENT ANALYSIS CONTEXT:\nResearch Context: {research_context if research_context else 'General educational research'}\nAnalysis Type: {analysis_type if analysis_type else 'General statistical analysis'}\nTarget Insights: {target_insights if target_insights else 'General interpretation'}\nAudience Level: {audience_level}\n\nCURRENT ANALYSIS:\n{current_analysis if current_analysis else 'No analysis provided yet'}\n\nUSER'S QUESTION/REQUEST:\n{user_message}\n\nINSTRUCTIONS:\n1. Respond to the user's specific question or request about the analysis\n2. Provide educational explanations appropriate for their audience level\n3. If they ask for clarifications, explain statistical concepts clearly\n4. If they want to explore implications, discuss practical applications\n5. If they request modifications to the analysis, provide an updated interpretation\n6. Be conversational, helpful, and educational\n7. Encourage critical thinking about the results\n\nIMPORTANT: If you provide a significantly updated or refined analysis based on their request, clearly indicate it as "UPDATED ANALYSIS:" followed by the complete new interpretation."""
         
-        result, model = make_ai_call(chat_prompt)
+        def finish(result, model, truncated=False):
+            processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
         
-        processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
+            # Log AI chat response
+            log_chat_interaction(
+                user_id=user_id,
+                chat_type='data_interpreter_chat',
+                message_type='ai_response',
+                content=result,
+                context_data={
+                    'research_context': research_context,
+                    'analysis_type': analysis_type,
+                    'target_insights': target_insights,
+                    'audience_level': audience_level,
+                    'user_question': user_message,
+                    'current_analysis_sample': current_analysis[:500] if current_analysis else None,
+                    'truncated': truncated
+                },
+                ai_model=model,
+                ai_response=result,
+                processing_time=processing_time
+            )
         
-        # Log AI chat response
-        log_chat_interaction(
-            user_id=user_id,
-            chat_type='data_interpreter_chat',
-            message_type='ai_response',
-            content=result,
-            context_data={
-                'research_context': research_context,
-                'analysis_type': analysis_type,
-                'target_insights': target_insights,
-                'audience_level': audience_level,
-                'user_question': user_message,
-                'current_analysis_sample': current_analysis[:500] if current_analysis else None
-            },
-            ai_model=model,
-            ai_response=result,
-            processing_time=processing_time
-        )
+            # Check if there's an updated analysis in the response
+            updated_analysis = None
+            if "UPDATED ANALYSIS:" in result:
+                # Extract the updated analysis
+                parts = result.split("UPDATED ANALYSIS:")
+                if len(parts) > 1:
+                    updated_analysis = parts[1].strip()
+                    # Remove the updated analysis from the main response to avoid duplication
+                    result = parts[0].strip()
+        
+            response_data = {
+                'response': result,
+                'status': 'success'
+            }
         
-        # Check if there's an updated analysis in the response
-        updated_analysis = None
-        if "UPDATED ANALYSIS:" in result:
-            # Extract the updated analysis
-            parts = result.split("UPDATED ANALYSIS:")
-            if len(parts) > 1:
-                updated_analysis = parts[1].strip()
-                # Remove the updated analysis from the main response to avoid duplication
-                result = parts[0].strip()
+            if updated_analysis:
+                response_data['updated_analysis'] = updated_analysis
         
-        response_data = {
-            'response': result,
-            'status': 'success'
-        }
+            return response_data
         
-        if updated_analysis:
-            response_data['updated_analysis'] = updated_analysis
+        if wants_stream(data):
+            return stream_chat_response(stream_ai_call(chat_prompt), finish)
         
-        return jsonify(response_data)
+        result, model = make_ai_call(chat_prompt, endpoint='chat')
+        return jsonify(finish(result, model))
         
     except Exception as e:
         print(f"Interpretation Chat Error: {str(e)}")
@@ -1743,16 +2728,10 @@ def interpret_chat():
         return jsonify({'response': fallback_response, 'status': 'success'})
 
 # --- Endpoint: Educational Chatbot ---
-@app.route('/api/educational-chat', methods=['POST'])
-@login_required
-def educational_chat():
-    data = request.json
-    user_message = data.get('message')
-    system_prompt = data.get('system_prompt')
-    chat_history = data.get('chat_history', [])
-    config = data.get('config', {})
-    
-    # Get AI service info if custom
+# The prompt/logging helpers are shared with the native async handler in asgi.py
+
+def educational_chat_request(data):
+    """Pull the chat fields out of a request body, resolving which API key to use"""
     ai_service = data.get('ai_service')
     use_custom_keys = data.get('use_custom_keys', False)
     user_openai_key = data.get('openai_key', '')
@@ -1766,96 +2745,141 @@ def educational_chat():
         elif ai_service == 'google' and user_google_key:
             user_api_key = user_google_key
     
-    if not user_message:
-        return jsonify({'error': 'Message required'}), 400
-    
-    if not system_prompt:
-        return jsonify({'error': 'System prompt required'}), 400
-    
-    # Log user chat message
-    start_time = time.time()
-    user_id = current_user.id if current_user.is_authenticated else 'anonymous'
+    return {
+        'user_message': data.get('message'),
+        'system_prompt': data.get('system_prompt'),
+        'chat_history': data.get('chat_history', []),
+        'config': data.get('config', {}),
+        'ai_service': ai_service,
+        'use_custom_keys': use_custom_keys,
+        'user_api_key': user_api_key
+    }
+
+def log_educational_chat_input(user_id, chat):
+    """Log the student's message for educational chat"""
     log_chat_interaction(
         user_id=user_id,
         chat_type='educational_chat',
         message_type='user_input',
-        content=user_message,
+        content=chat['user_message'],
         context_data={
-            'system_prompt_length': len(system_prompt) if system_prompt else 0,
-            'chat_history_length': len(chat_history),
-            'config': str(config),
-            'ai_service': ai_service,
-            'use_custom_keys': use_custom_keys
+            'system_prompt_length': len(chat['system_prompt']) if chat['system_prompt'] else 0,
+            'chat_history_length': len(chat['chat_history']),
+            'config': str(chat['config']),
+            'ai_service': chat['ai_service'],
+            'use_custom_keys': chat['use_custom_keys']
         }
     )
+
+def educational_chat_model(chat):
+    """(service, model) for an educational chat request"""
+    if chat['config'].get('modelType') == 'custom' and chat['ai_service'] and chat['user_api_key']:
+        # Use custom AI service
+        service = chat['ai_service']
+    else:
+        # Use system default
+        service = DEFAULT_AI_SERVICE
+    # Use default model for the service
+    model = DEFAULT_OPENAI_MODEL if service == 'openai' else DEFAULT_GOOGLE_MODEL
+    return service, model
+
+def educational_chat_context(chat, service, model):
+    """Recent client-supplied history as prompt text, within the history budget"""
+    conversation_context = ""
+    if chat['chat_history']:
+        history_lines = []
+        for msg in chat['chat_history']:
+            if msg.get('type') == 'user':
+                history_lines.append(f"Student: {msg.get('content', '')}\n")
+            elif msg.get('type') == 'bot':
+                history_lines.append(f"Assistant: {msg.get('content', '')}\n")
+        # As many recent messages as fit the history budget, however long they are
+        conversation_context = "".join(trim_history(history_lines, AI_HISTORY_TOKEN_BUDGET, service, model))
+    return conversation_context
+
+def educational_chat_prompt(chat, conversation_context):
+    """Build the provider prompt from the history and the new message"""
+    return f"""Previous conversation:\n{conversation_context}\n\nCurrent student message: {chat['user_message']}\n\nPlease respond as the educational assistant following your persona and guidelines."""
+
+def finish_educational_chat(user_id, chat, conversation_context, start_time, result, model, truncated=False):
+    """Log the AI reply for educational chat and return the response payload"""
+    processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
+    
+    # Log AI chat response
+    log_chat_interaction(
+        user_id=user_id,
+        chat_type='educational_chat',
+        message_type='ai_response',
+        content=result,
+        context_data={
+            'system_prompt_sample': chat['system_prompt'][:200] if chat['system_prompt'] else None,
+            'chat_history_length': len(chat['chat_history']),
+            'config': str(chat['config']),
+            'ai_service': chat['ai_service'],
+            'use_custom_keys': chat['use_custom_keys'],
+            'user_question': chat['user_message'],
+            'conversation_context_length': len(conversation_context),
+            'truncated': truncated
+        },
+        ai_model=model,
+        ai_response=result,
+        processing_time=processing_time
+    )
+    
+    return {'response': result, 'status': 'success'}
+
+def educational_chat_fallback(user_message):
+    """Canned reply used when the chat request itself fails"""
+    fallback_response = f"""I understand you're asking about: \"{user_message}\"\n\nI apologize, but I'm having a technical difficulty right now. However, I'd still like to help you learn! Here are some ways we can approach your question:\n\n1. **Break it down**: Can you tell me what specific part you'd like to understand better?\n2. **Context**: What have you already learned about this topic?\n3. **Application**: How do you think this might be used in real situations?\n\nPlease try asking your question again, and I'll do my best to help you understand the concept step by step!"""
+    return {'response': fallback_response, 'status': 'success'}
+
+@app.route('/api/educational-chat', methods=['POST'])
+@login_required
+def educational_chat():
+    data = request.json
+    chat = educational_chat_request(data)
+    
+    if not chat['user_message']:
+        return jsonify({'error': 'Message required'}), 400
+    
+    if not chat['system_prompt']:
+        return jsonify({'error': 'System prompt required'}), 400
+    
+    # Log user chat message
+    start_time = time.time()
+    user_id = current_user.id if current_user.is_authenticated else 'anonymous'
+    log_educational_chat_input(user_id, chat)
     
     try:
         # Determine AI service and model
-        if config.get('modelType') == 'custom' and ai_service and user_api_key:
-            # Use custom AI service
-            service = ai_service
-            api_key = user_api_key
-            # Use default model for the service
-            model = DEFAULT_OPENAI_MODEL if service == 'openai' else DEFAULT_GOOGLE_MODEL
-        else:
-            # Use system default
-            service = DEFAULT_AI_SERVICE
-            api_key = None
-            model = DEFAULT_OPENAI_MODEL if service == 'openai' else DEFAULT_GOOGLE_MODEL
-        
-        # Create conversation context from chat history
-        conversation_context = ""
-        if chat_history:
-            recent_history = chat_history[-6:]  # Last 6 messages for context
-            for msg in recent_history:
-                if msg.get('type') == 'user':
-                    conversation_context += f"Student: {msg.get('content', '')}\n"
-                elif msg.get('type') == 'bot':
-                    conversation_context += f"Assistant: {msg.get('content', '')}\n"
-        
-        # Create full prompt with context
-        full_prompt = f"""Previous conversation:\n{conversation_context}\n\nCurrent student message: {user_message}\n\nPlease respond as the educational assistant following your persona and guidelines."""
-        
-        # Make AI call
+        service, model = educational_chat_model(chat)
+        user_api_key = chat['user_api_key']
+        
+        # Create full prompt with context from chat history
+        conversation_context = educational_chat_context(chat, service, model)
+        full_prompt = educational_chat_prompt(chat, conversation_context)
+        
+        def finish(result, model, truncated=False):
+            return finish_educational_chat(user_id, chat, conversation_context, start_time, result, model, truncated)
+        
+        if wants_stream(data):
+            return stream_chat_response(stream_ai_call(full_prompt, chat['system_prompt'], service=service, model=model, user_api_key=user_api_key), finish)
+        
         result, model = make_ai_call(
             full_prompt,
-            system_prompt,
+            chat['system_prompt'],
             service=service,
             model=model,
-            user_api_key=user_api_key
-        )
-        
-        processing_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
-        
-        # Log AI chat response
-        log_chat_interaction(
-            user_id=user_id,
-            chat_type='educational_chat',
-            message_type='ai_response',
-            content=result,
-            context_data={
-                'system_prompt_sample': system_prompt[:200] if system_prompt else None,
-                'chat_history_length': len(chat_history),
-                'config': str(config),
-                'ai_service': ai_service,
-                'use_custom_keys': use_custom_keys,
-                'user_question': user_message,
-                'conversation_context_length': len(conversation_context)
-            },
-            ai_model=model,
-            ai_response=result,
-            processing_time=processing_time
+            user_api_key=user_api_key,
+            endpoint='chat'
         )
-        
-        return jsonify({'response': result, 'status': 'success'})
+        return jsonify(finish(result, model))
         
     except Exception as e:
         print(f"Educational Chat Error: {str(e)}")
         
         # Provide educational fallback response
-        fallback_response = f"""I understand you're asking about: \"{user_message}\"\n\nI apologize, but I'm having a technical difficulty right now. However, I'd still like to help you learn! Here are some ways we can approach your question:\n\n1. **Break it down**: Can you tell me what specific part you'd like to understand better?\n2. **Context**: What have you already learned about this topic?\n3. **Application**: How do you think this might be used in real situations?\n\nPlease try asking your question again, and I'll do my best to help you understand the concept step by step!"""
-        
-        return jsonify({'response': fallback_response, 'status': 'success'})
+        return jsonify(educational_chat_fallback(chat['user_message']))
 
 # --- Endpoint: AI Bias Analysis ---
 @app.route('/api/bias', methods=['POST'])
@@ -1864,7 +2888,7 @@ def bias_analysis():
     data = request.json
     vignette = data.get('vignette')
     api_key = data.get('api_key')
-    service = data.get('service', AI_SERVICE)
+    service = data.get('service', DEFAULT_AI_SERVICE)
     
     # log_interaction('user_input', 'bias_analysis', 'request_bias_analysis', details={'vignette': vignette})
     # Only return mock for explicit test requests
@@ -1877,30 +2901,50 @@ def bias_analysis():
     if not vignette:
         return jsonify({'error': 'Vignette required'}), 400
     
+    use_cache = is_response_cache_enabled('bias_analysis')
+    
     try:
         if service == 'google' or not api_key:
             # Use Google AI (embedded API key)
             model_name = 'gemini-pro'
-            model = genai.GenerativeModel(model_name)
             prompt = f"""{load_system_prompt("bias_analysis")}\n            \nVignette to analyze:\n{vignette}\n            \nPlease provide your bias analysis following the guidelines above."""
             
-            response = model.generate_content(prompt)
-            result = response.text
+            cache_key = ai_response_cache.make_key('google', model_name, None, prompt) if use_cache else None
+            cached = ai_response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                return jsonify({'bias_analysis': cached[0], 'service': 'google'})
+            
+            def analyze():
+                result = call_ai_provider('google', model_name, get_api_key('google'), prompt)
+                if cache_key:
+                    ai_response_cache.set(cache_key, result, model_name, 'google')
+                return result
+            
+            # Concurrent identical requests share one provider call
+            result = ai_inflight.do(cache_key, analyze) if cache_key else analyze()
             # log_interaction('ai_response', 'bias_analysis', 'bias_analysis_response', details={'vignette': vignette}, ai_model=model_name, ai_response=result)
             return jsonify({'bias_analysis': result, 'service': 'google'})
             
         elif service == 'openai':
             # Use OpenAI
-            from openai import OpenAI
-            client = OpenAI(api_key=api_key)
-            response = client.chat.completions.create(
-                model='gpt-4.1-nano',
-                messages=[
-                    {"role": "system", "content": "You are an expert in bias detection for academic vignettes."},
-                    {"role": "user", "content": f"Analyze the following vignette for bias and provide a brief explanation: {vignette}"}
-                ]
-            )
-            result = response.choices[0].message.content
+            system_prompt = "You are an expert in bias detection for academic vignettes."
+            prompt = f"Analyze the following vignette for bias and provide a brief explanation: {vignette}"
+            
+            cache_key = ai_response_cache.make_key('openai', 'gpt-4.1-nano', system_prompt, prompt) if use_cache else None
+            cached = ai_response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                return jsonify({'bias_analysis': cached[0], 'service': 'openai'})
+            
+            def analyze():
+                # The key comes with the request, so it is the caller's own and skips the shared circuit
+                result = call_ai_provider('openai', 'gpt-4.1-nano', api_key, prompt, system_prompt,
+                                          policy=get_ai_call_policy('bias_analysis'), user_key=True)
+                if cache_key:
+                    ai_response_cache.set(cache_key, result, 'gpt-4.1-nano', 'openai')
+                return result
+            
+            # Concurrent identical requests share one provider call
+            result = ai_inflight.do(cache_key, analyze) if cache_key else analyze()
             # log_interaction('ai_response', 'bias_analysis', 'bias_analysis_response', details={'vignette': vignette}, ai_model='gpt-3.5-turbo', ai_response=result)
             return jsonify({'bias_analysis': result, 'service': 'openai'})
             
@@ -1956,6 +3000,7 @@ def update_system_settings():
     if not data:
         return jsonify({'success': False, 'message': 'No data provided'}), 400
     save_system_settings(data)
+    reload_ai_config()
     return jsonify({'success': True, 'message': 'System settings updated successfully'})
 
 # --- Endpoints: Central Database Management (Admin) ---
@@ -1997,7 +3042,7 @@ def export_chat_logs():
         if not date_from and not date_to:
             # Get earliest and latest timestamps from database
             db_temp = CentralDatabase()
-            conn = sqlite3.connect('db/laila_central.db')
+            conn = get_connection()
             cursor = conn.cursor()
             try:
                 cursor.execute('SELECT MIN(timestamp), MAX(timestamp) FROM chat_logs')
@@ -2149,29 +3194,81 @@ def download_export(filename):
     except Exception as e:
         abort(404)
 
+# --- Endpoint: Full-Text Message Search (Admin) ---
+# e.g. /api/admin/search-messages?q=regression "p value"&module=Data Interpreter&date_from=2025-09-01
+@app.route('/api/admin/search-messages')
+@login_required
+@require_true_admin
+def search_chat_messages():
+    """Ranked keyword search over chat logs and chatbot messages, with snippets"""
+    try:
+        args = request.args
+        conn = get_connection()
+        try:
+            if not message_search_ready(conn):
+                return jsonify({'success': False, 'message': 'Message search index is not available'}), 503
+
+            user_id = None
+            if args.get('user'):
+                user_id = resolve_log_user(conn.cursor(), args['user'])
+                if user_id is None:
+                    return jsonify({'success': True, 'results': []})
+            date_from = args.get('date_from') and parse_log_date(args['date_from'], 'date_from').strftime('%Y-%m-%d')
+            date_to = args.get('date_to') and (parse_log_date(args['date_to'], 'date_to') + timedelta(days=1)).strftime('%Y-%m-%d')
+            # The index stores chatbot ids as integers, and a text value never equals one
+            chatbot_id = args.get('chatbot_id', type=int)
+            if args.get('chatbot_id') and chatbot_id is None:
+                return jsonify({'success': False, 'message': 'chatbot_id must be an integer'}), 400
+
+            results = search_messages(
+                conn, args.get('q', ''),
+                module=args.get('module'), sender=args.get('sender'), user_id=user_id,
+                chatbot_id=chatbot_id, source=args.get('source'),
+                date_from=date_from, date_to=date_to,
+                limit=args.get('limit', SEARCH_PAGE_SIZE), offset=args.get('offset', 0)
+            )
+
+            # Emails for the page's users in one query
+            user_ids = sorted({r['user_id'] for r in results if r['user_id'] is not None})
+            emails = {}
+            if user_ids:
+                emails = dict(conn.execute(
+                    f"SELECT id, email FROM users WHERE id IN ({', '.join('?' for _ in user_ids)})", user_ids
+                ).fetchall())
+            for result in results:
+                result['user_email'] = emails.get(result['user_id'])
+        finally:
+            conn.close()
+
+        return jsonify({'success': True, 'results': results})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"❌ Error searching messages: {str(e)}")
+        return jsonify({'success': False, 'message': 'Error searching messages'}), 500
+
 # --- Endpoints: Custom Chatbot Management (Admin) ---
 @app.route('/api/admin/chatbots')
 @login_required
 @require_true_admin
 def get_chatbots():
-    """Get all custom chatbots for admin management"""
+    """Get all custom chatbots for admin management (usage counts from the daily rollups)"""
     try:
-        conn = sqlite3.connect('db/laila_central.db')
+        totals = daily_rollups.chatbot_totals()
+        
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT c.*, u.fullname as created_by_name,
-                   COUNT(DISTINCT conv.id) as conversation_count,
-                   COUNT(DISTINCT conv.user_id) as unique_users
+            SELECT c.*, u.fullname as created_by_name
             FROM custom_chatbots c
             LEFT JOIN users u ON c.created_by = u.id
-            LEFT JOIN chatbot_conversations conv ON c.id = conv.chatbot_id
-            GROUP BY c.id
             ORDER BY c.created_at DESC
         ''')
         
         chatbots = []
         for row in cursor.fetchall():
+            conversation_count, unique_users = totals.get(row[0], (0, 0))
             chatbots.append({
                 'id': row[0],
                 'name': row[1],
@@ -2188,8 +3285,8 @@ def get_chatbots():
                 'deployment_settings': row[12],
                 'usage_count': row[13],
                 'created_by_name': row[14],
-                'conversation_count': row[15],
-                'unique_users': row[16]
+                'conversation_count': conversation_count,
+                'unique_users': unique_users
             })
         
         conn.close()
@@ -2211,9 +3308,9 @@ def get_chatbots():
 @login_required
 @require_true_admin
 def get_chatbot_stats():
-    """Get chatbot system statistics"""
+    """Get chatbot system statistics (conversation and message totals from the daily rollups)"""
     try:
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         # Combined stats query
@@ -2230,20 +3327,14 @@ def get_chatbot_stats():
         active_chatbots = row[1]
         total_interactions = row[2] or 0
         
-        # Total conversations
-        cursor.execute("SELECT COUNT(*) FROM chatbot_conversations")
-        total_conversations = cursor.fetchone()[0]
-        
-        # Unique users served
-        cursor.execute("SELECT COUNT(DISTINCT user_id) FROM chatbot_conversations WHERE user_id IS NOT NULL")
-        unique_users = cursor.fetchone()[0]
-        
-        # Total messages
-        cursor.execute("SELECT COUNT(*) FROM chatbot_messages")
-        total_messages = cursor.fetchone()[0]
-        
         conn.close()
         
+        # Conversations, messages and users served, from the daily rollups
+        usage = daily_rollups.chatbot_summary()
+        total_conversations = usage['total_conversations']
+        unique_users = usage['unique_users']
+        total_messages = usage['total_messages']
+        
         return jsonify({
             'success': True,
             'stats': {
@@ -2264,6 +3355,78 @@ def get_chatbot_stats():
             'error': str(e)
         }), 500
 
+@app.route('/api/admin/daily-activity')
+@login_required
+@require_true_admin
+def get_daily_activity():
+    """Per-day chatbot and chat log activity for charts (?days=30, optional chatbot_id, module)"""
+    try:
+        days = min(max(int(request.args.get('days', 30)), 1), 366)
+        chatbot_id = request.args.get('chatbot_id')
+        date_from = (datetime.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        series = daily_rollups.daily_series(
+            date_from,
+            chatbot_id=int(chatbot_id) if chatbot_id else None,
+            module=request.args.get('module')
+        )
+        return jsonify({'success': True, 'date_from': date_from, **series})
+    except ValueError:
+        return jsonify({'success': False, 'error': 'days and chatbot_id must be integers'}), 400
+    except Exception as e:
+        print(f"ERROR in get_daily_activity: {e}")
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# Custom chatbot configs (system prompt, service, model) keyed by chatbot id.
+# The admin create/update/toggle/delete endpoints bump the shared version so
+# every worker process picks up the change.
+chatbot_config_cache = VersionedCache('custom_chatbots')
+
+def get_chatbot_config(chatbot_id):
+    """Return (system_prompt, ai_service, ai_model) for a chatbot, or None if it does not exist"""
+    key = str(chatbot_id)
+    config = chatbot_config_cache.get(key)
+    if config is not None:
+        return config
+    
+    generation = chatbot_config_cache.generation()
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT system_prompt, ai_service, ai_model FROM custom_chatbots WHERE id = ?', (chatbot_id,))
+    config = cursor.fetchone()
+    conn.close()
+    
+    if config:
+        config = tuple(config)
+        chatbot_config_cache.set(key, config, generation)
+    return config
+
+def summarize_conversation(prompt):
+    """Summary call for conversation_memory; fails rather than storing test-mode text as a summary"""
+    summary, model = make_ai_call(prompt, endpoint='chat')
+    if model == 'test-mode':
+        raise Exception("No AI service available to summarize the conversation")
+    return summary
+
+# Chatbot history is rebuilt server-side from chatbot_messages (see conversation_memory.py)
+conversation_memory = ConversationMemory(summarize_conversation)
+
+def chatbot_conversation_owned(cursor, conversation_id, chatbot_id, user_id):
+    """True if the conversation exists, is with this chatbot and was started by this user"""
+    return cursor.execute('''
+        SELECT 1 FROM chatbot_conversations WHERE id = ? AND chatbot_id = ? AND user_id IS ?
+    ''', (conversation_id, chatbot_id, user_id)).fetchone() is not None
+
+def invalidate_chatbot_configs():
+    """Drop cached chatbot configs here and in every other worker process"""
+    try:
+        chatbot_config_cache.bump()
+    except Exception as e:
+        print(f"⚠️ Could not invalidate chatbot config cache: {e}")
+
 @app.route('/api/admin/chatbots/create', methods=['POST'])
 @login_required
 @require_true_admin
@@ -2273,16 +3436,13 @@ def create_chatbot():
         data = request.json
         
         # Get current user ID
-        from model.central_database_admin import CentralDatabase
-        db = CentralDatabase()
-        user_info = db.get_user_by_email(current_user.email)
-        user_id = user_info['id'] if user_info else None
+        user_id = get_current_user_id()
         
         # Generate internal name from display name
         import re
         internal_name = re.sub(r'[^a-zA-Z0-9_]', '_', data['display_name'].lower())
         
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -2299,6 +3459,7 @@ def create_chatbot():
         
         conn.commit()
         conn.close()
+        invalidate_chatbot_configs()
         
         return jsonify({
             'success': True,
@@ -2322,7 +3483,7 @@ def update_chatbot():
         data = request.json
         chatbot_id = data['id']
         
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -2340,6 +3501,7 @@ def update_chatbot():
         
         conn.commit()
         conn.close()
+        invalidate_chatbot_configs()
         
         return jsonify({
             'success': True,
@@ -2364,7 +3526,7 @@ def toggle_chatbot():
         chatbot_id = data['id']
         is_active = data['is_active']
         
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
@@ -2373,6 +3535,7 @@ def toggle_chatbot():
         
         conn.commit()
         conn.close()
+        invalidate_chatbot_configs()
         
         status = "activated" if is_active else "deactivated"
         return jsonify({
@@ -2397,17 +3560,19 @@ def delete_chatbot():
         data = request.json
         chatbot_id = data['id']
         
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         # Delete related data first
+        conversation_memory.forget_chatbot(cursor, chatbot_id)
         cursor.execute('DELETE FROM chatbot_messages WHERE chatbot_id = ?', (chatbot_id,))
         cursor.execute('DELETE FROM chatbot_conversations WHERE chatbot_id = ?', (chatbot_id,))
-        cursor.execute('DELETE FROM chatbot_analytics WHERE chatbot_id = ?', (chatbot_id,))
+        daily_rollups.forget_chatbot(cursor, chatbot_id)
         cursor.execute('DELETE FROM custom_chatbots WHERE id = ?', (chatbot_id,))
         
         conn.commit()
         conn.close()
+        invalidate_chatbot_configs()
         
         return jsonify({
             'success': True,
@@ -2429,7 +3594,7 @@ def delete_chatbot():
 def admin_get_users():
     """Get all users for admin management"""
     try:
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -2471,7 +3636,7 @@ def confirm_user():
             return jsonify({'error': 'Email is required'}), 400
         email = email.strip().lower()
         # Check if user exists
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('SELECT email, fullname FROM users WHERE email = ?', (email,))
@@ -2487,6 +3652,7 @@ def confirm_user():
         cursor.execute('UPDATE users SET is_confirmed = ? WHERE email = ?', (True, email))
         conn.commit()
         conn.close()
+        invalidate_user()
         
         print(f"✅ Admin {current_user.email} confirmed user {email}")
         
@@ -2517,7 +3683,7 @@ def admin_reset_password():
             return jsonify({'error': 'Password must be at least 6 characters long'}), 400
         
         # Check if user exists
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('SELECT email, fullname FROM users WHERE email = ?', (email,))
@@ -2536,6 +3702,7 @@ def admin_reset_password():
         
         conn.commit()
         conn.close()
+        invalidate_user()
         
         print(f"✅ Admin {current_user.email} reset password for user {email}")
         
@@ -2556,7 +3723,7 @@ def admin_reset_password():
 def get_available_chatbots():
     """Get all active chatbots for users"""
     try:
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -2596,10 +3763,7 @@ def start_chatbot_conversation():
         chatbot_id = data['chatbot_id']
         
         # Get user ID
-        from model.central_database_admin import CentralDatabase
-        db = CentralDatabase()
-        user_info = db.get_user_by_email(current_user.email)
-        user_id = user_info['id'] if user_info else None
+        user_id = get_current_user_id()
         
         # Generate session ID
         import uuid
@@ -2607,7 +3771,7 @@ def start_chatbot_conversation():
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
         # Create conversation record
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -2635,6 +3799,84 @@ def start_chatbot_conversation():
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# The storage/prompt helpers are shared with the native async handler in asgi.py
+
+CHATBOT_CHAT_FALLBACK = "I apologize, but I'm having trouble processing your request right now. Please try again in a moment."
+
+def store_chatbot_user_message(conversation_id, chatbot_id, user_id, user_message):
+    """Store the student's message; returns its id, or None if the conversation isn't this user's"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        # The conversation's history goes into the prompt, so it must be the caller's own
+        if not chatbot_conversation_owned(cursor, conversation_id, chatbot_id, user_id):
+            return None
+        
+        # Store user message
+        cursor.execute('''
+            INSERT INTO chatbot_messages 
+            (conversation_id, chatbot_id, user_id, sender, message, timestamp)
+            VALUES (?, ?, ?, 'user', ?, ?)
+        ''', (conversation_id, chatbot_id, user_id, user_message, timestamp))
+        message_id = cursor.lastrowid
+        
+        # Update conversation activity
+        cursor.execute('''
+            UPDATE chatbot_conversations 
+            SET last_activity = ?, message_count = message_count + 1
+            WHERE id = ?
+        ''', (timestamp, conversation_id))
+        
+        conn.commit()
+        return message_id
+    finally:
+        conn.close()
+
+def chatbot_chat_prompt(conversation_id, chatbot_id, user_id, user_message, ai_service, ai_model, message_id):
+    """Build the provider prompt: the conversation so far plus the new message"""
+    # Earlier turns come from the database, bounded by tokens: recent messages
+    # verbatim plus a rolling summary of the rest
+    history = conversation_memory.build_context(
+        conversation_id, chatbot_id, user_id, AI_HISTORY_TOKEN_BUDGET, ai_service, ai_model, before_id=message_id
+    )
+    if history:
+        return f"""{history}\n\nCurrent student message: {user_message}"""
+    return user_message
+
+def finish_chatbot_chat(conversation_id, chatbot_id, user_id, start_time, ai_response, model_used, truncated=False):
+    """Store the chatbot's reply and return the response payload; a truncated reply is marked in message_context"""
+    response_time = (datetime.now() - start_time).total_seconds()
+    
+    # Store AI response
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        INSERT INTO chatbot_messages 
+        (conversation_id, chatbot_id, user_id, sender, message, ai_model, response_time_sec, timestamp, message_context)
+        VALUES (?, ?, ?, 'chatbot', ?, ?, ?, ?, ?)
+    ''', (conversation_id, chatbot_id, user_id, ai_response, model_used, response_time, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+          json.dumps({'truncated': True}) if truncated else None))
+    
+    # Update conversation activity
+    cursor.execute('''
+        UPDATE chatbot_conversations 
+        SET last_activity = ?, message_count = message_count + 1
+        WHERE id = ?
+    ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), conversation_id))
+    
+    conn.commit()
+    conn.close()
+    
+    return {
+        'success': True,
+        'response': ai_response,
+        'model_used': model_used,
+        'response_time': response_time
+    }
+
 @app.route('/api/chatbots/chat', methods=['POST'])
 @login_required
 def chatbot_chat():
@@ -2646,83 +3888,47 @@ def chatbot_chat():
         user_message = data['message']
         
         # Get user ID
-        from model.central_database_admin import CentralDatabase
-        db = CentralDatabase()
-        user_info = db.get_user_by_email(current_user.email)
-        user_id = user_info['id'] if user_info else None
+        user_id = get_current_user_id()
         
         # Get chatbot configuration
-        conn = sqlite3.connect('db/laila_central.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT system_prompt, ai_service, ai_model FROM custom_chatbots WHERE id = ?', (chatbot_id,))
-        chatbot_config = cursor.fetchone()
+        chatbot_config = get_chatbot_config(chatbot_id)
         
         if not chatbot_config:
             return jsonify({'success': False, 'error': 'Chatbot not found'}), 404
         
         system_prompt, ai_service, ai_model = chatbot_config
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        # Store user message
-        cursor.execute('''
-            INSERT INTO chatbot_messages 
-            (conversation_id, chatbot_id, user_id, sender, message, timestamp)
-            VALUES (?, ?, ?, 'user', ?, ?)
-        ''', (conversation_id, chatbot_id, user_id, user_message, timestamp))
         
-        # Update conversation activity
-        cursor.execute('''
-            UPDATE chatbot_conversations 
-            SET last_activity = ?, message_count = message_count + 1
-            WHERE id = ?
-        ''', (timestamp, conversation_id))
+        message_id = store_chatbot_user_message(conversation_id, chatbot_id, user_id, user_message)
+        if message_id is None:
+            return jsonify({'success': False, 'error': 'Conversation not found'}), 404
         
-        conn.commit()
-        conn.close()
+        prompt = chatbot_chat_prompt(conversation_id, chatbot_id, user_id, user_message, ai_service, ai_model, message_id)
         
         # Get AI response
         start_time = datetime.now()
+        
+        def finish(ai_response, model_used, truncated=False):
+            return finish_chatbot_chat(conversation_id, chatbot_id, user_id, start_time, ai_response, model_used, truncated)
+        
+        if wants_stream(data):
+            return stream_chat_response(
+                stream_ai_call(prompt, system_prompt, service=ai_service, model=ai_model),
+                finish
+            )
+        
         try:
             ai_response, model_used = make_ai_call(
-                prompt=user_message,
+                prompt=prompt,
                 system_prompt=system_prompt,
                 service=ai_service,
-                model=ai_model
+                model=ai_model,
+                endpoint='chat'
             )
         except Exception as ai_error:
-            ai_response = "I apologize, but I'm having trouble processing your request right now. Please try again in a moment."
+            ai_response = CHATBOT_CHAT_FALLBACK
             model_used = ai_model
         
-        response_time = (datetime.now() - start_time).total_seconds()
-        
-        # Store AI response
-        conn = sqlite3.connect('db/laila_central.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO chatbot_messages 
-            (conversation_id, chatbot_id, user_id, sender, message, ai_model, response_time_sec, timestamp)
-            VALUES (?, ?, ?, 'chatbot', ?, ?, ?, ?)
-        ''', (conversation_id, chatbot_id, user_id, ai_response, model_used, response_time, datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-))
-        
-        # Update conversation activity
-        cursor.execute('''
-            UPDATE chatbot_conversations 
-            SET last_activity = ?, message_count = message_count + 1
-            WHERE id = ?
-        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), conversation_id))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'response': ai_response,
-            'model_used': model_used,
-            'response_time': response_time
-        })
+        return jsonify(finish(ai_response, model_used))
         
     except Exception as e:
         print(f"AI Call Error: {e}")
@@ -2738,7 +3944,7 @@ def chatbot_feedback():
         conversation_id = data['conversation_id']
         rating = data['rating']
         
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -2911,12 +4117,57 @@ def system_chatbot_chat():
         
         # Get AI response using the make_ai_call function
         start_time = time.time()
+        
+        def finish(ai_response, model_used, truncated=False):
+            response_time = (time.time() - start_time) * 1000  # Convert to milliseconds
+        
+            # Log the chat interaction
+            user_id = current_user.id if current_user.is_authenticated else 'anonymous'
+            # Store to user database chat logs
+            try:
+                session_id = f"system_chat_{chatbot_name}_{int(time.time())}"
+                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                base_row = {
+                    'user_id': user_id if current_user.is_authenticated else None,
+                    'session_id': session_id,
+                    'timestamp': timestamp,
+                    'module': f'system_chatbot_{chatbot_name}',
+                    'ai_model': model_used,
+                    'context': f"{chatbot_name} | truncated: True" if truncated else chatbot_name
+                }
+
+                # Log user message
+                log_writer.submit('chat_logs', dict(base_row, sender='User', turn=1, message=user_message, response_time_sec=start_time/1000))
+            
+                # Log AI response
+                prompt_tokens, completion_tokens = take_usage()
+                log_writer.submit('chat_logs', dict(base_row, sender='AI', turn=2, message=ai_response, response_time_sec=response_time/1000,
+                                                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens))
+            except Exception as log_error:
+                print(f"Logging error: {log_error}")
+                # Continue even if logging fails
+        
+            return {
+                'success': True,
+                'response': ai_response,
+                'model_used': model_used,
+                'response_time': response_time,
+                'chatbot_name': chatbot_name
+            }
+        
+        if wants_stream(data):
+            return stream_chat_response(
+                stream_ai_call(user_message, system_prompt, service=ai_service, model=ai_model),
+                finish
+            )
+        
         try:
             ai_response, model_used = make_ai_call(
                 prompt=user_message,
                 system_prompt=system_prompt,
                 service=ai_service,
-                model=ai_model
+                model=ai_model,
+                endpoint='chat'
             )
             
         except Exception as ai_error:
@@ -2924,45 +4175,7 @@ def system_chatbot_chat():
             ai_response = f"I apologize, but I'm having trouble processing your request right now. Please try again in a moment."
             model_used = ai_model
         
-        response_time = (time.time() - start_time) * 1000  # Convert to milliseconds
-        
-        # Log the chat interaction
-        user_id = current_user.id if current_user.is_authenticated else 'anonymous'
-        # Store to user database chat logs
-        try:
-            user_conn = sqlite3.connect('db/laila_central.db')
-            user_cursor = user_conn.cursor()
-            
-            session_id = f"system_chat_{chatbot_name}_{int(time.time())}"
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-            # Log user message
-            user_cursor.execute('''
-                INSERT INTO chat_logs 
-                (user_id, session_id, timestamp, module, sender, turn, message, ai_model, response_time_sec, context)
-                VALUES ((SELECT id FROM users WHERE id = ?), ?, ?, ?, 'User', 1, ?, ?, ?, ?)
-            ''', (user_id, session_id, timestamp, f'system_chatbot_{chatbot_name}', user_message, model_used, start_time/1000, chatbot_name))
-            
-            # Log AI response
-            user_cursor.execute('''
-                INSERT INTO chat_logs 
-                (user_id, session_id, timestamp, module, sender, turn, message, ai_model, response_time_sec, context)
-                VALUES ((SELECT id FROM users WHERE id = ?), ?, ?, ?, 'AI', 2, ?, ?, ?, ?)
-            ''', (user_id, session_id, timestamp, f'system_chatbot_{chatbot_name}', ai_response, model_used, response_time/1000, chatbot_name))
-            
-            user_conn.commit()
-            user_conn.close()
-        except Exception as log_error:
-            print(f"Logging error: {log_error}")
-            # Continue even if logging fails
-        
-        return jsonify({
-            'success': True,
-            'response': ai_response,
-            'model_used': model_used,
-            'response_time': response_time,
-            'chatbot_name': chatbot_name
-        })
+        return jsonify(finish(ai_response, model_used))
         
     except Exception as e:
         print(f"ERROR in system_chatbot_chat: {e}")
@@ -0,0 +1,273 @@
+# =============================================================================
+# ASGI ENTRY POINT - LAILA Platform
+# =============================================================================
+# Alternative to wsgi.py for asyncio servers:
+#
+#     uvicorn asgi:application --host 0.0.0.0 --port 5001 --workers 2
+#
+# AI chat routes listed in ASYNC_ROUTES are served here natively: they await
+# the provider on the event loop instead of holding a thread for the whole
+# generation, so one process can keep hundreds of chats in flight. Their
+# SQLite reads and writes run in worker threads (asyncio.to_thread) so they
+# never stall the loop. Every other route is handed to the Flask app
+# unchanged, on a pool of ASGI_WSGI_WORKERS threads.
+
+import asyncio
+import os
+import time
+import traceback
+from datetime import datetime
+
+from a2wsgi import WSGIMiddleware
+from flask import request, jsonify, Response
+from flask_login import current_user
+from werkzeug.test import EnvironBuilder
+
+from token_budget import start_usage
+from app import (
+    app, CHAT_SYSTEM_PROMPT, wants_stream, sse_event, finish_stream_payload, StreamInterrupted, get_current_user_id,
+    make_ai_call_async, stream_ai_call_async,
+    vignette_chat_prompt, log_vignette_chat_input, finish_vignette_chat, vignette_chat_fallback,
+    get_chatbot_config, store_chatbot_user_message, chatbot_chat_prompt, finish_chatbot_chat, CHATBOT_CHAT_FALLBACK,
+    educational_chat_request, log_educational_chat_input, educational_chat_model, educational_chat_context,
+    educational_chat_prompt, finish_educational_chat, educational_chat_fallback
+)
+
+# Threads serving the Flask routes concurrently
+WSGI_WORKERS = int(os.getenv('ASGI_WSGI_WORKERS', 40))
+
+flask_application = WSGIMiddleware(app, workers=WSGI_WORKERS)
+
+
+async def read_body(receive):
+    """Collect the full request body from ASGI receive events"""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI request, so Flask's request, session and current_user work"""
+    headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']]
+    host = next((value for name, value in headers if name.lower() == 'host'), 'localhost')
+    client = scope.get('client') or ('127.0.0.1', 0)
+    return EnvironBuilder(
+        path=scope['path'],
+        base_url=f"{scope.get('scheme', 'http')}://{host}{scope.get('root_path', '')}",
+        method=scope['method'],
+        query_string=scope.get('query_string', b'').decode('latin-1'),
+        headers=headers,
+        data=body,
+        # Flask-Login's 'strong' session protection hashes the client address
+        environ_base={'REMOTE_ADDR': client[0]}
+    ).get_environ()
+
+
+def json_response(payload, status=200):
+    response = jsonify(payload)
+    response.status_code = status
+    return response
+
+
+def response_headers(response):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]
+
+
+async def send_response(send, response):
+    """Send a complete (non-streaming) Flask response"""
+    # after_request hooks (CORS headers, session cookie) run as they would under WSGI
+    response = app.process_response(response)
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': response_headers(response)
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+async def send_event_stream(send, events):
+    """Send an async iterator of SSE strings as a text/event-stream response"""
+    response = app.process_response(Response(
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    ))
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': response_headers(response)
+    })
+    async for event in events:
+        await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def chat_events(chunks, on_complete):
+    """
+    Async counterpart of stream_chat_response in app.py: relay (text_chunk, model)
+    tuples as SSE 'token' events, then on_complete(full_text, model, truncated)
+    runs in a thread and its payload is sent in the final 'done' event.
+    """
+    parts = []
+    model_used = None
+    truncated = False
+    try:
+        async for chunk, model_used in chunks:
+            parts.append(chunk)
+            yield sse_event({'type': 'token', 'content': chunk})
+    except StreamInterrupted:
+        truncated = True
+
+    full_text = ''.join(parts)
+    try:
+        response_data = await asyncio.to_thread(on_complete, full_text, model_used, truncated)
+    except Exception as e:
+        print(f"Error finishing streamed response: {str(e)}")
+        response_data = {'response': full_text, 'status': 'success'}
+    yield finish_stream_payload(response_data, truncated)
+
+
+# --- Async Endpoint: AI Chat about Vignette (mirrors /api/chat in app.py) ---
+async def vignette_chat(send):
+    data = request.get_json(silent=True) or {}
+    vignette = data.get('vignette')
+    user_message = data.get('message')
+
+    if not vignette or not user_message:
+        return await send_response(send, json_response({'error': 'Both vignette and message are required'}, 400))
+
+    start_time = time.time()
+    user_id = current_user.id
+    log_vignette_chat_input(user_id, vignette, user_message)
+
+    try:
+        prompt = vignette_chat_prompt(vignette, user_message)
+
+        def finish(result, model, truncated=False):
+            return finish_vignette_chat(user_id, vignette, user_message, start_time, result, model, truncated)
+
+        if wants_stream(data):
+            return await send_event_stream(send, chat_events(stream_ai_call_async(prompt, CHAT_SYSTEM_PROMPT), finish))
+
+        result, model = await make_ai_call_async(prompt, CHAT_SYSTEM_PROMPT, endpoint='chat')
+        return await send_response(send, json_response(finish(result, model)))
+
+    except Exception as e:
+        print(f"Chat API Error: {str(e)}")
+        return await send_response(send, json_response(vignette_chat_fallback(user_message)))
+
+
+# --- Async Endpoint: Custom Chatbot Chat (mirrors /api/chatbots/chat in app.py) ---
+async def chatbot_chat(send):
+    try:
+        data = request.get_json(silent=True) or {}
+        conversation_id = data['conversation_id']
+        chatbot_id = data['chatbot_id']
+        user_message = data['message']
+        user_id = get_current_user_id()
+
+        chatbot_config = await asyncio.to_thread(get_chatbot_config, chatbot_id)
+        if not chatbot_config:
+            return await send_response(send, json_response({'success': False, 'error': 'Chatbot not found'}, 404))
+        system_prompt, ai_service, ai_model = chatbot_config
+
+        message_id = await asyncio.to_thread(store_chatbot_user_message, conversation_id, chatbot_id, user_id, user_message)
+        if message_id is None:
+            return await send_response(send, json_response({'success': False, 'error': 'Conversation not found'}, 404))
+
+        prompt = await asyncio.to_thread(
+            chatbot_chat_prompt, conversation_id, chatbot_id, user_id, user_message, ai_service, ai_model, message_id
+        )
+        start_time = datetime.now()
+
+        def finish(ai_response, model_used, truncated=False):
+            return finish_chatbot_chat(conversation_id, chatbot_id, user_id, start_time, ai_response, model_used, truncated)
+
+        if wants_stream(data):
+            chunks = stream_ai_call_async(prompt, system_prompt, service=ai_service, model=ai_model)
+            return await send_event_stream(send, chat_events(chunks, finish))
+
+        try:
+            ai_response, model_used = await make_ai_call_async(
+                prompt, system_prompt, service=ai_service, model=ai_model, endpoint='chat'
+            )
+        except Exception:
+            ai_response = CHATBOT_CHAT_FALLBACK
+            model_used = ai_model
+        return await send_response(send, json_response(await asyncio.to_thread(finish, ai_response, model_used)))
+
+    except Exception as e:
+        print(f"AI Call Error: {e}")
+        traceback.print_exc()
+        return await send_response(send, json_response({'success': False, 'error': f"Error in AI call: {str(e)}"}, 500))
+
+
+# --- Async Endpoint: Educational Chatbot (mirrors /api/educational-chat in app.py) ---
+async def educational_chat(send):
+    data = request.get_json(silent=True) or {}
+    chat = educational_chat_request(data)
+
+    if not chat['user_message']:
+        return await send_response(send, json_response({'error': 'Message required'}, 400))
+    if not chat['system_prompt']:
+        return await send_response(send, json_response({'error': 'System prompt required'}, 400))
+
+    start_time = time.time()
+    user_id = current_user.id
+    log_educational_chat_input(user_id, chat)
+
+    try:
+        service, model = educational_chat_model(chat)
+        user_api_key = chat['user_api_key']
+        conversation_context = educational_chat_context(chat, service, model)
+        full_prompt = educational_chat_prompt(chat, conversation_context)
+
+        def finish(result, model, truncated=False):
+            return finish_educational_chat(user_id, chat, conversation_context, start_time, result, model, truncated)
+
+        if wants_stream(data):
+            chunks = stream_ai_call_async(full_prompt, chat['system_prompt'], service=service, model=model, user_api_key=user_api_key)
+            return await send_event_stream(send, chat_events(chunks, finish))
+
+        result, model = await make_ai_call_async(
+            full_prompt, chat['system_prompt'], service=service, model=model, user_api_key=user_api_key, endpoint='chat'
+        )
+        return await send_response(send, json_response(finish(result, model)))
+
+    except Exception as e:
+        print(f"Educational Chat Error: {str(e)}")
+        return await send_response(send, json_response(educational_chat_fallback(chat['user_message'])))
+
+
+# (method, path) -> handler; handlers run inside a Flask request context
+ASYNC_ROUTES = {
+    ('POST', '/api/chat'): vignette_chat,
+    ('POST', '/api/chatbots/chat'): chatbot_chat,
+    ('POST', '/api/educational-chat'): educational_chat,
+}
+
+
+def is_authenticated():
+    # Loads the user from SQLite on the first access in a request (then cached in g)
+    return current_user.is_authenticated
+
+
+async def application(scope, receive, send):
+    """ASGI app: native async handlers for AI chat routes, Flask for everything else"""
+    handler = None
+    if scope['type'] == 'http':
+        handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        return await flask_application(scope, receive, send)
+
+    body = await read_body(receive)
+    with app.request_context(build_environ(scope, body)):
+        # Same check as @login_required, answered as JSON since these are API routes
+        # asyncio.to_thread copies the context, so the thread sees this request
+        if not await asyncio.to_thread(is_authenticated):
+            return await send_response(send, json_response({'error': 'Authentication required'}, 401))
+        # before_request hooks don't run for these handlers
+        start_usage()
+        await handler(send)
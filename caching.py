@@ -0,0 +1,176 @@
+# =============================================================================
+# IN-PROCESS CACHES - LAILA Platform
+# =============================================================================
+# Small thread-safe caches for data that is read on nearly every request but
+# changes rarely (users, prompts, chatbot configs). Each cache is local to one
+# worker process, so entries either expire on a TTL or follow a version counter
+# in the database that writers bump when the underlying rows change.
+
+import threading
+import time
+from collections import OrderedDict
+
+from model.database import get_cache_version, bump_cache_version
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, ttl, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store value under key for ttl seconds (defaults to the cache TTL)"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Drop a single key"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Drop every entry whose (key, value) matches predicate; returns the count dropped"""
+        with self._lock:
+            stale = [key for key, (_, value) in self._entries.items() if predicate(key, value)]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Cache size and hit/miss counters"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class VersionedCache:
+    """Process-local dict kept coherent across workers by a version counter in the database
+
+    Writers call bump() after changing the underlying rows. Readers compare
+    the shared version at most every check_interval seconds and drop their
+    local copy when it has moved. A reader that misses takes generation()
+    before reading the rows and passes it to set(), so a value read before
+    an invalidation is never stored after it.
+    """
+
+    def __init__(self, name, check_interval=5):
+        self.name = name
+        self.check_interval = check_interval
+        self._values = {}
+        self._version = None
+        self._generation = 0   # advances whenever the values are dropped
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _sync(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        # Throttle version checks even when the database is unavailable
+        self._checked_at = now
+        try:
+            version = get_cache_version(self.name)
+        except Exception as e:
+            print(f"⚠️ Could not read cache version for {self.name}: {e}")
+            return
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    self.reloads += 1
+                self._values.clear()
+                self._generation += 1
+                self._version = version
+
+    def get(self, key, default=None):
+        self._sync()
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                return self._values[key]
+            self.misses += 1
+            return default
+
+    def generation(self):
+        """Token for set()/replace(), taken before reading the rows the value comes from"""
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, generation=None):
+        """Store value, unless the cache was invalidated since generation was taken"""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._values[key] = value
+            return True
+
+    def invalidate(self, key):
+        """Drop a single key in this process only"""
+        with self._lock:
+            self._values.pop(key, None)
+
+    def replace(self, values, generation=None):
+        """Swap in a complete set of values (used to warm the cache), unless invalidated since generation"""
+        self._sync()
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._values = dict(values)
+            return True
+
+    def bump(self):
+        """Invalidate this cache here and in every other worker process"""
+        version = bump_cache_version(self.name)
+        with self._lock:
+            self._values.clear()
+            self._generation += 1
+            self._version = version
+            self._checked_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'size': len(self._values),
+                'version': self._version,
+                'generation': self._generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads
+            }
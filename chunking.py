@@ -0,0 +1,132 @@
+# =============================================================================
+# MAP-REDUCE CHUNKING - LAILA Platform
+# =============================================================================
+# Inputs larger than one request can hold are split into token-budgeted
+# chunks, each chunk is handled by its own AI call (map, run concurrently on a
+# bounded pool), and the partial answers are merged by further calls (reduce)
+# until a single answer remains.
+
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ai_resilience import estimate_tokens
+
+# =============================================================================
+# CHUNKING SETTINGS
+# =============================================================================
+
+# Inputs above this many (estimated) tokens go through map-reduce
+MAP_REDUCE_THRESHOLD_TOKENS = int(os.getenv('MAP_REDUCE_THRESHOLD_TOKENS', 24000))
+
+# Target size of each chunk
+CHUNK_TOKENS = int(os.getenv('MAP_REDUCE_CHUNK_TOKENS', 6000))
+
+# Concurrent map calls per request (admission control still caps the provider overall)
+MAP_WORKERS = int(os.getenv('MAP_REDUCE_WORKERS', 4))
+
+# Inputs needing more chunks than this are refused rather than queued for minutes
+MAX_CHUNKS = 64
+
+# Matches estimate_tokens(): ~4 characters per token
+CHARS_PER_TOKEN = 4
+
+
+class InputTooLargeError(Exception):
+    """Raised when an input would need more than MAX_CHUNKS chunks"""
+
+
+def needs_chunking(text, threshold=MAP_REDUCE_THRESHOLD_TOKENS):
+    return bool(text) and estimate_tokens(text) > threshold
+
+
+def split_into_chunks(text, max_tokens=CHUNK_TOKENS, repeat_header=False):
+    """Split text on line boundaries into chunks of about max_tokens each
+
+    With repeat_header, the first line (a table header) starts every chunk.
+    Lines longer than a whole chunk are cut into pieces.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    lines = text.splitlines()
+    header = lines.pop(0) if repeat_header and lines else None
+    budget = max_chars - (len(header) + 1 if header else 0)
+
+    chunks = []
+    current = []
+    size = 0
+
+    def flush():
+        nonlocal current, size
+        if current:
+            chunks.append('\n'.join(([header] if header else []) + current))
+            if len(chunks) > MAX_CHUNKS:
+                raise InputTooLargeError(f"Input needs more than {MAX_CHUNKS} chunks of {max_tokens} tokens")
+        current = []
+        size = 0
+
+    for line in lines:
+        pieces = [line[i:i + budget] for i in range(0, len(line), budget)] or ['']
+        for piece in pieces:
+            if size + len(piece) + 1 > budget:
+                flush()
+            current.append(piece)
+            size += len(piece) + 1
+    flush()
+    return chunks
+
+
+def _batches(partials, budget):
+    """Group consecutive partials into batches of at most budget tokens (at least two per batch)"""
+    batches = []
+    current = []
+    for partial in partials:
+        if len(current) >= 2 and estimate_tokens(*current, partial) > budget:
+            batches.append(current)
+            current = []
+        current.append(partial)
+    if current:
+        if len(current) == 1 and batches:
+            batches[-1].append(current[0])
+        else:
+            batches.append(current)
+    return batches
+
+
+def map_reduce(chunks, map_fn, reduce_fn, max_workers=MAP_WORKERS,
+               budget=MAP_REDUCE_THRESHOLD_TOKENS, progress=None):
+    """Run map_fn(chunk, index, total) over chunks concurrently, then merge the results
+
+    reduce_fn(partials, final) merges a list of partial results into one;
+    final is True only for the last merge. Partials that together exceed
+    budget are merged in batches first, level by level. progress(stage,
+    done, total) is called as map and reduce calls complete.
+    """
+    total = len(chunks)
+    partials = [None] * total
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, total)), thread_name_prefix='laila-map') as pool:
+        # Each call runs in a copy of the caller's context, so per-request token metering sees it
+        futures = {
+            pool.submit(contextvars.copy_context().run, map_fn, chunk, index, total): index
+            for index, chunk in enumerate(chunks)
+        }
+        done = 0
+        for future in as_completed(futures):
+            partials[futures[future]] = future.result()
+            done += 1
+            if progress:
+                progress('map', done, total)
+
+        while len(partials) > 1 and estimate_tokens(*partials) > budget:
+            batches = _batches(partials, budget)
+            if len(batches) == len(partials):
+                break  # every partial is already as large as the budget allows
+            partials = list(pool.map(lambda batch, context: context.run(reduce_fn, batch, False),
+                                     batches, [contextvars.copy_context() for _ in batches]))
+            if progress:
+                progress('reduce', 0, len(partials))
+
+    result = reduce_fn(partials, True)
+    if progress:
+        progress('reduce', 1, 1)
+    return result
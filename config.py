@@ -2,7 +2,8 @@
 import os
 import random
 import csv
-import sqlite3
+from model.database import get_connection
+from caching import VersionedCache
 
 # =============================================================================
 # IMPORT UNIFIED API SETTINGS
@@ -13,6 +14,7 @@ from API_Settings import (
     is_service_available, validate_configuration, log_api_status,
     DEFAULT_AI_SERVICE, AI_MODELS
 )
+from ai_resilience import circuit_breakers
 
 # =============================================================================
 # AUTHENTICATION TEMPLATES
@@ -417,8 +419,27 @@ Guidelines:
 
 Remember: You're facilitating learning and critical thinking, not providing definitive answers."""
 
+# System prompts are read on most AI requests but edited a few times per term,
+# so they are served from memory and re-read only after save_system_prompt()
+# (in any worker process) bumps the 'system_prompts' cache version.
+prompt_cache = VersionedCache('system_prompts')
+
+def warm_prompt_cache():
+    """Load every system prompt into the in-memory cache (called on the first request)"""
+    try:
+        generation = prompt_cache.generation()
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT name, prompt FROM system_prompts")
+        prompts = {name: prompt for name, prompt in cursor.fetchall() if prompt}
+        conn.close()
+        if prompt_cache.replace(prompts, generation):
+            print(f"✅ Cached {len(prompts)} system prompts")
+    except Exception as e:
+        print(f"⚠️ Could not warm system prompt cache: {e}")
+
 def load_system_prompt(prompt_name):
-    """Load any system prompt from text files
+    """Load any system prompt, from the in-memory cache when possible
     
     Args:
         prompt_name: Name of the prompt (e.g., 'bias_analyst', 'prompt_helper', etc.)
@@ -426,15 +447,21 @@ def load_system_prompt(prompt_name):
     Returns:
         str: The prompt content, or error message if not found
     """
+    content = prompt_cache.get(prompt_name)
+    if content is not None:
+        return content
    
     try:
-        conn = sqlite3.connect('db/laila_central.db')
+        generation = prompt_cache.generation()
+        conn = get_connection()
         cursor = conn.cursor()
         print(f"Loading prompt: {prompt_name}")
         # Total users
         cursor.execute("SELECT prompt FROM system_prompts WHERE name = ?", (prompt_name,))
         content = cursor.fetchone()[0] or 0
         conn.close()
+        if content:
+            prompt_cache.set(prompt_name, content, generation)
         return content
     except Exception as e:
         print(f"Error loading prompt from {prompt_name}: {str(e)}")
@@ -448,7 +475,7 @@ def save_system_prompt(prompt_name, content):
         content: The prompt content to save
     """
     try:
-        conn = sqlite3.connect('db/laila_central.db')
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute('''
             INSERT OR REPLACE INTO system_prompts (name, prompt)
@@ -456,6 +483,8 @@ def save_system_prompt(prompt_name, content):
         ''', (prompt_name, content))
         conn.commit()
         conn.close()
+        # Drop cached prompts in this and every other worker process
+        prompt_cache.bump()
         print(f"✅ Prompt '{prompt_name}' saved successfully.")
     except Exception as e:
         print(f"Error saving prompt '{prompt_name}': {str(e)}")
@@ -486,6 +515,18 @@ SHOW_AI_MODEL_DEBUG = True  # Set to False to hide AI model info
 SERVER_HOST = '0.0.0.0'
 SERVER_PORT = 5001
 
+# AI Response Cache Configuration
+# Opt-in (AI_RESPONSE_CACHE_ENABLED=true): identical requests to these endpoints
+# are then answered from ai_cache instead of calling the provider again, so
+# their sampled outputs stay the same until the entry expires. Chat endpoints
+# stay uncached because their replies depend on conversation state.
+AI_RESPONSE_CACHE_ENABLED = os.environ.get('AI_RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+AI_RESPONSE_CACHE_ENDPOINTS = {
+    'student_bias': True,
+    'bias_analysis': True,
+    'interpret_data': True
+}
+
 # =============================================================================
 # HELPER FUNCTIONS (Updated to use API_Settings)
 # =============================================================================
@@ -505,10 +546,18 @@ def get_ai_configuration():
         'default_google_model': config['google']['default_model'],
         'system_google_key_available': config['google']['available'],
         'system_openai_key_available': config['openai']['available'],
+        'provider_health': {
+            'google': circuit_breakers.get('google').snapshot(),
+            'openai': circuit_breakers.get('openai').snapshot()
+        },
         'chat_prompt': CHAT_SYSTEM_PROMPT,
         'bias_prompt': load_system_prompt("bias_analyst")
     }
 
+def is_response_cache_enabled(endpoint):
+    """Check whether AI responses for an endpoint may be served from the cache"""
+    return AI_RESPONSE_CACHE_ENABLED and AI_RESPONSE_CACHE_ENDPOINTS.get(endpoint, False)
+
 # =============================================================================
 # VALIDATION FUNCTIONS
 # =============================================================================
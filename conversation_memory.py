@@ -0,0 +1,213 @@
+# =============================================================================
+# CONVERSATION MEMORY - LAILA Platform
+# =============================================================================
+# Chatbot conversations are rebuilt on the server from chatbot_messages rather
+# than sent by the client. Each request gets the most recent turns that fit
+# the history token budget plus a rolling summary of everything older, so the
+# prompt stays the same size however long a tutoring session runs. Summaries
+# are refreshed on a background thread and stored per conversation.
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from caching import TTLCache
+from model.database import DB_PATH, get_connection, db_connection
+from token_budget import count_tokens, trim_history
+
+# =============================================================================
+# MEMORY SETTINGS
+# =============================================================================
+
+# Newest messages read per request; older ones are only reached through the summary
+RECENT_MESSAGES_LIMIT = 60
+
+# Refresh the summary once this many tokens of turns have fallen out of the recent window
+SUMMARY_REFRESH_TOKENS = 500
+
+# Length the summary is asked to stay within
+SUMMARY_MAX_WORDS = 250
+
+SUMMARY_WORKERS = 2
+SUMMARY_CACHE_TTL = 3600  # seconds
+
+SPEAKERS = {'user': 'Student', 'chatbot': 'Assistant'}
+
+CONVERSATION_SUMMARIES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS conversation_summaries (
+        conversation_id INTEGER PRIMARY KEY,
+        summary TEXT NOT NULL,
+        summarized_through INTEGER NOT NULL,
+        updated_at REAL NOT NULL,
+        FOREIGN KEY (conversation_id) REFERENCES chatbot_conversations (id)
+    )
+'''
+
+SUMMARY_PROMPT = """Below is the running summary of a tutoring conversation, followed by newer messages that are not in it yet.
+
+Write an updated summary that covers the whole conversation so far, in at most {max_words} words. Keep the student's goals, questions, misconceptions, what has been explained, and anything the assistant promised to do next. Write plain prose without headings.
+
+RUNNING SUMMARY:
+{summary}
+
+NEWER MESSAGES:
+{messages}"""
+
+
+def format_turn(sender, message):
+    return f"{SPEAKERS.get(sender, sender.title())}: {message}\n"
+
+
+class ConversationMemory:
+    """Bounded prompt context for stored conversations, with rolling summaries"""
+
+    def __init__(self, summarize, db_path=DB_PATH):
+        # summarize(prompt) -> summary text; called on a background thread
+        self.summarize = summarize
+        self.db_path = db_path
+        self._executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix='laila-summary')
+        self._summaries = TTLCache(ttl=SUMMARY_CACHE_TTL, max_size=2048)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self.refreshes = 0
+        self.failures = 0
+
+    def _ensure_schema(self, conn):
+        if not self._schema_ready:
+            conn.execute(CONVERSATION_SUMMARIES_SCHEMA)
+            self._schema_ready = True
+
+    def get_summary(self, conversation_id, chatbot_id, user_id):
+        """(summary, last message id it covers); ('', 0) before the first summary
+
+        Only a conversation of this chatbot and user has a summary here.
+        """
+        key = (conversation_id, chatbot_id, user_id)
+        cached = self._summaries.get(key)
+        if cached is not None:
+            return cached
+        conn = get_connection(self.db_path)
+        try:
+            self._ensure_schema(conn)
+            row = conn.execute('''
+                SELECT s.summary, s.summarized_through
+                FROM conversation_summaries s
+                JOIN chatbot_conversations c ON c.id = s.conversation_id
+                WHERE s.conversation_id = ? AND c.chatbot_id = ? AND c.user_id IS ?
+            ''', (conversation_id, chatbot_id, user_id)).fetchone()
+        finally:
+            conn.close()
+        summary = (row[0], row[1]) if row else ('', 0)
+        self._summaries.set(key, summary)
+        return summary
+
+    def _load_turns(self, conversation_id, chatbot_id, user_id, after_id, before_id=None, limit=RECENT_MESSAGES_LIMIT):
+        """Messages of this chatbot and user with after_id < id < before_id, oldest first (the newest `limit` of them)"""
+        conn = get_connection(self.db_path)
+        try:
+            rows = conn.execute('''
+                SELECT id, sender, message FROM chatbot_messages
+                WHERE conversation_id = ? AND chatbot_id = ? AND user_id IS ?
+                  AND id > ? AND id < ? AND sender IN ('user', 'chatbot')
+                ORDER BY id DESC LIMIT ?
+            ''', (conversation_id, chatbot_id, user_id, after_id, before_id or 2 ** 62, limit)).fetchall()
+        finally:
+            conn.close()
+        rows.reverse()
+        return rows
+
+    def build_context(self, conversation_id, chatbot_id, user_id, budget, service=None, model=None, before_id=None):
+        """Summary of older turns plus the recent turns that fit budget tokens, as prompt text
+
+        Callers check that the conversation belongs to user_id and chatbot_id
+        first; only that user's messages with that chatbot are read either way.
+        before_id excludes the message being answered (and anything after it).
+        """
+        summary, summarized_through = self.get_summary(conversation_id, chatbot_id, user_id)
+        summary_tokens = count_tokens(summary, service, model)
+        turns = self._load_turns(conversation_id, chatbot_id, user_id, summarized_through, before_id)
+
+        lines = [format_turn(sender, message) for _, sender, message in turns]
+        recent = trim_history(lines, max(budget - summary_tokens, 0), service, model)
+        dropped = turns[:len(turns) - len(recent)]
+
+        # Turns that no longer fit are folded into the summary for the next request
+        if dropped and count_tokens(''.join(lines[:len(dropped)]), service, model) >= SUMMARY_REFRESH_TOKENS:
+            self.schedule_refresh(conversation_id, chatbot_id, user_id, dropped[-1][0])
+        elif len(turns) == RECENT_MESSAGES_LIMIT and turns[0][0] > summarized_through + 1:
+            # A full window may hide older unsummarized turns, however short: summarize up to the window
+            self.schedule_refresh(conversation_id, chatbot_id, user_id, turns[0][0] - 1)
+
+        sections = []
+        if summary:
+            sections.append(f"Summary of the earlier conversation:\n{summary}")
+        if recent:
+            sections.append("Recent conversation:\n" + ''.join(recent).rstrip())
+        return "\n\n".join(sections)
+
+    def schedule_refresh(self, conversation_id, chatbot_id, user_id, through_id):
+        """Summarize the conversation up to message through_id in the background"""
+        with self._lock:
+            if conversation_id in self._pending:
+                return
+            self._pending.add(conversation_id)
+        self._executor.submit(self._refresh, conversation_id, chatbot_id, user_id, through_id)
+
+    def _refresh(self, conversation_id, chatbot_id, user_id, through_id):
+        try:
+            summary, summarized_through = self.get_summary(conversation_id, chatbot_id, user_id)
+            if through_id <= summarized_through:
+                return
+            turns = self._load_turns(conversation_id, chatbot_id, user_id, summarized_through, through_id + 1, limit=-1)
+            if not turns:
+                return
+            prompt = SUMMARY_PROMPT.format(
+                max_words=SUMMARY_MAX_WORDS,
+                summary=summary or '(none yet)',
+                messages=''.join(format_turn(sender, message) for _, sender, message in turns)
+            )
+            new_summary = self.summarize(prompt).strip()
+            if not new_summary:
+                return
+
+            now = time.time()
+            with db_connection(self.db_path) as conn:
+                self._ensure_schema(conn)
+                conn.execute('''
+                    INSERT INTO conversation_summaries (conversation_id, summary, summarized_through, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(conversation_id) DO UPDATE SET
+                        summary = excluded.summary,
+                        summarized_through = excluded.summarized_through,
+                        updated_at = excluded.updated_at
+                ''', (conversation_id, new_summary, turns[-1][0], now))
+            self._summaries.set((conversation_id, chatbot_id, user_id), (new_summary, turns[-1][0]))
+            with self._lock:
+                self.refreshes += 1
+            print(f"🧠 Summarized conversation {conversation_id} through message {turns[-1][0]}")
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+            print(f"⚠️ Conversation summary failed for {conversation_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(conversation_id)
+
+    def forget_chatbot(self, cursor, chatbot_id):
+        """Delete the summaries of a chatbot's conversations, inside the caller's transaction"""
+        self._ensure_schema(cursor)
+        cursor.execute('''
+            DELETE FROM conversation_summaries WHERE conversation_id IN
+                (SELECT id FROM chatbot_conversations WHERE chatbot_id = ?)
+        ''', (chatbot_id,))
+        # Conversation ids are never reused, so cached summaries of deleted ones are simply never read again
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+                'cache': self._summaries.stats()
+            }
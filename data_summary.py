@@ -0,0 +1,158 @@
+# =============================================================================
+# DATA PRE-SUMMARIZATION - LAILA Platform
+# =============================================================================
+# Large tables pasted into the data analyzer are summarized locally with
+# pandas before they reach the model: column types, descriptive statistics,
+# the strongest correlations, group summaries and a small random sample.
+# The summary grows with the number of columns, not the number of rows, so a
+# multi-megabyte CSV becomes a prompt of a few thousand characters.
+
+import csv
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# SUMMARY SETTINGS
+# =============================================================================
+
+# Tables at or below both limits are small enough to send as-is
+RAW_MAX_ROWS = 50
+RAW_MAX_CHARS = 8000
+
+# Anything with fewer rows/columns than this is not treated as a table
+MIN_TABLE_ROWS = 3
+MIN_TABLE_COLUMNS = 2
+
+MAX_SUMMARY_COLUMNS = 60        # columns described individually
+MAX_CORRELATION_PAIRS = 15      # strongest numeric correlations reported
+MAX_CATEGORY_LEVELS = 12        # categorical columns with more levels are not grouped
+MAX_TOP_VALUES = 8              # most frequent values listed per categorical column
+MAX_GROUP_COLUMNS = 3           # categorical columns used for group summaries
+MAX_GROUP_METRICS = 8           # numeric columns averaged per group summary
+SAMPLE_ROWS = 15
+
+
+def parse_table(text):
+    """Parse CSV/TSV or a JSON list of records into a DataFrame; None if the text is not tabular"""
+    stripped = text.strip()
+    if not stripped:
+        return None
+
+    if stripped[0] == '[':
+        try:
+            records = json.loads(stripped)
+        except ValueError:
+            return None
+        if not (isinstance(records, list) and records and all(isinstance(r, dict) for r in records)):
+            return None
+        df = pd.DataFrame.from_records(records)
+    else:
+        head = [line for line in stripped.splitlines()[:20] if line.strip()]
+        try:
+            dialect = csv.Sniffer().sniff('\n'.join(head), delimiters=',;\t|')
+        except csv.Error:
+            return None
+        # Prose with the odd comma is not a table: most lines must have the same field count
+        field_counts = [len(row) for row in csv.reader(head, dialect)]
+        if field_counts[0] < MIN_TABLE_COLUMNS or field_counts.count(field_counts[0]) < 0.8 * len(field_counts):
+            return None
+        try:
+            df = pd.read_csv(io.StringIO(stripped), sep=dialect.delimiter, skipinitialspace=True)
+        except (pd.errors.ParserError, ValueError):
+            return None
+
+    if len(df) < MIN_TABLE_ROWS or df.shape[1] < MIN_TABLE_COLUMNS:
+        return None
+    return df
+
+
+def _format_table(df, float_format='{:.4g}'):
+    return df.to_string(float_format=lambda value: float_format.format(value))
+
+
+def summarize_table(df):
+    """Compact text summary of a DataFrame computed over every row"""
+    rows, columns = df.shape
+    sections = [f"Rows: {rows}  Columns: {columns}"]
+
+    described = df.iloc[:, :MAX_SUMMARY_COLUMNS]
+    if columns > MAX_SUMMARY_COLUMNS:
+        sections.append(f"(Only the first {MAX_SUMMARY_COLUMNS} columns are described individually.)")
+
+    # Column overview: type, missing values, distinct values
+    overview = pd.DataFrame({
+        'type': described.dtypes.astype(str),
+        'missing': described.isna().sum(),
+        'distinct': described.nunique()
+    })
+    sections.append("COLUMNS:\n" + overview.to_string())
+
+    numeric = described.select_dtypes(include='number')
+    if not numeric.empty:
+        stats = numeric.describe().T[['mean', 'std', 'min', '25%', '50%', '75%', 'max']]
+        sections.append("NUMERIC SUMMARY (all rows):\n" + _format_table(stats))
+
+        if numeric.shape[1] > 1:
+            corr = numeric.corr()
+            # Upper triangle only, strongest absolute correlations first
+            pairs = corr.where(np.triu(np.ones(corr.shape, dtype=bool), k=1)).stack().dropna()
+            pairs = pairs.reindex(pairs.abs().sort_values(ascending=False).index).head(MAX_CORRELATION_PAIRS)
+            if not pairs.empty:
+                lines = [f"{a} ~ {b}: r = {value:.3f}" for (a, b), value in pairs.items()]
+                sections.append("STRONGEST CORRELATIONS (Pearson):\n" + "\n".join(lines))
+
+    categorical = described.select_dtypes(exclude='number')
+    group_columns = []
+    for name in categorical.columns:
+        counts = categorical[name].value_counts(dropna=True)
+        if counts.empty:
+            continue
+        if len(counts) > MAX_TOP_VALUES and len(counts) == counts.sum():
+            sections.append(f"VALUES OF '{name}': all {len(counts)} values distinct (identifier)")
+            continue
+        top = ", ".join(f"{value} ({count})" for value, count in counts.head(MAX_TOP_VALUES).items())
+        more = f", ... {len(counts) - MAX_TOP_VALUES} more" if len(counts) > MAX_TOP_VALUES else ""
+        sections.append(f"VALUES OF '{name}': {top}{more}")
+        if 1 < len(counts) <= MAX_CATEGORY_LEVELS:
+            group_columns.append(name)
+
+    if not numeric.empty:
+        metrics = list(numeric.columns[:MAX_GROUP_METRICS])
+        for name in group_columns[:MAX_GROUP_COLUMNS]:
+            grouped = described.groupby(name, dropna=True)[metrics].mean()
+            grouped.insert(0, 'n', described.groupby(name, dropna=True).size())
+            sections.append(f"MEANS BY '{name}':\n" + _format_table(grouped))
+
+    sample = df.sample(n=min(SAMPLE_ROWS, rows), random_state=0).sort_index()
+    sections.append(f"RANDOM SAMPLE OF {len(sample)} ROWS:\n" + sample.iloc[:, :MAX_SUMMARY_COLUMNS].to_csv(index=False))
+
+    return "\n\n".join(sections)
+
+
+def prepare_data_for_prompt(data_content):
+    """Return (text_for_prompt, info); large tables are replaced by their summary
+
+    info has 'summarized' plus, for tables, 'rows' and 'columns'.
+    """
+    df = parse_table(data_content)
+    if df is None:
+        return data_content, {'summarized': False}
+
+    info = {'summarized': False, 'rows': int(df.shape[0]), 'columns': int(df.shape[1])}
+    if df.shape[0] <= RAW_MAX_ROWS and len(data_content) <= RAW_MAX_CHARS:
+        return data_content, info
+
+    try:
+        summary = summarize_table(df)
+    except Exception as e:
+        print(f"⚠️ Data summarization failed, sending raw data: {e}")
+        return data_content, info
+
+    info['summarized'] = True
+    print(f"📉 Summarized {df.shape[0]}x{df.shape[1]} table: {len(data_content)} -> {len(summary)} chars")
+    note = (f"The full dataset has {df.shape[0]} rows and {df.shape[1]} columns. It was summarized "
+            f"locally; every statistic below was computed over all rows.\n\n")
+    return note + summary, info
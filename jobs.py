@@ -0,0 +1,242 @@
+# =============================================================================
+# BACKGROUND AI JOBS - LAILA Platform
+# =============================================================================
+# Long AI requests (data interpretation, bias analysis, final prompt crafting)
+# can run as jobs: the endpoint returns a job id straight away, a local thread
+# pool does the work, and the client polls for the result. Jobs and their
+# results live in the central database, so reloading the page and submitting
+# the same request again picks up the existing job instead of redoing it.
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from model.database import DB_PATH, get_connection, db_connection
+
+# =============================================================================
+# JOB SETTINGS
+# =============================================================================
+
+AI_JOB_WORKERS = int(os.getenv('AI_JOB_WORKERS', 4))
+
+# Finished jobs are reused for identical requests and kept for polling this long
+AI_JOB_RESULT_TTL = 24 * 3600  # seconds
+
+# A queued/running job of another worker process not updated for this long
+# belonged to a process that was restarted; it is reported as failed so the
+# client can resubmit. Jobs of the current process are never stale: they are
+# still in its thread pool, however long they wait behind other jobs.
+AI_JOB_STALE_AFTER = 30 * 60  # seconds
+
+# Identifies this process's jobs in the shared table
+PROCESS_ID = uuid.uuid4().hex
+
+# Old jobs are pruned at most once per this many submissions
+PRUNE_EVERY = 100
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Job id of the job running on the current worker thread, for report_progress()
+_current = threading.local()
+
+AI_JOBS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS ai_jobs (
+        job_id TEXT PRIMARY KEY,
+        user_id TEXT,
+        kind TEXT NOT NULL,
+        dedupe_key TEXT,
+        status TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        progress TEXT,
+        owner TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+'''
+
+
+class JobQueue:
+    """Thread-pool job runner with results persisted in SQLite"""
+
+    def __init__(self, db_path=DB_PATH, max_workers=AI_JOB_WORKERS):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='laila-job')
+        self._schema_ready = False
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.reused = 0
+        self.completed = 0
+        self.failed = 0
+
+    @staticmethod
+    def make_key(user_id, kind, payload):
+        """Stable hash identifying identical requests from the same user"""
+        body = json.dumps([user_id, kind, payload], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+    def _ensure_schema(self, conn):
+        if not self._schema_ready:
+            conn.execute(AI_JOBS_SCHEMA)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_ai_jobs_dedupe ON ai_jobs(dedupe_key, created_at)')
+            # Databases created before progress reporting and job owners lack the columns
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(ai_jobs)')]
+            if 'progress' not in columns:
+                conn.execute('ALTER TABLE ai_jobs ADD COLUMN progress TEXT')
+            if 'owner' not in columns:
+                conn.execute('ALTER TABLE ai_jobs ADD COLUMN owner TEXT')
+            self._schema_ready = True
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with db_connection(self.db_path) as conn:
+            self._ensure_schema(conn)
+            conn.execute(f'UPDATE ai_jobs SET {assignments} WHERE job_id = ?', (*fields.values(), job_id))
+
+    def submit(self, kind, user_id, fn, dedupe_key=None):
+        """Queue fn() and return the job; an identical live or finished job is returned instead"""
+        now = time.time()
+        with db_connection(self.db_path) as conn:
+            self._ensure_schema(conn)
+            if dedupe_key:
+                row = conn.execute('''
+                    SELECT job_id, status, updated_at, owner FROM ai_jobs
+                    WHERE dedupe_key = ? AND status != ? AND created_at > ?
+                    ORDER BY created_at DESC LIMIT 1
+                ''', (dedupe_key, FAILED, now - AI_JOB_RESULT_TTL)).fetchone()
+                if row and (row[1] == DONE or not self._is_stale(row[3], row[2], now)):
+                    with self._lock:
+                        self.reused += 1
+                    return {'job_id': row[0], 'status': row[1], 'reused': True}
+
+            job_id = uuid.uuid4().hex
+            conn.execute('''
+                INSERT INTO ai_jobs (job_id, user_id, kind, dedupe_key, status, owner, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job_id, str(user_id), kind, dedupe_key, QUEUED, PROCESS_ID, now, now))
+
+        with self._lock:
+            self.submitted += 1
+            prune = self.submitted % PRUNE_EVERY == 0
+        if prune:
+            self._prune()
+
+        self._executor.submit(self._run, job_id, kind, fn)
+        print(f"📥 Queued {kind} job {job_id}")
+        return {'job_id': job_id, 'status': QUEUED, 'reused': False}
+
+    def _run(self, job_id, kind, fn):
+        _current.job_id = job_id
+        _current.degraded = False
+        try:
+            self._update(job_id, status=RUNNING)
+            result = fn()
+            fields = {'status': DONE, 'result': json.dumps(result, default=str)}
+            if _current.degraded:
+                # A fallback answer is still returned to this client, but never reused for identical requests
+                fields['dedupe_key'] = None
+            self._update(job_id, **fields)
+            with self._lock:
+                self.completed += 1
+            print(f"✅ {kind} job {job_id} finished")
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            print(f"❌ {kind} job {job_id} failed: {e}")
+            try:
+                self._update(job_id, status=FAILED, error=str(e))
+            except Exception as db_error:
+                print(f"⚠️ Could not record job failure: {db_error}")
+        finally:
+            _current.job_id = None
+            _current.degraded = False
+
+    def report_progress(self, job_id, stage, done, total):
+        """Record how far a running job has got, e.g. ('map', 3, 8)"""
+        progress = {'stage': stage, 'done': done, 'total': total}
+        try:
+            self._update(job_id, progress=json.dumps(progress))
+        except Exception as e:
+            print(f"⚠️ Could not record job progress: {e}")
+
+    @staticmethod
+    def _is_stale(owner, updated_at, now):
+        """Whether a queued/running job was left behind by a process that has since gone away"""
+        return owner != PROCESS_ID and updated_at < now - AI_JOB_STALE_AFTER
+
+    def get(self, job_id, user_id=None):
+        """Job status and result as a dict, or None if it does not exist (or belongs to another user)"""
+        conn = get_connection(self.db_path)
+        try:
+            self._ensure_schema(conn)
+            row = conn.execute('''
+                SELECT job_id, user_id, kind, status, result, error, progress, created_at, updated_at, owner
+                FROM ai_jobs WHERE job_id = ?
+            ''', (job_id,)).fetchone()
+        finally:
+            conn.close()
+
+        if row is None or (user_id is not None and row[1] != str(user_id)):
+            return None
+
+        job = {
+            'job_id': row[0],
+            'kind': row[2],
+            'status': row[3],
+            'result': json.loads(row[4]) if row[4] else None,
+            'error': row[5],
+            'progress': json.loads(row[6]) if row[6] else None,
+            'created_at': row[7],
+            'updated_at': row[8]
+        }
+        if job['status'] in (QUEUED, RUNNING) and self._is_stale(row[9], job['updated_at'], time.time()):
+            job['status'] = FAILED
+            job['error'] = 'Job was interrupted by a server restart'
+            self._update(job_id, status=FAILED, error=job['error'])
+        return job
+
+    def _prune(self):
+        """Drop finished jobs past their TTL"""
+        try:
+            with db_connection(self.db_path) as conn:
+                conn.execute('DELETE FROM ai_jobs WHERE status IN (?, ?) AND updated_at < ?',
+                             (DONE, FAILED, time.time() - AI_JOB_RESULT_TTL))
+        except Exception as e:
+            print(f"⚠️ AI job pruning failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'in_progress': self.submitted - self.completed - self.failed,
+                'submitted': self.submitted,
+                'reused': self.reused,
+                'completed': self.completed,
+                'failed': self.failed
+            }
+
+
+# Shared job queue for the long-running AI endpoints
+ai_jobs = JobQueue()
+
+
+def report_progress(stage, done, total):
+    """Progress of the job running on this thread; a no-op outside background jobs"""
+    job_id = getattr(_current, 'job_id', None)
+    if job_id:
+        ai_jobs.report_progress(job_id, stage, done, total)
+
+
+def mark_result_degraded():
+    """Flag the running job's result as fallback or test-mode text, so it is not reused; a no-op outside background jobs"""
+    if getattr(_current, 'job_id', None):
+        _current.degraded = True
@@ -4,11 +4,19 @@ Central Database Admin Tools for LAILA Platform
 Export, query, and manage the central SQLite database
 """
 
-import sqlite3
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
 
+try:
+    from model.database import get_connection
+    from model.message_search import message_search_ready, build_match_query
+    from model.log_statistics import get_log_statistics
+except ImportError:
+    from database import get_connection
+    from message_search import message_search_ready, build_match_query
+    from log_statistics import get_log_statistics
+
 class CentralDatabase:
     """Class for managing central database operations"""
     
@@ -23,8 +31,8 @@ class CentralDatabase:
             create_central_database()
     
     def get_connection(self):
-        """Get database connection"""
-        return sqlite3.connect(self.db_path)
+        """Get a pooled database connection"""
+        return get_connection(self.db_path)
     
     def export_chat_logs(self, filename=None, date_from=None, date_to=None, module=None, user_email=None):
         """Export chat logs to CSV with optional filtering"""
@@ -247,83 +255,52 @@ class CentralDatabase:
         return filename, len(df)
     
     def get_database_statistics(self):
-        """Get comprehensive database statistics"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """Get comprehensive database statistics (from the running totals in log_statistics.py)"""
+        snapshot = get_log_statistics(self.db_path).get()
         
-        stats = {}
-        
-        # Total users
-        cursor.execute("SELECT COUNT(*) FROM users")
-        stats['total_users'] = cursor.fetchone()[0]
-        
-        # Total messages
-        cursor.execute("SELECT COUNT(*) FROM chat_logs")
-        stats['total_messages'] = cursor.fetchone()[0]
-        
-        # Messages by sender
-        cursor.execute("SELECT sender, COUNT(*) FROM chat_logs GROUP BY sender")
-        stats['by_sender'] = dict(cursor.fetchall())
-        
-        # Messages by module
-        cursor.execute("SELECT module, COUNT(*) FROM chat_logs GROUP BY module ORDER BY COUNT(*) DESC")
-        stats['by_module'] = dict(cursor.fetchall())
-        
-        # Top users by messages
-        cursor.execute("""
-            SELECT u.email, COUNT(cl.id) as message_count 
-            FROM users u 
-            LEFT JOIN chat_logs cl ON u.id = cl.user_id 
-            GROUP BY u.id 
-            ORDER BY message_count DESC 
-            LIMIT 10
-        """)
-        stats['top_users'] = dict(cursor.fetchall())
-        
-        # Date range
-        cursor.execute("SELECT MIN(timestamp), MAX(timestamp) FROM chat_logs")
-        date_range = cursor.fetchone()
-        stats['date_range'] = {'from': date_range[0], 'to': date_range[1]}
-        
-        # Recent activity (last 7 days)
-        week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-        cursor.execute("SELECT COUNT(*) FROM chat_logs WHERE timestamp >= ?", (week_ago,))
-        stats['recent_messages'] = cursor.fetchone()[0]
-        
-        # Average response time
-        cursor.execute("SELECT AVG(response_time_sec) FROM chat_logs WHERE sender = 'AI' AND response_time_sec IS NOT NULL")
-        avg_response = cursor.fetchone()[0]
-        stats['avg_response_time'] = round(avg_response, 2) if avg_response else 0
-        
-        # User interactions count
-        cursor.execute("SELECT COUNT(*) FROM user_interactions")
-        stats['total_interactions'] = cursor.fetchone()[0]
-        
-        # User submissions count
-        cursor.execute("SELECT COUNT(*) FROM user_submissions")
-        stats['total_submissions'] = cursor.fetchone()[0]
+        stats = {key: snapshot[key] for key in (
+            'total_users', 'total_messages', 'by_sender', 'by_module', 'top_users', 'date_range',
+            'recent_messages', 'total_interactions', 'total_submissions', 'as_of'
+        )}
+        stats['avg_response_time'] = round(snapshot['avg_response_time'], 2)
         
         # Database size
         stats['db_size_bytes'] = os.path.getsize(self.db_path)
         
-        conn.close()
         return stats
     
     def search_messages(self, search_term, sender=None, module=None, user_email=None, limit=100):
-        """Search messages by content"""
-        query = """
-            SELECT 
-                cl.timestamp,
-                u.email as user,
-                cl.module,
-                cl.sender,
-                cl.message,
-                cl.context
-            FROM chat_logs cl
-            LEFT JOIN users u ON cl.user_id = u.id
-            WHERE cl.message LIKE ?
-        """
-        params = [f'%{search_term}%']
+        """Search messages by content (full-text index, LIKE scan if it is unavailable)"""
+        conn = self.get_connection()
+        if message_search_ready(conn):
+            query = """
+                SELECT 
+                    cl.timestamp,
+                    u.email as user,
+                    cl.module,
+                    cl.sender,
+                    cl.message,
+                    cl.context
+                FROM message_search ms
+                JOIN chat_logs cl ON cl.id = ms.rowid / 2
+                LEFT JOIN users u ON cl.user_id = u.id
+                WHERE message_search MATCH ? AND ms.source = 'chat_logs'
+            """
+            params = [build_match_query(search_term)]
+        else:
+            query = """
+                SELECT 
+                    cl.timestamp,
+                    u.email as user,
+                    cl.module,
+                    cl.sender,
+                    cl.message,
+                    cl.context
+                FROM chat_logs cl
+                LEFT JOIN users u ON cl.user_id = u.id
+                WHERE cl.message LIKE ?
+            """
+            params = [f'%{search_term}%']
         
         if sender:
             query += " AND cl.sender = ?"
@@ -340,7 +317,6 @@ class CentralDatabase:
         query += " ORDER BY cl.timestamp DESC LIMIT ?"
         params.append(limit)
         
-        conn = self.get_connection()
         df = pd.read_sql_query(query, conn, params=params)
         conn.close()
         
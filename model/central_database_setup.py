@@ -11,6 +11,19 @@ from datetime import datetime
 import json
 import bcrypt
 
+# Composite indexes behind the filtered, keyset-paginated log endpoints: each
+# serves "WHERE <column> = ? ORDER BY timestamp DESC, id DESC" as a range scan
+LOG_FILTER_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_chat_logs_module_time ON chat_logs(module, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_logs_user_time ON chat_logs(user_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_logs_sender_time ON chat_logs(sender, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_logs_model_time ON chat_logs(ai_model, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_user_interactions_user_time ON user_interactions(user_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_user_interactions_page_time ON user_interactions(page, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_user_interactions_action_time ON user_interactions(action, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_user_interactions_type_time ON user_interactions(interaction_type, timestamp)"
+]
+
 def create_central_database():
     """Create comprehensive SQLite database for all LAILA data"""
     
@@ -77,6 +90,8 @@ def create_central_database():
             ai_model TEXT,
             response_time_sec REAL,
             context TEXT,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
@@ -150,15 +165,40 @@ def create_central_database():
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
-    
+
+    # 9. CACHE VERSIONS TABLE (lets worker processes invalidate in-memory caches)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 10. AI JOBS TABLE (background AI requests and their results, see jobs.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_jobs (
+            job_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            kind TEXT NOT NULL,
+            dedupe_key TEXT,
+            status TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            progress TEXT,
+            owner TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+
     # Create indexes for better performance
     indexes = [
         "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)",
-        "CREATE INDEX IF NOT EXISTS idx_chat_logs_user ON chat_logs(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ai_jobs_dedupe ON ai_jobs(dedupe_key, created_at)",
         "CREATE INDEX IF NOT EXISTS idx_chat_logs_timestamp ON chat_logs(timestamp)",
-        "CREATE INDEX IF NOT EXISTS idx_chat_logs_module ON chat_logs(module)",
-        "CREATE INDEX IF NOT EXISTS idx_user_interactions_user ON user_interactions(user_id)",
         "CREATE INDEX IF NOT EXISTS idx_user_interactions_timestamp ON user_interactions(timestamp)",
+        *LOG_FILTER_INDEXES,
         "CREATE INDEX IF NOT EXISTS idx_user_settings_user ON user_settings(user_id)",
         "CREATE INDEX IF NOT EXISTS idx_system_settings_key ON system_settings(setting_key)"
     ]
@@ -432,6 +472,13 @@ if __name__ == "__main__":
     # Create database
     db_path = create_central_database()
     
+    # Bring a database created by an older version up to date
+    try:
+        from model.schema_migrations import ensure_database_migrated
+    except ImportError:
+        from schema_migrations import ensure_database_migrated
+    ensure_database_migrated(db_path)
+    
     # Migrate all data
     print(f"\n📋 MIGRATING ALL CSV DATA...")
     migrated_counts = migrate_csv_data()
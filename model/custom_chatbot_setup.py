@@ -91,6 +91,27 @@ def add_chatbot_tables():
         )
     ''')
     
+    # 5. CONVERSATION SUMMARIES TABLE (rolling summaries, see conversation_memory.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            conversation_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_through INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            FOREIGN KEY (conversation_id) REFERENCES chatbot_conversations (id)
+        )
+    ''')
+    
+    # 6. CHATBOT USERS TABLE (distinct users per chatbot, see daily_rollups.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chatbot_users (
+            chatbot_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            first_date DATE NOT NULL,
+            PRIMARY KEY (chatbot_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    
     # Create indexes for better performance
     indexes = [
         "CREATE INDEX IF NOT EXISTS idx_chatbots_active ON custom_chatbots(is_active)",
@@ -99,12 +120,21 @@ def add_chatbot_tables():
         "CREATE INDEX IF NOT EXISTS idx_messages_conversation ON chatbot_messages(conversation_id)",
         "CREATE INDEX IF NOT EXISTS idx_messages_chatbot ON chatbot_messages(chatbot_id)",
         "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON chatbot_messages(timestamp)",
-        "CREATE INDEX IF NOT EXISTS idx_analytics_chatbot_date ON chatbot_analytics(chatbot_id, date)"
+        "CREATE INDEX IF NOT EXISTS idx_conversations_started ON chatbot_conversations(started_at)",
+        "CREATE INDEX IF NOT EXISTS idx_analytics_chatbot_date ON chatbot_analytics(chatbot_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_chatbot_users_user ON chatbot_users(user_id)"
     ]
     
     for index in indexes:
         cursor.execute(index)
     
+    # Index chatbot messages for full-text search
+    try:
+        from model.message_search import ensure_message_search
+    except ImportError:
+        from message_search import ensure_message_search
+    ensure_message_search(conn)
+    
     # Insert a default welcome chatbot
     cursor.execute('''
         INSERT OR IGNORE INTO custom_chatbots 
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Daily Rollups for LAILA Platform
+Incrementally aggregates chatbot_messages/chatbot_conversations into
+chatbot_analytics (per chatbot per day) and chat_logs into chat_log_daily
+(per module per day), so admin lists, totals and time series read a few
+rollup rows instead of joining every conversation and message
+"""
+
+import os
+import threading
+import time
+
+try:
+    from model.database import DB_PATH, get_connection, db_connection
+except ImportError:
+    from database import DB_PATH, get_connection, db_connection
+
+# Reads trigger an incremental rollup when the last one is older than this
+ROLLUP_INTERVAL = int(os.getenv('ROLLUP_INTERVAL_SECONDS', 60))
+
+ROLLUP_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS chatbot_analytics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chatbot_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        total_conversations INTEGER DEFAULT 0,
+        total_messages INTEGER DEFAULT 0,
+        unique_users INTEGER DEFAULT 0,
+        avg_conversation_length REAL DEFAULT 0,
+        avg_response_time REAL DEFAULT 0,
+        user_satisfaction_avg REAL DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (chatbot_id) REFERENCES custom_chatbots (id),
+        UNIQUE(chatbot_id, date)
+    )
+    ''',
+    # Distinct users per chatbot, which daily unique_users cannot be summed into
+    '''
+    CREATE TABLE IF NOT EXISTS chatbot_users (
+        chatbot_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        first_date DATE NOT NULL,
+        PRIMARY KEY (chatbot_id, user_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS chat_log_daily (
+        date DATE NOT NULL,
+        module TEXT NOT NULL,
+        total_messages INTEGER NOT NULL,
+        user_messages INTEGER NOT NULL,
+        ai_messages INTEGER NOT NULL,
+        unique_users INTEGER NOT NULL,
+        avg_response_time REAL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        PRIMARY KEY (date, module)
+    ) WITHOUT ROWID
+    ''',
+    # Highest source row id already folded into the rollups
+    '''
+    CREATE TABLE IF NOT EXISTS rollup_watermarks (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_conversations_started ON chatbot_conversations(started_at)",
+    "CREATE INDEX IF NOT EXISTS idx_chatbot_users_user ON chatbot_users(user_id)"
+]
+
+
+class DailyRollups:
+    """Keeps the daily rollup tables up to date with the rows added since the last run
+
+    Each run finds the earliest day touched by new rows and recomputes every
+    rollup row from that day on, so reruns are idempotent and late rows are
+    counted on the day they belong to.
+    """
+
+    def __init__(self, db_path=DB_PATH, interval=ROLLUP_INTERVAL):
+        self.db_path = db_path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self._last_run = 0
+        self.runs = 0
+        self.last_run_sec = None
+
+    def _ensure_schema(self, conn):
+        if not self._schema_ready:
+            for statement in ROLLUP_SCHEMA:
+                conn.execute(statement)
+            self._schema_ready = True
+
+    def refresh_if_stale(self):
+        """Run the rollup if the last run is older than interval; readers never wait on another run"""
+        if time.time() - self._last_run < self.interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if time.time() - self._last_run >= self.interval:
+                self._run()
+        finally:
+            self._lock.release()
+
+    def refresh(self):
+        with self._lock:
+            self._run()
+
+    def _run(self):
+        started = time.time()
+        with db_connection(self.db_path) as conn:
+            self._ensure_schema(conn)
+            self._roll_up_chatbots(conn)
+            self._roll_up_chat_logs(conn)
+        self._last_run = started
+        self.runs += 1
+        self.last_run_sec = round(time.time() - started, 3)
+
+    @staticmethod
+    def _watermark(conn, name):
+        row = conn.execute("SELECT last_id FROM rollup_watermarks WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _set_watermark(conn, name, last_id):
+        conn.execute('''
+            INSERT INTO rollup_watermarks (name, last_id, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                last_id = MAX(last_id, excluded.last_id),
+                updated_at = excluded.updated_at
+        ''', (name, last_id, time.time()))
+
+    def _new_rows(self, conn, table, time_column):
+        """(earliest day among rows added since the watermark, highest id), or (None, None)"""
+        last_id = self._watermark(conn, table)
+        row = conn.execute(f'''
+            SELECT MIN(substr({time_column}, 1, 10)), MAX(id) FROM {table} WHERE id > ?
+        ''', (last_id,)).fetchone()
+        return (row[0], row[1]) if row[1] is not None else (None, None)
+
+    def _roll_up_chatbots(self, conn):
+        message_day, message_high = self._new_rows(conn, 'chatbot_messages', 'timestamp')
+        conversation_day, conversation_high = self._new_rows(conn, 'chatbot_conversations', 'started_at')
+        days = [day for day in (message_day, conversation_day) if day]
+        if not days:
+            return
+        since = min(days)
+
+        daily = {}
+        for chatbot_id, day, messages, users, conversations, response_time, satisfaction in conn.execute('''
+            SELECT chatbot_id, substr(timestamp, 1, 10),
+                   COUNT(*),
+                   COUNT(DISTINCT user_id),
+                   COUNT(DISTINCT conversation_id),
+                   AVG(CASE WHEN sender = 'chatbot' THEN response_time_sec END),
+                   AVG(user_satisfaction)
+            FROM chatbot_messages
+            WHERE timestamp >= ?
+            GROUP BY chatbot_id, substr(timestamp, 1, 10)
+        ''', (since,)):
+            daily[(chatbot_id, day)] = {
+                'total_messages': messages,
+                'unique_users': users,
+                'avg_conversation_length': messages / conversations if conversations else 0,
+                'avg_response_time': response_time,
+                'user_satisfaction_avg': satisfaction
+            }
+        # Conversations count on the day they started
+        for chatbot_id, day, conversations in conn.execute('''
+            SELECT chatbot_id, substr(started_at, 1, 10), COUNT(*)
+            FROM chatbot_conversations
+            WHERE started_at >= ?
+            GROUP BY chatbot_id, substr(started_at, 1, 10)
+        ''', (since,)):
+            daily.setdefault((chatbot_id, day), {})['total_conversations'] = conversations
+
+        conn.execute("DELETE FROM chatbot_analytics WHERE date >= ?", (since,))
+        conn.executemany('''
+            INSERT INTO chatbot_analytics
+            (chatbot_id, date, total_conversations, total_messages, unique_users,
+             avg_conversation_length, avg_response_time, user_satisfaction_avg)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (chatbot_id, day, row.get('total_conversations', 0), row.get('total_messages', 0),
+             row.get('unique_users', 0), row.get('avg_conversation_length', 0),
+             row.get('avg_response_time'), row.get('user_satisfaction_avg'))
+            for (chatbot_id, day), row in daily.items()
+        ])
+
+        if conversation_high is not None:
+            conn.execute('''
+                INSERT OR IGNORE INTO chatbot_users (chatbot_id, user_id, first_date)
+                SELECT chatbot_id, user_id, MIN(substr(started_at, 1, 10))
+                FROM chatbot_conversations
+                WHERE id > ? AND id <= ? AND user_id IS NOT NULL
+                GROUP BY chatbot_id, user_id
+            ''', (self._watermark(conn, 'chatbot_conversations'), conversation_high))
+            self._set_watermark(conn, 'chatbot_conversations', conversation_high)
+        if message_high is not None:
+            self._set_watermark(conn, 'chatbot_messages', message_high)
+
+    def _roll_up_chat_logs(self, conn):
+        since, high = self._new_rows(conn, 'chat_logs', 'timestamp')
+        if high is None:
+            return
+        conn.execute("DELETE FROM chat_log_daily WHERE date >= ?", (since,))
+        conn.execute('''
+            INSERT INTO chat_log_daily
+            (date, module, total_messages, user_messages, ai_messages, unique_users,
+             avg_response_time, prompt_tokens, completion_tokens)
+            SELECT substr(timestamp, 1, 10), COALESCE(module, ''),
+                   COUNT(*),
+                   COUNT(CASE WHEN sender = 'User' THEN 1 END),
+                   COUNT(CASE WHEN sender = 'AI' THEN 1 END),
+                   COUNT(DISTINCT user_id),
+                   AVG(CASE WHEN sender = 'AI' THEN response_time_sec END),
+                   SUM(prompt_tokens),
+                   SUM(completion_tokens)
+            FROM chat_logs
+            WHERE timestamp >= ?
+            GROUP BY substr(timestamp, 1, 10), COALESCE(module, '')
+        ''', (since,))
+        self._set_watermark(conn, 'chat_logs', high)
+
+    def forget_chatbot(self, cursor, chatbot_id):
+        """Delete a chatbot's rollup rows, inside the caller's transaction"""
+        self._ensure_schema(cursor)
+        cursor.execute('DELETE FROM chatbot_analytics WHERE chatbot_id = ?', (chatbot_id,))
+        cursor.execute('DELETE FROM chatbot_users WHERE chatbot_id = ?', (chatbot_id,))
+
+    def chatbot_totals(self):
+        """{chatbot_id: (conversation_count, unique_users)} from the rollups"""
+        self.refresh_if_stale()
+        conn = get_connection(self.db_path)
+        try:
+            self._ensure_schema(conn)
+            totals = {chatbot_id: [conversations, 0] for chatbot_id, conversations in conn.execute(
+                "SELECT chatbot_id, SUM(total_conversations) FROM chatbot_analytics GROUP BY chatbot_id"
+            )}
+            for chatbot_id, users in conn.execute(
+                "SELECT chatbot_id, COUNT(*) FROM chatbot_users GROUP BY chatbot_id"
+            ):
+                totals.setdefault(chatbot_id, [0, 0])[1] = users
+        finally:
+            conn.close()
+        return {chatbot_id: tuple(values) for chatbot_id, values in totals.items()}
+
+    def chatbot_summary(self):
+        """Conversations, messages and distinct users across all chatbots"""
+        self.refresh_if_stale()
+        conn = get_connection(self.db_path)
+        try:
+            self._ensure_schema(conn)
+            conversations, messages = conn.execute(
+                "SELECT SUM(total_conversations), SUM(total_messages) FROM chatbot_analytics"
+            ).fetchone()
+            users = conn.execute("SELECT COUNT(DISTINCT user_id) FROM chatbot_users").fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            'total_conversations': conversations or 0,
+            'total_messages': messages or 0,
+            'unique_users': users
+        }
+
+    def daily_series(self, date_from, chatbot_id=None, module=None):
+        """Per-day rows from date_from ('YYYY-MM-DD') on, for charts"""
+        self.refresh_if_stale()
+        conn = get_connection(self.db_path)
+        try:
+            self._ensure_schema(conn)
+            # unique_users is distinct per chatbot, so summing over chatbots is an upper bound
+            chatbot_sql = '''
+                SELECT date, SUM(total_conversations), SUM(total_messages), SUM(unique_users),
+                       AVG(avg_response_time)
+                FROM chatbot_analytics WHERE date >= ?
+            '''
+            params = [date_from]
+            if chatbot_id is not None:
+                chatbot_sql += " AND chatbot_id = ?"
+                params.append(chatbot_id)
+            chatbots = [{
+                'date': day, 'conversations': conversations, 'messages': messages,
+                'users': users, 'avg_response_time': response_time
+            } for day, conversations, messages, users, response_time in conn.execute(
+                chatbot_sql + " GROUP BY date ORDER BY date", params
+            )]
+
+            chat_log_sql = '''
+                SELECT date, SUM(total_messages), SUM(user_messages), SUM(ai_messages),
+                       SUM(prompt_tokens), SUM(completion_tokens)
+                FROM chat_log_daily WHERE date >= ?
+            '''
+            params = [date_from]
+            if module:
+                chat_log_sql += " AND module = ?"
+                params.append(module)
+            chat_logs = [{
+                'date': day, 'messages': messages, 'user_messages': user_messages,
+                'ai_messages': ai_messages, 'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens
+            } for day, messages, user_messages, ai_messages, prompt_tokens, completion_tokens in conn.execute(
+                chat_log_sql + " GROUP BY date ORDER BY date", params
+            )]
+        finally:
+            conn.close()
+        return {'chatbots': chatbots, 'chat_logs': chat_logs}
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'last_run_at': self._last_run or None,
+            'last_run_sec': self.last_run_sec
+        }
+
+
+# Shared rollups of the central database
+daily_rollups = DailyRollups()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Database Connection Manager for LAILA Platform
+Hands out pooled SQLite connections to the central database with WAL mode
+and tuned pragmas, so readers no longer block writers and requests skip
+connection setup
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = 'db/laila_central.db'
+
+# Seconds a connection waits on a locked database before raising
+BUSY_TIMEOUT = 30
+
+# Maximum idle connections kept per database file
+MAX_IDLE_CONNECTIONS = 16
+
+# Applied to every new connection, in order
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),           # readers and the writer no longer block each other
+    ('synchronous', 'NORMAL'),         # durable in WAL mode without an fsync per commit
+    ('cache_size', -20000),            # ~20 MB page cache (negative values are KiB)
+    ('mmap_size', 268435456),          # 256 MB memory-mapped I/O
+    ('busy_timeout', BUSY_TIMEOUT * 1000),
+    ('temp_store', 'MEMORY'),
+)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool
+
+    Subclassing keeps it a real sqlite3.Connection, so pandas.read_sql_query
+    and existing cursor code work unchanged.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+        self._checked_out = False
+
+    def close(self):
+        if self._pool is None:
+            super().close()
+        elif self._checked_out:
+            self._checked_out = False
+            self._pool._release(self)
+
+    def _close_for_real(self):
+        self._pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """LIFO pool of idle connections to one database file"""
+
+    def __init__(self, db_path=DB_PATH, max_idle=MAX_IDLE_CONNECTIONS):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def _open(self):
+        # Connections move between request threads, but only one uses them at a time
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT,
+            check_same_thread=False,
+            factory=PooledConnection
+        )
+        for name, value in CONNECTION_PRAGMAS:
+            conn.execute(f"PRAGMA {name} = {value}")
+        conn._pool = self
+        return conn
+
+    def connect(self):
+        """Check out a connection, reusing an idle one when available"""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            if conn is not None:
+                self.reused += 1
+        if conn is None:
+            conn = self._open()
+            with self._lock:
+                self.opened += 1
+        conn._checked_out = True
+        return conn
+
+    def _release(self, conn):
+        try:
+            # Match sqlite3's close() semantics: uncommitted work is discarded
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+        except sqlite3.Error:
+            conn._close_for_real()
+            return
+
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn._close_for_real()
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn._close_for_real()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'db_path': self.db_path,
+                'idle': len(self._idle),
+                'max_idle': self.max_idle,
+                'opened': self.opened,
+                'reused': self.reused
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path=DB_PATH):
+    """Get the shared pool for a database file"""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path)
+        return pool
+
+
+def get_connection(db_path=DB_PATH):
+    """Get a pooled connection; call close() to return it to the pool"""
+    return get_pool(db_path).connect()
+
+
+@contextmanager
+def db_connection(db_path=DB_PATH):
+    """Context manager that commits on success, rolls back on error and returns the connection"""
+    conn = get_connection(db_path)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+CACHE_VERSIONS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS cache_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+def get_cache_version(name, db_path=DB_PATH):
+    """Current version of a shared cache (0 if it was never bumped)"""
+    conn = get_connection(db_path)
+    try:
+        conn.execute(CACHE_VERSIONS_SCHEMA)
+        row = conn.execute("SELECT version FROM cache_versions WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+    finally:
+        conn.close()
+
+
+def bump_cache_version(name, db_path=DB_PATH):
+    """Increment a shared cache version so every worker process drops its copy"""
+    with db_connection(db_path) as conn:
+        conn.execute(CACHE_VERSIONS_SCHEMA)
+        conn.execute('''
+            INSERT INTO cache_versions (name, version, updated_at) VALUES (?, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT(name) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        ''', (name,))
+        return conn.execute("SELECT version FROM cache_versions WHERE name = ?", (name,)).fetchone()[0]
+
+
+def get_pool_stats():
+    """Idle/open counters for every pool"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+
+SCHEMA_MIGRATIONS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name TEXT PRIMARY KEY,
+        applied_at REAL NOT NULL
+    )
+'''
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Log Statistics Snapshot for LAILA Platform
+Keeps running totals of chat_logs, user_interactions and user_submissions,
+advanced incrementally from the last row id seen, and serves the admin
+statistics from an in-memory snapshot instead of scanning the tables per request
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    from model.database import DB_PATH, get_connection
+except ImportError:
+    from database import DB_PATH, get_connection
+
+# Snapshots older than this are refreshed in the background on the next read
+REFRESH_INTERVAL = int(os.getenv('LOG_STATS_REFRESH_SECONDS', 30))
+
+# Totals are recomputed from scratch this often, to pick up deleted rows
+REBUILD_INTERVAL = int(os.getenv('LOG_STATS_REBUILD_SECONDS', 3600))
+
+TOP_USERS = 10
+RECENT_DAYS = 7
+
+# Tables whose only statistic is a row count
+COUNTED_TABLES = ('user_interactions', 'user_submissions')
+
+
+class LogStatistics:
+    """Running totals over the log tables, published as an immutable snapshot"""
+
+    def __init__(self, db_path=DB_PATH, refresh_interval=REFRESH_INTERVAL, rebuild_interval=REBUILD_INTERVAL):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+
+        self._refresh_lock = threading.Lock()   # one refresh at a time
+        self._state_lock = threading.Lock()
+        self._totals = None
+        self._snapshot = None
+        self._refreshed_at = 0
+        self._rebuilt_at = 0
+        self._refreshing = False
+
+        self.refreshes = 0
+        self.rebuilds = 0
+        self.last_refresh_sec = None
+
+    @staticmethod
+    def _empty_totals():
+        return {
+            'last_id': 0,
+            'by_module_sender': {},
+            'by_user': {},
+            'by_day': {},
+            'ai_time_sum': 0.0,
+            'ai_time_count': 0,
+            'first_timestamp': None,
+            'last_timestamp': None,
+            'counted': {table: {'last_id': 0, 'rows': 0} for table in COUNTED_TABLES}
+        }
+
+    @staticmethod
+    def _copy_totals(totals):
+        copy = dict(totals)
+        for key in ('by_module_sender', 'by_user', 'by_day'):
+            copy[key] = dict(totals[key])
+        copy['counted'] = {table: dict(counter) for table, counter in totals['counted'].items()}
+        return copy
+
+    def get(self):
+        """Current snapshot; computed synchronously only on the very first read"""
+        with self._state_lock:
+            snapshot = self._snapshot
+            stale = time.time() - self._refreshed_at >= self.refresh_interval
+            start = stale and snapshot is not None and not self._refreshing
+            if start:
+                self._refreshing = True
+        if snapshot is None:
+            self.refresh()
+            with self._state_lock:
+                return self._snapshot
+        if start:
+            threading.Thread(target=self._refresh_in_background, name='laila-log-stats', daemon=True).start()
+        return snapshot
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"⚠️ Log statistics refresh failed: {e}")
+        finally:
+            with self._state_lock:
+                self._refreshing = False
+
+    def request_rebuild(self):
+        """Recompute from scratch on the next refresh (after rows were deleted)"""
+        with self._state_lock:
+            self._rebuilt_at = 0
+            self._refreshed_at = 0
+
+    def refresh(self):
+        """Fold rows added since the last refresh into the totals and publish a new snapshot"""
+        with self._refresh_lock:
+            started = time.time()
+            rebuild = self._totals is None or started - self._rebuilt_at >= self.rebuild_interval
+            # Work on a copy, so a failed refresh leaves the published totals intact
+            totals = self._empty_totals() if rebuild else self._copy_totals(self._totals)
+
+            conn = get_connection(self.db_path)
+            try:
+                self._add_chat_logs(conn, totals)
+                for table in COUNTED_TABLES:
+                    self._add_row_count(conn, table, totals['counted'][table])
+                snapshot = self._build_snapshot(conn, totals)
+            finally:
+                conn.close()
+
+            elapsed = time.time() - started
+            with self._state_lock:
+                self._totals = totals
+                self._snapshot = snapshot
+                self._refreshed_at = started
+                if rebuild:
+                    self._rebuilt_at = started
+                    self.rebuilds += 1
+                self.refreshes += 1
+                self.last_refresh_sec = round(elapsed, 3)
+            if rebuild:
+                print(f"📊 Rebuilt log statistics in {elapsed:.2f}s")
+
+    def _add_chat_logs(self, conn, totals):
+        """One grouped pass over the chat_logs rows added since last_id"""
+        high = conn.execute("SELECT MAX(id) FROM chat_logs").fetchone()[0] or 0
+        if high <= totals['last_id']:
+            return
+        rows = conn.execute('''
+            SELECT module, sender, user_id, substr(timestamp, 1, 10),
+                   COUNT(*),
+                   SUM(CASE WHEN sender = 'AI' THEN response_time_sec END),
+                   COUNT(CASE WHEN sender = 'AI' THEN response_time_sec END),
+                   MIN(timestamp), MAX(timestamp)
+            FROM chat_logs
+            WHERE id > ? AND id <= ?
+            GROUP BY module, sender, user_id, substr(timestamp, 1, 10)
+        ''', (totals['last_id'], high)).fetchall()
+
+        for module, sender, user_id, day, count, time_sum, time_count, first, last in rows:
+            key = (module, sender)
+            totals['by_module_sender'][key] = totals['by_module_sender'].get(key, 0) + count
+            if user_id is not None:
+                totals['by_user'][user_id] = totals['by_user'].get(user_id, 0) + count
+            totals['by_day'][day] = totals['by_day'].get(day, 0) + count
+            totals['ai_time_sum'] += time_sum or 0.0
+            totals['ai_time_count'] += time_count
+            if first is not None and (totals['first_timestamp'] is None or first < totals['first_timestamp']):
+                totals['first_timestamp'] = first
+            if last is not None and (totals['last_timestamp'] is None or last > totals['last_timestamp']):
+                totals['last_timestamp'] = last
+        totals['last_id'] = high
+
+    @staticmethod
+    def _add_row_count(conn, table, counter):
+        rows, high = conn.execute(
+            f"SELECT COUNT(*), MAX(id) FROM {table} WHERE id > ?", (counter['last_id'],)
+        ).fetchone()
+        counter['rows'] += rows
+        if high is not None:
+            counter['last_id'] = high
+
+    @staticmethod
+    def _build_snapshot(conn, totals):
+        """Everything both statistics endpoints return, derived from the totals"""
+        by_module = {}
+        by_sender = {}
+        for (module, sender), count in totals['by_module_sender'].items():
+            by_module[module] = by_module.get(module, 0) + count
+            by_sender[sender] = by_sender.get(sender, 0) + count
+        total_messages = sum(by_module.values())
+
+        # Emails are looked up for the busiest users only
+        ranked = sorted(totals['by_user'].items(), key=lambda item: item[1], reverse=True)
+        top_users = {}
+        most_active_user = 'N/A'
+        for start in range(0, len(ranked), 500):
+            page = ranked[start:start + 500]
+            emails = dict(conn.execute(
+                f"SELECT id, email FROM users WHERE id IN ({', '.join('?' for _ in page)})",
+                [user_id for user_id, _ in page]
+            ).fetchall())
+            for user_id, count in page:
+                if user_id in emails and len(top_users) < TOP_USERS:
+                    top_users[emails[user_id]] = count
+            if len(top_users) >= TOP_USERS:
+                break
+        if top_users:
+            most_active_user = next(iter(top_users))
+        if len(top_users) < TOP_USERS:
+            # Users without messages fill the list, as in the LEFT JOIN it replaces
+            for (email,) in conn.execute("SELECT email FROM users ORDER BY id").fetchall():
+                if len(top_users) >= TOP_USERS:
+                    break
+                top_users.setdefault(email, 0)
+
+        week_ago = (datetime.now() - timedelta(days=RECENT_DAYS)).strftime('%Y-%m-%d')
+        avg_response = totals['ai_time_sum'] / totals['ai_time_count'] if totals['ai_time_count'] else 0
+
+        return {
+            'total_users': conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+            'chat_users': len(totals['by_user']),
+            'total_messages': total_messages,
+            'by_sender': by_sender,
+            'by_module': dict(sorted(by_module.items(), key=lambda item: item[1], reverse=True)),
+            'top_users': top_users,
+            'most_active_user': most_active_user,
+            'date_range': {'from': totals['first_timestamp'], 'to': totals['last_timestamp']},
+            'recent_messages': sum(count for day, count in totals['by_day'].items() if day and day >= week_ago),
+            'avg_response_time': avg_response,
+            'total_interactions': totals['counted']['user_interactions']['rows'],
+            'total_submissions': totals['counted']['user_submissions']['rows'],
+            'as_of': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+    def stats(self):
+        with self._state_lock:
+            return {
+                'refreshes': self.refreshes,
+                'rebuilds': self.rebuilds,
+                'last_refresh_sec': self.last_refresh_sec,
+                'refreshed_at': self._refreshed_at or None,
+                'refreshing': self._refreshing
+            }
+
+
+_statistics = {}
+_statistics_lock = threading.Lock()
+
+
+def get_log_statistics(db_path=DB_PATH):
+    """Shared LogStatistics for a database file"""
+    with _statistics_lock:
+        statistics = _statistics.get(db_path)
+        if statistics is None:
+            statistics = _statistics[db_path] = LogStatistics(db_path)
+        return statistics
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Background Log Writer for LAILA Platform
+Moves chat_logs and user_interactions inserts off the request thread and
+writes them to the central database in batched transactions
+"""
+
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from model.database import get_connection
+from model.schema_migrations import ensure_database_migrated
+
+# Columns accepted for each log table, in insert order
+LOG_TABLE_COLUMNS = {
+    'chat_logs': (
+        'user_id', 'session_id', 'timestamp', 'module', 'sender', 'turn',
+        'message', 'ai_model', 'response_time_sec', 'context',
+        'prompt_tokens', 'completion_tokens'
+    ),
+    'user_interactions': (
+        'user_id', 'interaction_type', 'page', 'action', 'element_id',
+        'element_type', 'element_value', 'timestamp', 'additional_data'
+    )
+}
+
+DEFAULT_MAX_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 1.0  # seconds
+WRITE_RETRIES = 5
+
+
+class LogWriter:
+    """Bounded in-memory queue drained by a single writer thread"""
+
+    def __init__(self, db_path='db/laila_central.db', max_queue_size=DEFAULT_MAX_QUEUE_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_at = None
+
+    def _ensure_started(self):
+        """Start the writer thread on first use so importing this module has no side effects"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='laila-log-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, table, row):
+        """Queue one row (a dict keyed by column name) without blocking the caller"""
+        if table not in LOG_TABLE_COLUMNS:
+            raise ValueError(f"Unknown log table: {table}")
+
+        self._ensure_started()
+        values = tuple(row.get(column) for column in LOG_TABLE_COLUMNS[table])
+        try:
+            self._queue.put_nowait((table, values))
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+                dropped = self.dropped
+            # Warn on the first drop and then periodically, not once per row
+            if dropped == 1 or dropped % 100 == 0:
+                print(f"⚠️ Log queue full, {dropped} rows dropped so far")
+            return False
+
+        with self._stats_lock:
+            self.enqueued += 1
+        return True
+
+    def _run(self):
+        conn = None
+        while True:
+            batch = self._next_batch()
+            if batch:
+                if conn is None:
+                    conn = self._connect_for(batch)
+                    if conn is None:
+                        continue
+                self._write(conn, batch)
+            elif self._stop.is_set():
+                break
+
+        if conn is not None:
+            conn.close()
+
+    def _next_batch(self):
+        """Collect up to batch_size rows, waiting at most flush_interval for the batch to fill"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _connect_for(self, batch):
+        """Open the writer's connection, retrying while it fails; on giving up the batch is dropped
+
+        An exception here must not kill the writer thread: the batch would be
+        lost without task_done() and flush() would wait forever.
+        """
+        for attempt in range(WRITE_RETRIES):
+            try:
+                return self._connect()
+            except Exception as e:
+                if attempt < WRITE_RETRIES - 1:
+                    print(f"⚠️ Log writer could not open the database ({e}), retrying")
+                    time.sleep(0.1 * (2 ** attempt))
+                    continue
+                self._record_failure(batch, e)
+        for _ in batch:
+            self._queue.task_done()
+        return None
+
+    def _connect(self):
+        if not os.path.exists(self.db_path):
+            from model.central_database_setup import create_central_database
+            create_central_database()
+        ensure_database_migrated(self.db_path)
+        # Held for the life of the writer thread, so it never goes back to the pool
+        return get_connection(self.db_path)
+
+    def _write(self, conn, batch):
+        """Insert a batch in one transaction, retrying while the database is locked"""
+        rows_by_table = {}
+        for table, values in batch:
+            rows_by_table.setdefault(table, []).append(values)
+
+        for attempt in range(WRITE_RETRIES):
+            try:
+                with conn:
+                    for table, rows in rows_by_table.items():
+                        columns = LOG_TABLE_COLUMNS[table]
+                        placeholders = ', '.join('?' for _ in columns)
+                        conn.executemany(
+                            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                            rows
+                        )
+                with self._stats_lock:
+                    self.written += len(batch)
+                    self.batches += 1
+                    self.last_flush_at = time.time()
+                break
+            except sqlite3.OperationalError as e:
+                if 'locked' in str(e) and attempt < WRITE_RETRIES - 1:
+                    time.sleep(0.1 * (2 ** attempt))
+                    continue
+                self._record_failure(batch, e)
+                break
+            except Exception as e:
+                self._record_failure(batch, e)
+                break
+
+        for _ in batch:
+            self._queue.task_done()
+
+    def _record_failure(self, batch, error):
+        with self._stats_lock:
+            self.failed += len(batch)
+        print(f"❌ Error writing {len(batch)} log rows: {error}")
+
+    def flush(self, timeout=10):
+        """Block until every queued row has been written (or timeout expires)"""
+        if self._thread is None:
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout=10):
+        """Drain the queue and stop the writer thread"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"⚠️ Log writer did not drain in {timeout}s, {self._queue.qsize()} rows pending")
+
+    def stats(self):
+        """Queue depth and write/drop counters"""
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_size': self.max_queue_size,
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'batches': self.batches,
+                'last_flush_at': self.last_flush_at,
+                'running': self._thread is not None and self._thread.is_alive()
+            }
+
+
+# Shared writer used by the app's logging helpers
+log_writer = LogWriter()
+atexit.register(log_writer.close)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Full-Text Message Search for LAILA Platform
+An FTS5 index over chat_logs and chatbot_messages, kept in sync by triggers,
+so keyword searches are ranked index lookups instead of LIKE table scans
+"""
+
+import re
+import sqlite3
+import time
+
+try:
+    from model.database import SCHEMA_MIGRATIONS_SCHEMA
+except ImportError:
+    from database import SCHEMA_MIGRATIONS_SCHEMA
+
+# Index rowids interleave the sources: rowid = id * 2 + offset
+SEARCH_SOURCES = {
+    'chat_logs': {
+        'offset': 0,
+        'module': 'new.module',
+        'chatbot_id': 'NULL'
+    },
+    'chatbot_messages': {
+        'offset': 1,
+        'module': "'Chatbot'",
+        'chatbot_id': 'new.chatbot_id'
+    }
+}
+
+# Porter stemming so "regressions" finds "regression"
+MESSAGE_SEARCH_SCHEMA = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+        message,
+        source UNINDEXED,
+        module UNINDEXED,
+        sender UNINDEXED,
+        user_id UNINDEXED,
+        chatbot_id UNINDEXED,
+        timestamp UNINDEXED,
+        tokenize = 'porter unicode61 remove_diacritics 2'
+    )
+'''
+
+# Source rows indexed per transaction when an existing table is first indexed
+BACKFILL_BATCH_SIZE = 5000
+
+SEARCH_PAGE_SIZE = 50
+SEARCH_PAGE_MAX = 200
+
+# Marks around matched terms in snippets (markdown bold, rendered by the chat views)
+SNIPPET_OPEN = '**'
+SNIPPET_CLOSE = '**'
+SNIPPET_TOKENS = 16
+
+
+def fts5_available(conn):
+    """True if this SQLite build includes FTS5"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def _index_values(source):
+    settings = SEARCH_SOURCES[source]
+    return (f"new.id * 2 + {settings['offset']}, new.message, '{source}', {settings['module']}, "
+            f"new.sender, new.user_id, {settings['chatbot_id']}, new.timestamp")
+
+
+def _triggers(source):
+    offset = SEARCH_SOURCES[source]['offset']
+    insert = (f"INSERT INTO message_search (rowid, message, source, module, sender, user_id, chatbot_id, timestamp) "
+              f"VALUES ({_index_values(source)});")
+    delete = f"DELETE FROM message_search WHERE rowid = old.id * 2 + {offset};"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {source}_search_insert AFTER INSERT ON {source} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {source}_search_delete AFTER DELETE ON {source} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {source}_search_update AFTER UPDATE ON {source} BEGIN {delete} {insert} END"
+    ]
+
+
+def ensure_message_search(conn, batch_size=BACKFILL_BATCH_SIZE):
+    """Create the index and its triggers, and index existing rows of each source once
+
+    Commits as it goes: the schema first, then the backfill one batch of
+    rows at a time, so the write lock is never held for a whole table.
+    Returns False when SQLite lacks FTS5, in which case searches fall back
+    to LIKE.
+    """
+    if not fts5_available(conn):
+        print("⚠️ SQLite was built without FTS5, message search will use LIKE scans")
+        return False
+
+    with conn:
+        conn.execute(MESSAGE_SEARCH_SCHEMA)
+        conn.execute(SCHEMA_MIGRATIONS_SCHEMA)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        sources = [source for source in SEARCH_SOURCES if source in tables]  # chatbot tables come from custom_chatbot_setup.py
+        for source in sources:
+            for trigger in _triggers(source):
+                conn.execute(trigger)
+
+    for source in sources:
+        name = f'message_search_{source}'
+        if conn.execute("SELECT 1 FROM schema_migrations WHERE name = ?", (name,)).fetchone():
+            continue
+        # Rows written from here on are indexed by the triggers; REPLACE makes a rerun after an interruption harmless
+        values = _index_values(source).replace('new.', '')
+        high = conn.execute(f"SELECT MAX(id) FROM {source}").fetchone()[0] or 0
+        for low in range(0, high, batch_size):
+            with conn:
+                conn.execute(f'''
+                    INSERT OR REPLACE INTO message_search (rowid, message, source, module, sender, user_id, chatbot_id, timestamp)
+                    SELECT {values} FROM {source} WHERE id > ? AND id <= ? AND message IS NOT NULL
+                ''', (low, low + batch_size))
+        with conn:
+            conn.execute('INSERT INTO schema_migrations (name, applied_at) VALUES (?, ?)', (name, time.time()))
+        print(f"🔎 Indexed existing {source} rows for message search")
+    return True
+
+
+def message_search_ready(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'message_search'"
+    ).fetchone() is not None
+
+
+def build_match_query(text):
+    """FTS5 MATCH expression for a user's search box text
+
+    Words and "quoted phrases" must all occur; a trailing * makes a word a
+    prefix. Everything is quoted, so FTS5 operators in the text are literal.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text or ''):
+        term = phrase if phrase else word
+        prefix = not phrase and term.endswith('*')
+        term = term.rstrip('*') if prefix else term
+        if not re.search(r'\w', term):
+            continue
+        terms.append('"' + term.replace('"', '""') + '"' + ('*' if prefix else ''))
+    if not terms:
+        raise ValueError('Search query must contain at least one word')
+    return ' '.join(terms)
+
+
+def search_messages(conn, query, module=None, sender=None, user_id=None, chatbot_id=None,
+                    source=None, date_from=None, date_to=None, limit=SEARCH_PAGE_SIZE, offset=0):
+    """Best-matching messages first (BM25), each with a highlighted snippet
+
+    date_from and date_to are 'YYYY-MM-DD' strings; date_to is exclusive.
+    Raises ValueError for an empty query or unknown source.
+    """
+    if source and source not in SEARCH_SOURCES:
+        raise ValueError(f'Unknown source: {source}')
+
+    where = ['message_search MATCH ?']
+    params = [build_match_query(query)]
+    for column, value in (('source', source), ('module', module), ('sender', sender),
+                          ('user_id', user_id), ('chatbot_id', chatbot_id)):
+        if value is not None and value != '':
+            where.append(f'{column} = ?')
+            params.append(value)
+    if date_from:
+        where.append('timestamp >= ?')
+        params.append(date_from)
+    if date_to:
+        where.append('timestamp < ?')
+        params.append(date_to)
+
+    rows = conn.execute(f'''
+        SELECT rowid, source, module, sender, user_id, chatbot_id, timestamp, message,
+               snippet(message_search, 0, ?, ?, ' … ', ?),
+               rank
+        FROM message_search
+        WHERE {' AND '.join(where)}
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+    ''', (SNIPPET_OPEN, SNIPPET_CLOSE, SNIPPET_TOKENS, *params,
+          min(max(int(limit), 1), SEARCH_PAGE_MAX), max(int(offset), 0))).fetchall()
+
+    return [{
+        'id': rowid // 2,
+        'source': row_source,
+        'module': row_module,
+        'sender': row_sender,
+        'user_id': row_user_id,
+        'chatbot_id': row_chatbot_id,
+        'timestamp': timestamp,
+        'message': message,
+        'snippet': snippet,
+        'score': -score  # bm25() is lower for better matches
+    } for rowid, row_source, row_module, row_sender, row_user_id, row_chatbot_id,
+          timestamp, message, snippet, score in rows]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Schema Migrations for LAILA Platform
+Brings a central database created by an older version up to date: columns
+and indexes added to existing tables since their first release, and
+one-time data migrations recorded in schema_migrations, and the message
+search index. New databases get the full schema from central_database_setup.py.
+"""
+
+import ast
+import json
+import os
+import threading
+import time
+
+try:
+    from model.database import DB_PATH, get_connection, SCHEMA_MIGRATIONS_SCHEMA
+except ImportError:
+    from database import DB_PATH, get_connection, SCHEMA_MIGRATIONS_SCHEMA
+
+# Columns added after a table was first released: created on databases that predate them
+LOG_TABLE_MIGRATIONS = {
+    'chat_logs': {'prompt_tokens': 'INTEGER', 'completion_tokens': 'INTEGER'}
+}
+
+
+def legacy_additional_data_to_json(text):
+    """JSON for an additional_data value that older versions stored as a Python repr"""
+    try:
+        json.loads(text)
+        return text
+    except ValueError:
+        pass
+    try:
+        return json.dumps(ast.literal_eval(text), ensure_ascii=False, default=str)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        # Unparseable text is kept as a JSON string rather than dropped
+        return json.dumps(text, ensure_ascii=False)
+
+
+def migrate_additional_data_to_json(conn, batch_size=1000):
+    """Rewrite user_interactions.additional_data as canonical JSON, in id order, committing each batch"""
+    last_id = 0
+    converted = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, additional_data FROM user_interactions
+            WHERE id > ? AND additional_data IS NOT NULL
+            ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for row_id, text in rows:
+            value = legacy_additional_data_to_json(text)
+            if value != text:
+                updates.append((value, row_id))
+        with conn:
+            conn.executemany('UPDATE user_interactions SET additional_data = ? WHERE id = ?', updates)
+        converted += len(updates)
+    print(f"🔧 Converted {converted} user_interactions.additional_data values to JSON")
+
+
+# One-time data migrations, recorded in schema_migrations once applied
+LOG_DATA_MIGRATIONS = [
+    ('user_interactions_additional_data_json', migrate_additional_data_to_json)
+]
+
+
+def table_exists(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def migrate_database(conn):
+    """Add missing LOG_TABLE_MIGRATIONS columns and log indexes, run pending LOG_DATA_MIGRATIONS and set up message search
+
+    Schema changes share one short transaction; data migrations and the
+    search backfill commit batch by batch, so other processes can keep
+    writing while a large table is converted.
+    """
+    try:
+        from model.central_database_setup import LOG_FILTER_INDEXES
+        from model.message_search import ensure_message_search
+    except ImportError:
+        from central_database_setup import LOG_FILTER_INDEXES
+        from message_search import ensure_message_search
+
+    with conn:
+        for table, columns in LOG_TABLE_MIGRATIONS.items():
+            existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+                    print(f"🔧 Added {table}.{column}")
+        # Indexes added for the log endpoints' filters
+        for index in LOG_FILTER_INDEXES:
+            conn.execute(index)
+        conn.execute(SCHEMA_MIGRATIONS_SCHEMA)
+
+    applied = {row[0] for row in conn.execute('SELECT name FROM schema_migrations')}
+    for name, migration in LOG_DATA_MIGRATIONS:
+        if name not in applied:
+            # Migrations are idempotent, so one interrupted before it is recorded simply runs again
+            migration(conn)
+            with conn:
+                conn.execute('INSERT INTO schema_migrations (name, applied_at) VALUES (?, ?)', (name, time.time()))
+
+    # Full-text index over the chat tables (model/message_search.py)
+    ensure_message_search(conn)
+
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def ensure_database_migrated(db_path=DB_PATH):
+    """Run migrate_database once per process, as soon as the database exists
+
+    Never creates the database file: returns False (and runs again on the
+    next call) until central_database_setup.py has created the log tables.
+    """
+    if db_path in _migrated:
+        return True
+    with _migrate_lock:
+        if db_path in _migrated:
+            return True
+        if not os.path.exists(db_path):
+            return False
+        conn = get_connection(db_path)
+        try:
+            if not table_exists(conn, 'chat_logs'):
+                return False
+            migrate_database(conn)
+        finally:
+            conn.close()
+        _migrated.add(db_path)
+        return True
+
+
+if __name__ == "__main__":
+    print("🔧 LAILA SCHEMA MIGRATIONS")
+    print("=" * 50)
+    if ensure_database_migrated():
+        print(f"✅ {DB_PATH} is up to date")
+    else:
+        print(f"❌ {DB_PATH} does not exist yet, run central_database_setup.py first")
@@ -3,7 +3,7 @@ from setuptools import setup
 setup(
     name='LAILA',
 
-    py_modules=["app","config","API_Settings","wsgi"],  # Only include your main script/module
+    py_modules=["app","config","API_Settings","wsgi","asgi","ai_clients","caching","ai_cache","ai_resilience","jobs","data_summary","chunking","token_budget","conversation_memory"],  # Only include your main script/module
     packages=["model","views","static/css","static/js","db","prompts"],
     install_requires=open("requirements.txt").read().splitlines(),
     include_package_data=True,
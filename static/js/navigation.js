@@ -78,23 +78,142 @@ function goToAdmin() {
     window.location.href = '/admin';
 }
 
+// Buffered interaction logging.
+// Events are coalesced client-side and posted to the batch endpoint, either
+// periodically, when the buffer fills up, or via sendBeacon when the page is hidden.
+const INTERACTION_BATCH_URL = '/api/log-interactions/batch';
+const INTERACTION_FLUSH_INTERVAL_MS = 5000;
+const INTERACTION_MAX_BUFFER = 20;
+let interactionBuffer = [];
+let interactionFlushTimer = null;
+
+function queueInteraction(event) {
+    interactionBuffer.push({
+        ...event,
+        timestamp: event.timestamp || new Date().toISOString()
+    });
+
+    if (interactionBuffer.length >= INTERACTION_MAX_BUFFER) {
+        flushInteractions();
+    } else if (!interactionFlushTimer) {
+        interactionFlushTimer = setTimeout(flushInteractions, INTERACTION_FLUSH_INTERVAL_MS);
+    }
+}
+
+function flushInteractions(useBeacon = false) {
+    if (interactionFlushTimer) {
+        clearTimeout(interactionFlushTimer);
+        interactionFlushTimer = null;
+    }
+    if (interactionBuffer.length === 0) return;
+
+    const events = interactionBuffer;
+    interactionBuffer = [];
+    const body = JSON.stringify({ events: events });
+
+    // sendBeacon survives page unload; fall back to a keepalive fetch if it is refused
+    if (useBeacon && navigator.sendBeacon && navigator.sendBeacon(INTERACTION_BATCH_URL, body)) {
+        return;
+    }
+
+    fetch(INTERACTION_BATCH_URL, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: body,
+        keepalive: useBeacon
+    }).catch(error => console.error('Error logging interactions:', error));
+}
+
+window.addEventListener('pagehide', () => flushInteractions(true));
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') {
+        flushInteractions(true);
+    }
+});
+
 // Log interaction helper
 function logInteraction(action, page, elementId = null, elementType = null, elementValue = null) {
-    fetch('/api/log-interaction', {
+    queueInteraction({
+        action: action,
+        page: page,
+        element_id: elementId,
+        element_type: elementType,
+        element_value: elementValue,
+        interaction_type: 'user_click'
+    });
+}
+
+// Stream a chat response over server-sent events.
+// onToken receives the text assembled so far; resolves with the final 'done' payload.
+// A reply the AI service cut off comes back with truncated: true and a note appended.
+async function streamChat(url, payload, onToken) {
+    const response = await fetch(url, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
+            'Accept': 'text/event-stream'
         },
-        body: JSON.stringify({
-            action: action,
-            page: page,
-            element_id: elementId,
-            element_type: elementType,
-            element_value: elementValue,
-            interaction_type: 'user_click',
-            timestamp: new Date().toISOString()
-        })
-    }).catch(error => console.error('Error logging interaction:', error));
+        body: JSON.stringify({ ...payload, stream: true })
+    });
+    if (!response.ok) throw new Error(`Request failed with status ${response.status}`);
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+    let finalPayload = null;
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Events are separated by a blank line; keep any partial event for the next read
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const event of events) {
+            if (!event.startsWith('data: ')) continue;
+            const data = JSON.parse(event.slice(6));
+            if (data.type === 'token') {
+                text += data.content;
+                if (onToken) onToken(text);
+            } else if (data.type === 'done') {
+                if (data.truncated) {
+                    data.response = `${data.response}\n\n*(${data.error})*`;
+                }
+                finalPayload = data;
+            }
+        }
+    }
+    
+    return finalPayload || { response: text, status: 'success' };
+}
+
+// Run a long AI request as a background job and poll until it finishes.
+// Resolves with the endpoint's usual response payload.
+const AI_JOB_POLL_INTERVAL_MS = 2000;
+
+async function runAiJob(url, payload, onProgress) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ ...payload, background: true })
+    });
+    const submitted = await response.json();
+    // Endpoints answer inline when they don't run the request as a job
+    if (response.status !== 202) return submitted;
+
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, AI_JOB_POLL_INTERVAL_MS));
+        const job = await (await fetch(submitted.status_url)).json();
+        if (!job.success) throw new Error(job.error || 'Job not found');
+        if (job.status === 'done') return job.result;
+        if (job.status === 'failed') throw new Error(job.error || 'Job failed');
+        // e.g. {stage: 'map', done: 3, total: 8} while a large input is interpreted in parts
+        if (onProgress && job.progress) onProgress(job.progress);
+    }
 }
 
 // Initialize navigation when DOM is loaded
@@ -0,0 +1,153 @@
+# =============================================================================
+# TOKEN COUNTING AND BUDGETS - LAILA Platform
+# =============================================================================
+# Token counts for prompts, history and responses. OpenAI models are counted
+# with tiktoken when it is installed; everything else uses a per-provider
+# characters-per-token ratio. Counts feed the per-model prompt budgets in
+# API_Settings.py and the prompt/completion columns of chat_logs.
+
+import contextvars
+import threading
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# =============================================================================
+# TOKENIZER SETTINGS
+# =============================================================================
+
+# Average characters per token on English prose (provider documentation);
+# used when no offline tokenizer is available for the model
+CHARS_PER_TOKEN = {
+    'openai': 4.0,
+    'google': 4.0
+}
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+# Never trim a prompt below this many tokens, even if the system prompt is huge
+MIN_PROMPT_TOKENS = 256
+
+TRUNCATION_MARKER = "\n\n[... {omitted} tokens omitted to fit the model's context ...]\n\n"
+
+
+@lru_cache(maxsize=16)
+def _encoding(model):
+    """tiktoken encoding for an OpenAI model, or None"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Models newer than the installed tiktoken use the current encoding
+        return tiktoken.get_encoding('o200k_base')
+    except Exception as e:
+        print(f"⚠️ tiktoken unavailable for {model}: {e}")
+        return None
+
+
+def count_tokens(text, service=None, model=None):
+    """Number of tokens text takes for the given provider/model"""
+    if not text:
+        return 0
+    if service == 'openai' and model:
+        encoding = _encoding(model)
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+    return int(len(text) / CHARS_PER_TOKEN.get(service, DEFAULT_CHARS_PER_TOKEN)) + 1
+
+
+def truncate_to_tokens(text, max_tokens, service=None, model=None):
+    """Cut the middle out of text so it fits max_tokens, keeping its start and end"""
+    tokens = count_tokens(text, service, model)
+    if tokens <= max_tokens:
+        return text
+
+    keep = len(text) * max_tokens // tokens
+    while keep > 0:
+        head = text[:keep * 2 // 3]
+        tail = text[len(text) - keep // 3:]
+        trimmed = head + TRUNCATION_MARKER.format(omitted=tokens - max_tokens) + tail
+        if count_tokens(trimmed, service, model) <= max_tokens:
+            return trimmed
+        keep = keep * 9 // 10
+    return ''
+
+
+def fit_prompt(prompt, system_prompt, budget, service=None, model=None):
+    """Trim prompt so that it and the system prompt together fit within budget tokens"""
+    available = max(MIN_PROMPT_TOKENS, budget - count_tokens(system_prompt, service, model))
+    tokens = count_tokens(prompt, service, model)
+    if tokens <= available:
+        return prompt
+    print(f"✂️ Prompt of {tokens} tokens exceeds the {budget}-token budget of {service}/{model}, trimming")
+    return truncate_to_tokens(prompt, available, service, model)
+
+
+def trim_history(turns, budget, service=None, model=None):
+    """The most recent turns (strings, oldest first) that fit in budget tokens together"""
+    kept = []
+    used = 0
+    for turn in reversed(turns):
+        used += count_tokens(turn, service, model)
+        if used > budget:
+            break
+        kept.append(turn)
+    kept.reverse()
+    return kept
+
+# =============================================================================
+# PER-REQUEST USAGE
+# =============================================================================
+# make_ai_call and the streaming calls add to the meter of the current request
+# (or background job); log_chat_interaction takes the totals for the AI row.
+
+
+class TokenUsage:
+    """Prompt/completion tokens spent by the provider calls of one request"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+
+    def add(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.calls += 1
+
+    def take(self):
+        """(prompt_tokens, completion_tokens) since the last take, or (None, None) if no calls were made"""
+        with self._lock:
+            if not self.calls:
+                return None, None
+            totals = (self.prompt_tokens, self.completion_tokens)
+            self.prompt_tokens = self.completion_tokens = self.calls = 0
+            return totals
+
+
+_current_usage = contextvars.ContextVar('laila_token_usage', default=None)
+
+
+def start_usage():
+    """Give the current request (or job) a fresh usage meter"""
+    usage = TokenUsage()
+    _current_usage.set(usage)
+    return usage
+
+
+def record_usage(prompt_tokens, completion_tokens):
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add(prompt_tokens, completion_tokens)
+
+
+def take_usage():
+    usage = _current_usage.get()
+    if usage is None:
+        return None, None
+    return usage.take()